@@ -0,0 +1,9 @@
+"""Benchmarks of Kart.
+
+* ``python -m benchmarks.suite`` generates a synthetic site and times the builds,
+  the updates of the dev server and its requests, see ``benchmarks/suite.py``
+* ``python -m benchmarks.synthetic path`` only generates the synthetic site
+* ``python -m benchmarks.memory`` measures the memory used by the site and the map
+* ``python -m benchmarks.routing`` times the resolution of the urls of the dev server
+* ``python -m benchmarks.import_time`` checks the import time of kart against a budget
+"""
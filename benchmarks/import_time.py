@@ -0,0 +1,97 @@
+"""Measures with ``python -X importtime`` the time needed to import kart like the
+``main.py`` of a site does, and checks it against a budget.
+
+The dependencies used only by the development server or by some renderers must
+not be imported, so that ``main.py build`` pays only for what it uses.
+
+Usage: python -m benchmarks.import_time [--budget 150] [--repeat 5] [--top 10]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+STATEMENT = "from kart import Kart, mappers, miners, modifiers, renderers"
+
+# imported only when they are needed
+LAZY_MODULES = (
+    "watchdog",
+    "http.server",
+    "pygments",
+    "dateutil",
+    "multiprocessing",
+    "concurrent.futures",
+    "sqlite3",
+)
+
+
+def import_times(statement: str) -> dict:
+    """Runs ``statement`` in a new interpreter, returning the self time
+    in microseconds of each imported module"""
+    environment = {**os.environ, "PYTHONPATH": str(ROOT)}
+    # the bytecode of kart must be cached, like it is after the first build
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        env=environment,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, _, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(self_time)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--statement", default=STATEMENT)
+    parser.add_argument("--budget", type=float, default=150, help="in milliseconds")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    # the modules imported by the interpreter at startup are not counted
+    startup = import_times("pass")
+    import_times(args.statement)
+    runs = []
+    for _ in range(args.repeat):
+        times = import_times(args.statement)
+        runs.append({x: y for x, y in times.items() if x not in startup})
+    totals = [sum(x.values()) / 1000 for x in runs]
+    total = statistics.median(totals)
+
+    median_run = min(runs, key=lambda x: abs(sum(x.values()) / 1000 - total))
+    packages = {}
+    for name, time in median_run.items():
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + time
+    print(f"{args.statement}: {total:.1f} ms (budget {args.budget:.0f} ms)")
+    slowest = sorted(packages.items(), key=lambda x: x[1], reverse=True)
+    for package, time in slowest[: args.top]:
+        print(f"{package:>24}: {time / 1000:8.1f} ms")
+
+    failed = False
+    imported = [
+        x for x in LAZY_MODULES if any(y == x or y.startswith(x + ".") for y in runs[0])
+    ]
+    if imported:
+        print(f"Modules that should be imported lazily: {', '.join(imported)}")
+        failed = True
+    if total > args.budget:
+        print(f"Import time over budget by {total - args.budget:.1f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
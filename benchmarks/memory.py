@@ -0,0 +1,61 @@
+"""Measures with tracemalloc the memory used by the site and the map of a large
+blog, created by the default miners' data structures and mappers.
+
+Usage: python -m benchmarks.memory [number of posts]
+"""
+
+import sys
+import tracemalloc
+from datetime import date, timedelta
+
+from kart import Kart, mappers, modifiers
+from kart.utils import KartDict
+
+
+def create_site(count: int, tags: int = 100) -> dict:
+    """Creates the data of a blog like DefaultCollectionMiner and DefaultTaxonomyMiner"""
+    posts = KartDict()
+    for i in range(count):
+        posts[f"post{i}"] = {
+            "title": f"Post {i}",
+            "date": date(2015, 1, 1) + timedelta(days=i % 3650),
+            "tags": [f"tag{i % tags}", f"tag{(i * 7) % tags}"],
+            "content": f"# Post {i}\n\n" + "Some content of the post. " * 40,
+            "slug": f"post{i}",
+        }
+    taxonomy = KartDict()
+    for i in range(tags):
+        taxonomy[f"tag{i}"] = {"name": f"Tag {i}", "slug": f"tag{i}"}
+    return {"posts": posts, "tags": taxonomy}
+
+
+def main(count: int = 100000):
+    kart = Kart(
+        content_modifiers=[modifiers.TaxonomyIndexer("posts", "tags")],
+        mappers=[
+            mappers.DefaultIndexMapper(collection="posts"),
+            mappers.DefaultTaxonomyMapper(collection="posts", taxonomy="tags"),
+            mappers.DefaultCollectionMapper(collection="posts"),
+            mappers.DefaultFeedMapper(collections=["posts"]),
+            mappers.DefaultSitemapMapper(),
+        ],
+    )
+    kart.check_config()
+    tracemalloc.start()
+    kart.site = create_site(count)
+    for modifier in kart.content_modifiers:
+        modifier.modify(kart.config, kart.site)
+    site = tracemalloc.get_traced_memory()[0]
+    kart.create_map()
+    total, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{count} posts, {len(kart.map)} pages")
+    print(f"site: {site / 2**20:8.1f} MiB")
+    print(
+        f" map: {(total - site) / 2**20:8.1f} MiB ({(total - site) / len(kart.map):.0f} bytes per page)"
+    )
+    print(f"peak: {peak / 2**20:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:2]))
@@ -0,0 +1,55 @@
+"""Measures the time needed by the dev server to resolve an url to a page.
+
+Usage: python -m benchmarks.routing [number of routes]
+"""
+
+import fnmatch
+import sys
+from timeit import timeit
+
+from kart.utils import KartMap, RouteTable
+
+
+def create_map(count: int) -> KartMap:
+    """Creates a map with ``count`` pages and the default wildcard routes"""
+    map = KartMap(site_url="http://localhost:9000")
+    for i in range(count):
+        map[f"posts.post{i}"] = {
+            "url": f"/posts/post{i}/",
+            "data": {},
+            "template": "post.html",
+            "renderer": "default_site_renderer",
+        }
+    map["static"] = {"url": "/static/*", "data": {}, "template": "", "renderer": ""}
+    map["root"] = {"url": "/*", "data": {}, "template": "", "renderer": ""}
+    return map
+
+
+def linear_resolve(map: KartMap, url: str):
+    """The previous implementation, which scanned every wildcard url with fnmatch"""
+    urls = {page["url"]: slug for slug, page in map.items()}
+    if url in urls:
+        return urls[url]
+    wildcards = {x: slug for x, slug in urls.items() if "*" in x or "?" in x}
+    return next((wildcards[x] for x in wildcards if fnmatch.fnmatch(url, x)), None)
+
+
+def main(count: int = 100000, number: int = 100000):
+    map = create_map(count)
+    build_time = timeit(lambda: RouteTable(map), number=1)
+    routes = RouteTable(map)
+    print(f"{count} routes, table built in {build_time * 1000:.1f} ms")
+    requests = {
+        "exact": f"/posts/post{count // 2}/",
+        "static": "/static/css/main.css",
+        "root": "/favicon.ico",
+        "missing": "/does/not/exist",
+    }
+    for name, url in requests.items():
+        assert routes.resolve(url) == linear_resolve(map, url)
+        elapsed = timeit(lambda: routes.resolve(url), number=number)
+        print(f"{name:>8}: {elapsed / number * 1e6:.3f} us per request")
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:2]))
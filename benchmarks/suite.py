@@ -0,0 +1,281 @@
+"""Times the builds, the site updates and the requests to the dev server of a
+synthetic site, saving the results as json so that runs can be compared.
+
+Usage:
+    python -m benchmarks.suite --posts 5000 --output new.json --compare old.json
+    python -m benchmarks.suite --kind documentation --sections 20 --pages 50
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import runpy
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from contextlib import redirect_stdout
+from datetime import datetime
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from time import perf_counter
+
+from benchmarks import synthetic
+
+ROOT = Path(__file__).parent.parent
+
+
+def statistics_of(times: list) -> dict:
+    """Summarizes a list of timings, in seconds"""
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "max": max(times),
+        "runs": len(times),
+    }
+
+
+def time_build(path: Path, arguments: list, repeat: int, before=None) -> dict:
+    """Times ``main.py build`` in a new interpreter, like it is run by the users"""
+    environment = {**os.environ, "PYTHONPATH": str(ROOT)}
+    times = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = perf_counter()
+        subprocess.run(
+            [sys.executable, "main.py", "build", *arguments],
+            cwd=path,
+            env=environment,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        times.append(perf_counter() - start)
+    return statistics_of(times)
+
+
+def benchmark_builds(path: Path, repeat: int) -> dict:
+    def clear_build():
+        shutil.rmtree(path / "_site", ignore_errors=True)
+
+    return {
+        "build_cold": time_build(path, ["--clear-cache"], repeat, clear_build),
+        "build_warm": time_build(path, [], repeat),
+        "build_incremental": time_build(path, ["--incremental"], repeat),
+    }
+
+
+class DevServer:
+    """Runs the dev server of a site in background threads, like Kart.serve()"""
+
+    def __init__(self, kart):
+        from kart.server import KartObserver, KartRequestHandler
+
+        self.kart = kart
+        self.update_times = []
+        kart.config["serving"] = True
+        kart.config["dev_mode"] = False
+        kart.check_config()
+        kart.renderer_dict = {x.name: x for x in kart.renderers}
+        self.observer = KartObserver(
+            action=self.update_data,
+            debounce=kart.config["watching"]["debounce"],
+            max_delay=kart.config["watching"]["max_delay"],
+        )
+        for miner in kart.miners:
+            miner.start_watching(kart.config, self.observer)
+        for renderer in kart.renderers:
+            renderer.start_serving(kart.config)
+
+        class Handler(KartRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        Handler.action = kart.serve_page
+        self.httpd = ThreadingHTTPServer(("localhost", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://localhost:{self.httpd.server_address[1]}"
+        kart.config["site_url"] = self.url
+
+    def update_data(self):
+        start = perf_counter()
+        self.kart.update_data()
+        self.update_times.append(perf_counter() - start)
+
+    def start(self):
+        self.update_data()
+        self.observer.start()
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.observer.stop()
+        self.observer.join()
+        for miner in self.kart.miners:
+            miner.stop_watching(self.kart.config)
+
+    def get(self, url: str) -> bytes:
+        with urllib.request.urlopen(self.url + url) as response:
+            return response.read()
+
+
+def time_requests(server: DevServer, urls: list) -> dict:
+    times = []
+    for url in urls:
+        start = perf_counter()
+        server.get(url)
+        times.append(perf_counter() - start)
+    return statistics_of(times)
+
+
+def time_edits(server: DevServer, files: list, url: str, repeat: int) -> dict:
+    """Appends a marker to ``files`` and times how long it takes for the dev server
+    to serve the page at ``url``, which is the page of the last file, with the marker"""
+    originals = [file.read_text() for file in files]
+    times = []
+    try:
+        for i in range(repeat):
+            marker = f"benchmark-marker-{i}-{time.time_ns()}"
+            start = perf_counter()
+            for file, original in zip(files, originals):
+                # the file is replaced atomically like editors do, so that the
+                # miners never read it while it is being written
+                temporary = file.with_name(file.name + ".tmp")
+                temporary.write_text(original + f"\n\n{marker}\n")
+                os.replace(temporary, file)
+            while marker.encode() not in server.get(url):
+                if perf_counter() - start > 30:
+                    raise TimeoutError(f"{url} was not updated after editing {file}")
+                time.sleep(0.001)
+            times.append(perf_counter() - start)
+    finally:
+        for file, original in zip(files, originals):
+            file.write_text(original)
+    return statistics_of(times)
+
+
+def benchmark_server(path: Path, kind: str, repeat: int, requests: int) -> dict:
+    """Times update_data(), the requests and the edits served by the dev server"""
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        with redirect_stdout(io.StringIO()):
+            kart = runpy.run_path("main.py", run_name="benchmark")["kart"]
+            server = DevServer(kart)
+            server.start()
+            try:
+                update_times = []
+                for _ in range(repeat):
+                    start = perf_counter()
+                    kart.update_data()
+                    update_times.append(perf_counter() - start)
+                with kart.lock:
+                    pages = [
+                        page["url"]
+                        for page in kart._map.values()
+                        if page["renderer"] == "default_site_renderer"
+                    ]
+                step = max(len(pages) // requests, 1)
+                urls = pages[::step][:requests]
+                results = {
+                    "update_data": statistics_of(update_times),
+                    "serve_page_cold": time_requests(server, urls),
+                    "serve_page_cached": time_requests(server, urls),
+                }
+                if kind == "blog":
+                    files = sorted(Path("collections/posts").glob("*.md"))
+                    url = "/posts/{}/"
+                else:
+                    files = sorted(Path("docs/section0").glob("*.md"))
+                    url = "/section0/{}/"
+                updates = len(server.update_times)
+                results["edit_latency"] = time_edits(
+                    server, files[:1], url.format(files[0].stem), repeat
+                )
+                results["update_data_after_edit"] = statistics_of(
+                    server.update_times[updates:]
+                )
+                # many files changed at once, like by git checkout
+                batch = files[:100]
+                results["batch_edit_latency"] = time_edits(
+                    server, batch, url.format(batch[-1].stem), repeat
+                )
+            finally:
+                server.stop()
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def compare(old: dict, new: dict, threshold: float = 0.1):
+    """Prints the change of the median of each benchmark between two runs"""
+    if old.get("scale") != new.get("scale") or old.get("kind") != new.get("kind"):
+        print("Warning: the runs used sites of different scale")
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            continue
+        before = old["results"][name]["median"]
+        after = result["median"]
+        change = (after - before) / before if before else 0
+        flag = ""
+        if change > threshold:
+            flag = "  slower"
+        elif change < -threshold:
+            flag = "  faster"
+        print(
+            f"{name:>24}: {before * 1000:10.2f} ms -> {after * 1000:10.2f} ms "
+            f"({change:+.1%}){flag}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    synthetic.add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--site", help="reuse or keep the site in this directory")
+    parser.add_argument("--output", help="save the results to this json file")
+    parser.add_argument("--compare", help="compare with the results of a previous run")
+    args = parser.parse_args()
+
+    scale = synthetic.scale(args)
+    with tempfile.TemporaryDirectory() as temporary:
+        path = Path(args.site or temporary).absolute()
+        if not (path / "main.py").exists():
+            print(f"Generating {args.kind} site in {path}")
+            synthetic.generate(args.kind, path, **scale)
+        results = benchmark_builds(path, args.repeat)
+        results.update(benchmark_server(path, args.kind, args.repeat, args.requests))
+
+    output = {
+        "kind": args.kind,
+        "scale": scale,
+        "date": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    for name, result in results.items():
+        print(
+            f"{name:>24}: median {result['median'] * 1000:10.2f} ms, "
+            f"min {result['min'] * 1000:10.2f} ms"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), output)
+
+
+if __name__ == "__main__":
+    main()
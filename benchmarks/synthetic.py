@@ -0,0 +1,324 @@
+"""Generates synthetic sites of configurable scale for the benchmarks.
+
+The templates and the static files are copied from the cookiecutters, like
+``cookiecutter`` does, while the content is random but reproducible.
+
+Usage: python -m benchmarks.synthetic path [--kind documentation] [--posts 1000] ...
+"""
+
+import argparse
+import random
+from datetime import date, timedelta
+from pathlib import Path
+
+from kart.utils import copy_directory
+
+COOKIECUTTERS = Path(__file__).parent.parent / "cookiecutters"
+
+WORDS = (
+    "kart static site generator python template page post tag data render "
+    "build cache map miner mapper renderer markdown jinja content url file "
+    "server update index feed sitemap collection taxonomy config theme fast"
+).split()
+
+CODE = {
+    "python": "def function_{0}(x):\n    return [y * {0} for y in range(x)]\n",
+    "javascript": "function f{0}(x) {{\n  return x.map((y) => y * {0});\n}}\n",
+    "bash": 'for i in $(seq 1 {0}); do\n  echo "$i"\ndone\n',
+}
+
+BLOG_MAIN = """from kart import Kart, mappers, miners, modifiers, renderers
+from kart.ext.markdown import markdown_to_html, markdown_to_toc
+from kart.utils import date_to_string
+{asciidoc_import}
+kart = Kart()
+
+kart.miners = [
+    miners.DefaultCollectionMiner("posts"),
+    miners.DefaultTaxonomyMiner("tags"),
+    miners.DefaultDataMiner(),
+    miners.DefaultPageMiner(),{asciidoc_miner}
+]
+
+kart.content_modifiers = [
+    modifiers.CollectionSorter("posts", "date", True),
+    modifiers.TaxonomyIndexer("posts", "tags"),
+]
+
+kart.mappers = [
+    mappers.DefaultIndexMapper(collection="posts", template="blog_index.html"),
+    mappers.DefaultTaxonomyMapper(
+        collection="posts", taxonomy="tags", template="tag.html"
+    ),
+    mappers.DefaultCollectionMapper(collection="posts", template="post.html"),
+    mappers.DefaultPageMapper(),
+    mappers.DefaultFeedMapper(collections=["posts"]),
+    mappers.DefaultSitemapMapper(),
+    mappers.DefaultStaticFilesMapper(),
+    mappers.DefaultRootDirMapper(),
+]
+
+kart.renderers = [
+    renderers.DefaultSiteRenderer(
+        filters={{
+            "html": markdown_to_html,
+            "toc": markdown_to_toc,
+            "date_to_string": date_to_string,{asciidoc_filter}
+        }},
+        process_count={processes},
+        bytecode_cache=True,
+    ),
+    renderers.DefaultFeedRenderer(),
+    renderers.DefaultSitemapRenderer(),
+    renderers.DefaultStaticFilesRenderer(),
+    renderers.DefaultRootDirRenderer(),
+]
+
+kart.config["name"] = "Benchmark"
+kart.config["site_url"] = "https://example.com"
+kart.config["pagination"] = {{"per_page": 5}}
+kart.config["code_highlighting"] = {{"style": "material"}}
+kart.config["miner_cache"] = {{"enabled": True}}
+
+if __name__ == "__main__":
+    kart.run()
+"""
+
+DOCUMENTATION_MAIN = """from kart import Kart, mappers, miners, renderers
+from kart.ext import documentation
+from kart.ext.markdown import markdown_to_toc
+from kart.utils import date_to_string
+
+kart = Kart()
+
+kart.miners = [
+    miners.DefaultDataMiner(),
+    documentation.DefaultDocumentationMiner(),
+]
+
+kart.mappers = [
+    documentation.DefaultDocumentationMapper(template="default.html"),
+    mappers.DefaultSitemapMapper(),
+    mappers.DefaultStaticFilesMapper(),
+    mappers.DefaultRootDirMapper(),
+]
+
+kart.renderers = [
+    renderers.DefaultSiteRenderer(
+        filters={{
+            "html": documentation.markdown_to_html,
+            "toc": markdown_to_toc,
+            "date_to_string": date_to_string,
+        }},
+        process_count={processes},
+        bytecode_cache=True,
+    ),
+    renderers.DefaultSitemapRenderer(),
+    renderers.DefaultStaticFilesRenderer(),
+    renderers.DefaultRootDirRenderer(),
+]
+
+kart.config["name"] = "Benchmark"
+kart.config["version"] = "1.0.0"
+kart.config["icon"] = "/favicon.ico"
+kart.config["repo_url"] = "https://github.com/example/benchmark"
+kart.config["repository_url"] = "https://github.com/example/benchmark"
+kart.config["repo_name"] = "example/benchmark"
+kart.config["maintainer_name"] = "example"
+kart.config["site_url"] = "https://example.com"
+kart.config["code_highlighting"] = {{"style": "material"}}
+kart.config["miner_cache"] = {{"enabled": True}}
+
+if __name__ == "__main__":
+    kart.run()
+"""
+
+
+def sentence(rng: random.Random, length: int = 12) -> str:
+    words = rng.choices(WORDS, k=length)
+    return " ".join(words).capitalize() + "."
+
+
+def markdown_body(rng: random.Random, sections: int, code_blocks: int) -> str:
+    """Returns markdown with headings, paragraphs, lists and code blocks"""
+    body = []
+    for i in range(sections):
+        body.append(f"## {sentence(rng, 4)[:-1]}\n")
+        body.append(" ".join(sentence(rng) for _ in range(5)) + "\n")
+        body.extend(f"* {sentence(rng, 6)}" for _ in range(3))
+        body.append("")
+    for i in range(code_blocks):
+        language = rng.choice(list(CODE))
+        body.append(f"```{language}\n{CODE[language].format(rng.randrange(100))}```\n")
+    return "\n".join(body)
+
+
+def copy_cookiecutter(kind: str, path: Path):
+    """Copies the files that cookiecutter copies without rendering"""
+    project = COOKIECUTTERS / kind / "{{cookiecutter.project_slug}}"
+    for directory in ("templates", "static"):
+        copy_directory(project / directory, path / directory)
+
+
+def static_files(rng: random.Random, path: Path, count: int):
+    """Creates ``count`` static assets between 1 and 64 KiB"""
+    for i in range(count):
+        file = path / "static" / "assets" / f"{i // 100}" / f"asset{i}.bin"
+        file.parent.mkdir(parents=True, exist_ok=True)
+        size = rng.randrange(1024, 65536)
+        file.write_bytes(rng.getrandbits(size * 8).to_bytes(size, "little"))
+    (path / "root").mkdir(exist_ok=True)
+    (path / "root" / "robots.txt").write_text("User-agent: *\n")
+
+
+def generate_blog(
+    path: Path,
+    posts: int = 1000,
+    tags: int = 50,
+    data_files: int = 10,
+    code_blocks: int = 2,
+    asciidoc_pages: int = 0,
+    static: int = 100,
+    processes: int = 1,
+    seed: int = 0,
+):
+    """Generates a blog with the cookiecutter blog templates"""
+    rng = random.Random(seed)
+    path = Path(path)
+    copy_cookiecutter("blog", path)
+    for directory in ("collections/posts", "taxonomies/tags", "data", "pages"):
+        (path / directory).mkdir(parents=True, exist_ok=True)
+    for i in range(tags):
+        (path / "taxonomies" / "tags" / f"tag{i}.md").write_text(
+            f"---\nname: Tag {i}\n---\n{sentence(rng)}\n"
+        )
+    start = date(2015, 1, 1)
+    for i in range(posts):
+        post_tags = sorted(rng.sample(range(tags), min(3, tags)))
+        front_matter = [
+            "---",
+            f"title: {sentence(rng, 5)[:-1]}",
+            f"date: {start + timedelta(days=rng.randrange(3650))}",
+            f"tags: [{', '.join(f'tag{x}' for x in post_tags)}]",
+            f"description: {sentence(rng)}",
+            "---",
+        ]
+        body = markdown_body(rng, 4, code_blocks)
+        (path / "collections" / "posts" / f"post{i}.md").write_text(
+            "\n".join(front_matter) + "\n" + body
+        )
+    for i in range(data_files):
+        items = "\n".join(
+            f"- name: {sentence(rng, 3)}\n  value: {x}" for x in range(20)
+        )
+        (path / "data" / f"data{i}.yml").write_text(items + "\n")
+    (path / "pages" / "about.md").write_text(
+        "---\ntitle: About\n---\n" + markdown_body(rng, 2, 0)
+    )
+    asciidoc = {"asciidoc_import": "", "asciidoc_miner": "", "asciidoc_filter": ""}
+    if asciidoc_pages:
+        asciidoc = {
+            "asciidoc_import": "from kart.ext import asciidoc\n",
+            "asciidoc_miner": "\n    asciidoc.AsciidocPageMiner(),",
+            "asciidoc_filter": '\n            "asciidoc": asciidoc.asciidoc_to_html,',
+        }
+        page = (path / "templates" / "page.html").read_text()
+        (path / "templates" / "asciidoc_page.html").write_text(
+            page.replace("|html", "|asciidoc")
+        )
+    for i in range(asciidoc_pages):
+        sections = "\n\n".join(
+            f"== {sentence(rng, 4)[:-1]}\n\n{sentence(rng)}" for _ in range(4)
+        )
+        (path / "pages" / f"asciidoc{i}.adoc").write_text(
+            f"= Asciidoc page {i}\n:template: asciidoc_page.html\n\n{sections}\n"
+        )
+    static_files(rng, path, static)
+    (path / "main.py").write_text(BLOG_MAIN.format(processes=processes, **asciidoc))
+
+
+def generate_documentation(
+    path: Path,
+    sections: int = 10,
+    pages: int = 20,
+    code_blocks: int = 4,
+    static: int = 100,
+    processes: int = 1,
+    seed: int = 0,
+):
+    """Generates a documentation site with the cookiecutter documentation templates.
+    Each of the ``sections`` has ``pages`` pages"""
+    rng = random.Random(seed)
+    path = Path(path)
+    copy_cookiecutter("documentation", path)
+    docs = path / "docs"
+    docs.mkdir(parents=True, exist_ok=True)
+    (path / "data").mkdir(exist_ok=True)
+    (docs / "index.md").write_text(
+        "---\ntitle: Home\n---\n" + markdown_body(rng, 2, code_blocks)
+    )
+    navigation = ["- page: index.md"]
+    for i in range(sections):
+        navigation.append(f"- section: section{i}\n  name: Section {i}")
+        section = docs / f"section{i}"
+        section.mkdir(exist_ok=True)
+        section_navigation = []
+        for j in range(pages):
+            section_navigation.append(f"- page: page{j}.md")
+            (section / f"page{j}.md").write_text(
+                f"---\ntitle: {sentence(rng, 4)[:-1]}\n---\n"
+                + markdown_body(rng, 4, code_blocks)
+            )
+        (section / "navigation.yml").write_text("\n".join(section_navigation) + "\n")
+    (docs / "navigation.yml").write_text("\n".join(navigation) + "\n")
+    static_files(rng, path, static)
+    (path / "main.py").write_text(DOCUMENTATION_MAIN.format(processes=processes))
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Adds the scale of the site to the arguments of a command"""
+    parser.add_argument("--kind", choices=["blog", "documentation"], default="blog")
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--tags", type=int, default=50)
+    parser.add_argument("--data-files", type=int, default=10)
+    parser.add_argument("--code-blocks", type=int, default=2)
+    parser.add_argument("--asciidoc-pages", type=int, default=0)
+    parser.add_argument("--sections", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--static", type=int, default=100)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def scale(args: argparse.Namespace) -> dict:
+    """Returns the arguments of the generator of the chosen kind of site"""
+    common = {
+        "code_blocks": args.code_blocks,
+        "static": args.static,
+        "processes": args.processes,
+        "seed": args.seed,
+    }
+    if args.kind == "blog":
+        return {
+            "posts": args.posts,
+            "tags": args.tags,
+            "data_files": args.data_files,
+            "asciidoc_pages": args.asciidoc_pages,
+            **common,
+        }
+    return {"sections": args.sections, "pages": args.pages, **common}
+
+
+def generate(kind: str, path: Path, **scale):
+    if kind == "blog":
+        generate_blog(path, **scale)
+    else:
+        generate_documentation(path, **scale)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="directory of the site")
+    add_arguments(parser)
+    args = parser.parse_args()
+    generate(args.kind, Path(args.path), **scale(args))
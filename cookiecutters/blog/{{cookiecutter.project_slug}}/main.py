@@ -9,7 +9,10 @@ kart.miners = [
     miners.DefaultPageMiner(),
 ]
 
-kart.content_modifiers = [modifiers.CollectionSorter("posts", "date", True)]
+kart.content_modifiers = [
+    modifiers.CollectionSorter("posts", "date", True),
+    modifiers.TaxonomyIndexer("posts", "tags"),
+]
 
 kart.mappers = [
     mappers.DefaultIndexMapper(collection="posts", template="blog_index.html"),
@@ -28,7 +28,10 @@ kart.renderers = [
             "html": markdown_to_html,
             "toc": markdown_to_toc,
             "date_to_string": date_to_string,
-        }
+        },
+        # the templates read only the titles of site.docs, which are also in
+        # the global toc, so editing a page does not render the others again
+        site_keys=["docs_global_toc"],
     ),
     renderers.DefaultSitemapRenderer(),
     renderers.DefaultStaticFilesRenderer(),
@@ -1,13 +1,22 @@
 import argparse
-import fnmatch
+import json
+import os
 import shutil
 import threading
-import traceback
-from copy import deepcopy
-from http.server import HTTPServer
+from contextlib import nullcontext
+from copy import copy
 from pathlib import Path
+from time import perf_counter
 
-from kart.utils import KartMap, KartObserver, KartRequestHandler, merge_dicts
+from kart.utils import (
+    KartMap,
+    Profiler,
+    RouteTable,
+    copy_entry,
+    exchange_paths,
+    link_unchanged_files,
+    merge_dicts,
+)
 
 
 class Kart:
@@ -31,6 +40,17 @@ class Kart:
         self.config = config
         self.build_location = Path(build_location)
         self.lock = threading.Lock()
+        self.update_lock = threading.Lock()
+        self._mapper_outputs = None
+        self._modified_keys = set()
+        self._site = {}
+        self.profiler = None
+
+    def profile(self, category: str, name: str):
+        """Records the time spent inside the context if the build is profiled"""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.record(category, name)
 
     def check_config(self):
         """Checks if the config has all the necessary fields and sets them to default values if not"""
@@ -38,10 +58,19 @@ class Kart:
             "name": "Example",
             "site_url": "https://example.org",
             "pagination": {"per_page": 5, "skip": 0},
-            "code_highlighting": {"style": "default", "noclasses": True},
+            "code_highlighting": {
+                "style": "default",
+                "noclasses": True,
+                "cache": False,
+            },
             "timezone": "UTC",
             "serving": False,
+            "verbose": False,
             "dev_server_port": 9000,
+            "cache_location": ".kart-cache",
+            "mining": {"workers": 1, "processes": False, "lazy_content": False},
+            "miner_cache": {"enabled": False, "verify_hash": False},
+            "watching": {"debounce": 0.05, "max_delay": 1},
         }
         self.config = merge_dicts(self.config, default)
 
@@ -49,81 +78,275 @@ class Kart:
         """Calls miners and content modifiers"""
         self.site = {}
         for miner in self.miners:
-            if start:
-                miner.read_data(self.config)
-            self.site = merge_dicts(self.site, miner.collect(self.config))
+            with self.profile("miner", Profiler.describe(miner)):
+                if start:
+                    miner.read_data(self.config)
+                self.site = merge_dicts(self.site, miner.collect(self.config))
+        mined = dict(self.site)
         for modifier in self.content_modifiers:
-            modifier.modify(self.config, self.site)
+            with self.profile("modifier", Profiler.describe(modifier)):
+                modifier.modify(self.config, self.site)
+        # keys created or replaced by the content modifiers
+        self._modified_keys = {x for x in self.site if self.site[x] is not mined.get(x)}
+
+    def changed_keys(self) -> set:
+        """Returns the keys of the site changed by the last call of mine_data(),
+        as reported by the miners. The keys created or replaced by the content
+        modifiers are considered changed whenever the data of a miner has changed"""
+        changed = set()
+        for miner in self.miners:
+            keys = miner.changed_keys()
+            if keys is None:
+                return set(self.site.keys()) | (self._site.keys() - self.site.keys())
+            changed.update(keys)
+        if changed:
+            changed.update(self._modified_keys)
+        # deleted keys
+        changed.update(self._site.keys() - self.site.keys())
+        return changed
 
-    def create_map(self):
-        """Calls mappers and map modifiers"""
+    def create_map(self, changed: set = None):
+        """Calls mappers and map modifiers.
+
+        If ``changed`` is given, only the mappers that depend on those keys of the
+        site are called again, while the others reuse their previous output.
+        Only the dev server keeps the outputs, builds map the site once
+        """
+        if changed is None or self._mapper_outputs is None:
+            self._mapper_outputs = [None] * len(self.mappers)
         self.map = KartMap(site_url=self.config["site_url"])
-        for mapper in self.mappers:
-            self.map.update(mapper.map(self.config, self.site))
+        for i, mapper in enumerate(self.mappers):
+            output = self._mapper_outputs[i]
+            dependencies = mapper.dependencies()
+            if (
+                output is None
+                or dependencies is None
+                or changed.intersection(dependencies)
+            ):
+                with self.profile("mapper", Profiler.describe(mapper)):
+                    output = mapper.map(self.config, self.site)
+            if self.config["serving"]:
+                self._mapper_outputs[i] = output
+                if self.map_modifiers:
+                    # the entries kept for the next update are not modified
+                    output = {slug: copy_entry(entry) for slug, entry in output.items()}
+            self.map.update(output)
         for modifier in self.map_modifiers:
-            modifier.modify(self.config, self.site, self.map)
+            with self.profile("modifier", Profiler.describe(modifier)):
+                modifier.modify(self.config, self.site, self.map)
 
-    def write(self):
-        """Calls renderers"""
+    def write(self, keys: list = None, location: Path = None):
+        """Calls renderers. If ``keys`` is given only those pages are rendered.
+        The files are written in ``location``, by default the build location"""
+        location = location or self.build_location
         for renderer in self.renderers:
-            renderer.render(self.config, self.site, self.map, self.build_location)
+            if self.profiler is not None:
+                renderer.profile = True
+            with self.profile("renderer", Profiler.describe(renderer)):
+                # keys is passed only when needed to support renderers written before it
+                if keys is None:
+                    renderer.render(self.config, self.site, self.map, location)
+                else:
+                    renderer.render(
+                        self.config, self.site, self.map, location, keys=keys
+                    )
+            if self.profiler is not None:
+                pages = getattr(renderer, "page_times", [])
+                self.profiler.add_pages(renderer.name, pages)
 
-    def build(self):
-        """Build the entire site"""
-        self.check_config()
-        self.mine_data()
-        self.create_map()
-        shutil.rmtree(self.build_location, ignore_errors=True)
-        self.build_location.mkdir(parents=True, exist_ok=True)
-        self.write()
+    def create_manifest(self) -> dict:
+        """Returns the hash and the output files of every page of the map"""
+        renderers = {renderer.name: renderer for renderer in self.renderers}
+        pages = {}
+        for slug, page in self.map.items():
+            renderer = renderers.get(page["renderer"])
+            if renderer is None:
+                continue
+            paths = [
+                str(x.relative_to(self.build_location))
+                for x in renderer.output_files(page, self.build_location)
+            ]
+            hash = renderer.page_hash(page, self.config, self.site, self.map)
+            pages[slug] = {"hash": hash, "paths": paths}
+        return {"build_location": str(self.build_location), "pages": pages}
+
+    @property
+    def manifest_location(self) -> Path:
+        return Path(self.config["cache_location"]) / "manifest.json"
+
+    def load_manifest(self) -> dict:
+        """Loads the manifest of the previous build, if it is still valid"""
+        try:
+            with self.manifest_location.open() as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("build_location") != str(self.build_location):
+            return None
+        if not self.build_location.is_dir():
+            return None
+        return manifest
+
+    def save_manifest(self, manifest: dict):
+        self.manifest_location.parent.mkdir(parents=True, exist_ok=True)
+        with self.manifest_location.open("w") as f:
+            json.dump(manifest, f)
+
+    def write_incremental(self, previous: dict, current: dict, location: Path):
+        """Renders only the pages whose hash has changed since the previous build
+        and removes the files of the pages that no longer exist"""
+        old_pages = previous["pages"]
+        keys = []
+        for slug, page in current["pages"].items():
+            if (
+                page["hash"] is None
+                or old_pages.get(slug, {}).get("hash") != page["hash"]
+            ):
+                keys.append(slug)
+        old_paths = {x for page in old_pages.values() for x in page["paths"]}
+        new_paths = {x for page in current["pages"].values() for x in page["paths"]}
+        for path in old_paths - new_paths:
+            path = location / path
+            if path.exists():
+                path.unlink()
+            # the empty directories are removed, even if some of them were deleted
+            parent = path.parent
+            while parent != location:
+                if parent.is_dir():
+                    if any(parent.iterdir()):
+                        break
+                    parent.rmdir()
+                parent = parent.parent
+        self.write(keys, location)
+
+    def swap_build(self, staging: Path):
+        """Replaces the build location with the staging directory.
+
+        Files whose content has not changed are replaced by the files of the
+        previous build, keeping their timestamps for deploy tools like rsync
+        """
+        if not self.build_location.is_dir():
+            os.replace(staging, self.build_location)
+            return
+        link_unchanged_files(staging, self.build_location)
+        # staging holds the previous build after the exchange
+        if not exchange_paths(staging, self.build_location):
+            old = self.build_location.with_name(self.build_location.name + ".old")
+            shutil.rmtree(old, ignore_errors=True)
+            os.replace(self.build_location, old)
+            os.replace(staging, self.build_location)
+            staging = old
+        shutil.rmtree(staging)
+
+    def build(self, incremental: bool = False, atomic: bool = False):
+        """Build the entire site.
+
+        If ``incremental`` is true only the pages whose data, template or config
+        have changed since the last build are rendered again. The data that
+        renderers read directly from ``site`` is tracked by their ``site_keys``.
+
+        If ``atomic`` is true the site is built in a staging directory that
+        replaces the build location only when the build has finished
+        """
+        with self.profile("phase", "check_config"):
+            self.check_config()
+        with self.profile("phase", "mine_data"):
+            self.mine_data()
+        with self.profile("phase", "create_map"):
+            self.create_map()
+        manifest = None
+        if incremental or atomic:
+            with self.profile("phase", "create_manifest"):
+                manifest = self.create_manifest()
+        previous = self.load_manifest() if incremental else None
+        location = self.build_location
+        if atomic:
+            location = self.build_location.with_name(
+                self.build_location.name + ".staging"
+            )
+            shutil.rmtree(location, ignore_errors=True)
+            if previous:
+                # renderers never write through the links, see DefaultFileRenderer
+                shutil.copytree(self.build_location, location, copy_function=os.link)
+        elif self.manifest_location.exists():
+            # the manifest is removed until the build succeeds, so that an
+            # interrupted build is never mistaken for a complete one
+            self.manifest_location.unlink()
+        with self.profile("phase", "write"):
+            if previous:
+                self.write_incremental(previous, manifest, location)
+            else:
+                shutil.rmtree(location, ignore_errors=True)
+                location.mkdir(parents=True, exist_ok=True)
+                self.write(location=location)
+        if atomic:
+            with self.profile("phase", "swap_build"):
+                self.swap_build(location)
+        if manifest is not None:
+            self.save_manifest(manifest)
 
     # _site and _map are set and retrieved with a threading lock to prevent data races
     # _site and _map are set only when the creation of the map has finished
     # therefore it is not possible to access only partial data,
-    # preventing errors when serving the site during development
+    # preventing errors when serving the site during development.
+    # Miners apply the changed files to their data in place when collect() is
+    # called, and update_lock ensures that updates never overlap. _site holds a
+    # shallow copy of every changed key, while unchanged keys share the copy of
+    # the previous snapshot.
+    # The items themselves are replaced and never modified by miners.
+    # A new map is created at every update, so it is never copied
 
     def update_data(self):
         """Update the site data after a file has been changed"""
-        self.mine_data(False)
-        self.create_map()
-        _site = deepcopy(self.site)
-        _map = deepcopy(self.map)
-        _urls = {}
-        _regexes = {}
-        for slug, page in self.map.items():
-            _urls[page["url"]] = slug
-            if "*" in page["url"] or "?" in page["url"]:
-                _regexes[page["url"]] = slug
-        with self.lock:
-            self._site = _site
-            self._map = _map
-            self._urls = _urls
-            self._regexes = _regexes
+        with self.update_lock:
+            start = perf_counter()
+            self.mine_data(False)
+            changed = self.changed_keys()
+            self.create_map(changed)
+            _site = {}
+            for key, value in self.site.items():
+                if key in changed or key not in self._site:
+                    _site[key] = copy(value)
+                else:
+                    _site[key] = self._site[key]
+            _map = self.map
+            _routes = RouteTable(self.map)
+            with self.lock:
+                self._site = _site
+                self._map = _map
+                self._routes = _routes
+            elapsed = (perf_counter() - start) * 1000
+            if self.config["verbose"]:
+                print(
+                    f"Updated {', '.join(sorted(changed)) or 'nothing'} "
+                    f"in {elapsed:.0f} ms"
+                )
 
     def serve_page(self, handler, url: str):
         """Serve a single page"""
         with self.lock:
             site_map = self._map
-            urls = self._urls
             site = self._site
-            regexes = self._regexes
-        if url in urls:
-            page = site_map[urls[url]]
-        else:
-            try:
-                pattern = next((x for x in regexes if fnmatch.fnmatch(url, x)))
-                page = site_map[regexes[pattern]]
-            except StopIteration:
-                page = None
-        if page:
+            routes = self._routes
+        slug = routes.resolve(url)
+        if slug is not None:
+            page = site_map[slug]
             renderer = self.renderer_dict[page["renderer"]]
             renderer.serve(handler, page, self.config, site, site_map)
 
     def serve(self, port: int = 9000):
         """Main loop for serving the site"""
+        from http.server import ThreadingHTTPServer
+
+        from kart.server import KartObserver, KartRequestHandler
+
         self.check_config()
         self.renderer_dict = {}
-        observer = KartObserver(action=self.update_data)
+        observer = KartObserver(
+            action=self.update_data,
+            debounce=self.config["watching"]["debounce"],
+            max_delay=self.config["watching"]["max_delay"],
+        )
         for miner in self.miners:
             miner.start_watching(self.config, observer)
         observer.start()
@@ -132,17 +355,18 @@ class Kart:
             renderer.start_serving(self.config)
         handler_class = KartRequestHandler
         handler_class.action = self.serve_page
-        httpd = HTTPServer(("", port), handler_class)
+        # every request is handled in its own thread, so that the assets of a page
+        # can be served concurrently
+        httpd = ThreadingHTTPServer(("", port), handler_class)
+        httpd.daemon_threads = True
         self.update_data()
         shutil.rmtree(self.build_location, ignore_errors=True)
 
-        while True:
-            try:
-                httpd.handle_request()
-            except KeyboardInterrupt:
-                break
-            except Exception:
-                print(traceback.format_exc())
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        httpd.server_close()
 
         print("\rexiting")
         for miner in self.miners:
@@ -167,6 +391,44 @@ class Kart:
             type=str,
         )
         parser.add_argument("--dev", help="developer mode", action="store_true")
+        parser.add_argument(
+            "--clear-cache",
+            help="delete the cache folder before running",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--atomic",
+            help="build in a staging directory and swap it with the build location",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--incremental",
+            help="only render the pages that changed since the last build",
+            action="store_true",
+        )
+        parser.add_argument(
+            "-v",
+            "--verbose",
+            help="print statistics of the renderers and of the site updates",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--profile",
+            help="print the time spent by each part of the build and save a report, "
+            "implies --verbose",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--profile-top",
+            help="number of pages and templates listed by --profile",
+            default=10,
+            type=int,
+        )
+        parser.add_argument(
+            "--trace",
+            help="save a Chrome trace of the build to this file, implies --profile",
+            type=str,
+        )
         args = parser.parse_args()
 
         self.config["serving"] = False
@@ -179,8 +441,23 @@ class Kart:
         if args.port:
             self.config["dev_server_port"] = args.port
         self.config["dev_mode"] = args.dev
+        if args.verbose or args.profile or args.trace:
+            self.config["verbose"] = True
+
+        if args.clear_cache:
+            self.check_config()
+            shutil.rmtree(self.config["cache_location"], ignore_errors=True)
 
         if args.command == "build":
-            self.build()
+            if args.profile or args.trace:
+                self.profiler = Profiler()
+            self.build(incremental=args.incremental, atomic=args.atomic)
+            if self.profiler is not None:
+                print(self.profiler.summary(args.profile_top))
+                report = Path(self.config["cache_location"]) / "profile.json"
+                self.profiler.save(report)
+                print(f"Profile saved in {report}")
+                if args.trace:
+                    self.profiler.save_trace(args.trace)
         if args.command == "serve":
             self.serve(self.config["dev_server_port"])
@@ -1,36 +1,159 @@
+import atexit
+import json
+import os
+import queue
+import threading
 import xml.etree.ElementTree as xml
 from datetime import date
 from pathlib import Path
 from subprocess import PIPE, Popen
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
 
 from jinja2 import pass_context
 from jinja2.runtime import Context
 
 from kart.miners import DefaultMiner
-from kart.utils import id_from_path, str_to_bool
+from kart.utils import LRUCache, digest, id_from_path, render_string, str_to_bool
 
+# Ruby script run by AsciidoctorConverter. For every line of stdin, containing
+# a json object with the source of a document, it writes a line of json to stdout
+# with the converted document. The toc is the outline of the document sections
+ASCIIDOCTOR_WORKER = """
+require "asciidoctor"
+require "json"
+STDOUT.sync = true
+STDIN.each_line do |line|
+  doc = Asciidoctor.load(JSON.parse(line)["source"], safe: :unsafe)
+  html = doc.convert
+  toc = doc.converter.convert(doc, "outline", toclevels: 4)
+  puts JSON.generate({"html" => html, "toc" => toc || ""})
+end
+"""
 
-@pass_context
-def asciidoc_to_html(context: Context, asciidoc: str) -> str:
-    """Converts asciidoc data to html"""
-    parsed_asciidoc = context.environment.from_string(asciidoc).render(context)
+
+class AsciidoctorConverter:
+    """Pool of persistent asciidoctor processes.
+
+    Each process reads a document as a ``{"source": ...}`` json object on a single
+    line of its stdin and answers with a ``{"html": ..., "toc": ...}`` json object
+    on a single line of its stdout. ``command`` can be replaced by any program
+    following this protocol, for example a fake converter used in tests.
+    Converted documents are cached by the hash of their source
+    """
+
+    def __init__(
+        self,
+        command: list = ["ruby", "-e", ASCIIDOCTOR_WORKER],
+        process_count: int = 2,
+        cache_size: int = 1024,
+    ):
+        self.command = command
+        self.process_count = process_count
+        self.cache = LRUCache(maxsize=cache_size)
+        self._lock = threading.Lock()
+        self._reset()
+        atexit.register(self.close)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.Queue()
+        self._processes = []
+
+    def _acquire(self) -> Popen:
+        """Returns an idle process, starting a new one if the pool is not full"""
+        while True:
+            with self._lock:
+                if self._pid != os.getpid():
+                    # the pipes of the parent process must not be shared with a fork
+                    self._reset()
+                if self._idle.empty() and len(self._processes) < self.process_count:
+                    process = Popen(
+                        self.command,
+                        stdin=PIPE,
+                        stdout=PIPE,
+                        encoding="utf-8",
+                    )
+                    self._processes.append(process)
+                    return process
+            process = self._idle.get()
+            # None is put in the queue when a process has been removed
+            if process is None:
+                continue
+            if process.poll() is None:
+                return process
+            self._discard(process)
+
+    def _discard(self, process: Popen):
+        """Removes a failed process from the pool, so that a new one is started"""
+        process.kill()
+        process.wait()
+        with self._lock:
+            if process in self._processes:
+                self._processes.remove(process)
+        # wakes a thread waiting for an idle process
+        self._idle.put(None)
+
+    def convert(self, source: str) -> Tuple[str, str]:
+        """Converts a document, returning an ``(html, toc)`` tuple"""
+        key = digest(source)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        process = self._acquire()
+        document = None
+        try:
+            process.stdin.write(json.dumps({"source": source}) + "\n")
+            process.stdin.flush()
+            line = process.stdout.readline()
+            if not line:
+                raise RuntimeError("The asciidoctor process exited unexpectedly")
+            document = json.loads(line)
+        finally:
+            # the process is returned to the pool only if it answered
+            if document is None:
+                self._discard(process)
+            else:
+                self._idle.put(process)
+        result = (document["html"], document["toc"])
+        self.cache.set(key, result)
+        return result
+
+    def close(self):
+        """Stops every process of the pool"""
+        with self._lock:
+            if self._pid == os.getpid():
+                for process in self._processes:
+                    process.stdin.close()
+                    process.wait()
+            self._reset()
+
+
+converter = AsciidoctorConverter()
+
+
+def prepare_asciidoc(context: Context, asciidoc: str) -> str:
+    """Renders the jinja code inside the asciidoc data and adds the
+    attributes needed for code highlighting"""
+    parsed_asciidoc = render_string(context, asciidoc)
     config = context["config"]["code_highlighting"]
     pygments_header = ":source-highlighter: pygments\n"
     if config["noclasses"]:
         pygments_header += ":pygments-css: style\n"
         pygments_header += f':pygments-style: {config["style"]}\n'
-    parsed_asciidoc = pygments_header + parsed_asciidoc
-    p = Popen(["asciidoctor", "-e", "-"], stdin=PIPE, stdout=PIPE)
-    return p.communicate(input=parsed_asciidoc.encode("utf-8"))[0].decode("utf-8")
+    return pygments_header + parsed_asciidoc
 
 
-def asciidoc_to_toc(asciidoc: str) -> str:
-    """Extracts a list of header from asciidoc data"""
-    asciidoc = ":toc:\n:toclevels: 4\n" + asciidoc
-    p = Popen(["asciidoctor", "-e", "-a", "toc", "-"], stdin=PIPE, stdout=PIPE)
-    html = p.communicate(input=asciidoc.encode("utf-8"))[0].decode("utf-8")
-    toc_xml = xml.fromstring("</div>".join(html.split("</div>")[:2]) + "</div>")[1]
+@pass_context
+def asciidoc_to_html(context: Context, asciidoc: str) -> str:
+    """Converts asciidoc data to html"""
+    html, _ = converter.convert(prepare_asciidoc(context, asciidoc))
+    return html
+
+
+def parse_outline(outline: str) -> list:
+    """Returns the headers listed by the outline of a document"""
+    if not outline:
+        return []
 
     def parse(ul):
         toc = []
@@ -48,7 +171,22 @@ def asciidoc_to_toc(asciidoc: str) -> str:
                     toc.extend(parse(x))
         return toc
 
-    return parse(toc_xml)
+    return parse(xml.fromstring(outline))
+
+
+def asciidoc_to_toc(asciidoc: str) -> list:
+    """Extracts a list of header from asciidoc data"""
+    _, outline = converter.convert(str(asciidoc))
+    return parse_outline(outline)
+
+
+@pass_context
+def asciidoc_page_toc(context: Context, asciidoc: str) -> list:
+    """Extracts a list of header from asciidoc data, like asciidoc_to_toc(), after
+    rendering its jinja code. It shares the conversion with asciidoc_to_html(),
+    so every page is converted once"""
+    _, outline = converter.convert(prepare_asciidoc(context, asciidoc))
+    return parse_outline(outline)
 
 
 def parse_asciidoc_header(header: str) -> Dict[str, Any]:
@@ -90,11 +228,10 @@ class AsciidocMiner(DefaultMiner):
         the content in the ``content`` field and then return the dictionary
         """
         with file.open("r") as f:
-            data = f.read().split("\n\n")
-            metadata = parse_asciidoc_header(data[0])
+            header, _, content = f.read().partition("\n\n")
+            metadata = parse_asciidoc_header(header)
             if "draft" in metadata and metadata["draft"] and not config["dev_mode"]:
                 return
-            content = "\n\n".join(data[1:])
             slug = id_from_path(self.dir, file)
             data = {}
             data["markup"] = "asciidoc"
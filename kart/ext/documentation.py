@@ -1,7 +1,7 @@
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 from slugify import slugify
-from watchdog.events import RegexMatchingEventHandler
 
 from kart.miners import DefaultMarkupMiner
 from kart.utils import KartDict
@@ -13,69 +13,236 @@ except ImportError:
 
 import importlib
 import inspect
+import os
+import threading
 
 import mistune
 from jinja2 import pass_context
 from jinja2.runtime import Context
 from mistune.directives import Directive
 
-from kart.ext.markdown import KartMistuneRenderer, TocRenderer
+from kart.ext.markdown import (
+    KartMistuneRenderer,
+    TocRenderer,
+    html_cache,
+    toc_cache,
+    url_key,
+)
 from kart.mappers import Mapper
-from kart.utils import KartObserver
+from kart.utils import MapEntry, digest
+
+if TYPE_CHECKING:
+    from kart.server import KartObserver
+
+_parsers = threading.local()
+
+# modules documented by DocumentationDirective, with the modification time of their
+# source, and the html of every documented symbol, with the times of its module and
+# of the modules of its bases
+_modules = {}
+_symbols = {}
+_modules_lock = threading.Lock()
+# miners that are watching, which also watch the sources of the documented modules
+_watching_miners = []
+
+
+def module_mtime(module) -> int:
+    """Returns the modification time of the source of a module, if it has one"""
+    path = getattr(module, "__file__", None)
+    return os.stat(path).st_mtime_ns if path else None
+
+
+def is_kart_module(name: str) -> bool:
+    return name.split(".")[0] == "kart"
+
+
+def load_module(name: str):
+    """Imports a module, reloading it the first time it is documented and then only
+    when its source file changes. Returns the module and the time of its source.
+
+    The modules of kart are never reloaded, since that would replace their caches
+    and their classes, e.g. the caches above"""
+    with _modules_lock:
+        module = importlib.import_module(name)
+        mtime = module_mtime(module)
+        if is_kart_module(name):
+            return module, mtime
+        if name not in _modules or _modules[name][0] != mtime:
+            module = importlib.reload(module)
+            _modules[name] = (mtime, module)
+        return _modules[name][1], mtime
 
 
 class DefaultDocumentationMiner(DefaultMarkupMiner):
-    """Miner that recursively looks for data in the ``docs`` folder"""
+    """Miner that recursively looks for data in the ``docs`` folder.
+
+    It keeps the parsed pages and the navigation tree of the sections, so that
+    while watching only the changed pages are parsed again, and only the sections
+    whose ``navigation.yml`` has changed are read again
+    """
 
     def __init__(self, directory: str = "docs"):
         "Initializes miner. Sets the ``dir`` variable"
         self.dir = Path(directory)
-
-    def __recursive_read_data(self, config: dict, dir: Path, level: int = 0):
-        """Helper function"""
-        if dir.joinpath("navigation.yml").exists():
-            nav_file = dir.joinpath("navigation.yml").open()
+        # items of every section, as ("page", path, None) or ("section", path, name)
+        self._sections = {}
+        # slug and data of every parsed page
+        self._pages = {}
+
+    def read_navigation(self, dir: Path) -> list:
+        """Returns the items of a section, listed by its ``navigation.yml``
+        or, if it does not exist, by the directory"""
+        navigation = dir.joinpath("navigation.yml")
+        if not navigation.exists():
+            return [
+                ("section", x, x.name) if x.is_dir() else ("page", x, None)
+                for x in dir.iterdir()
+                if x.is_dir() or self.valid_path(x)
+            ]
+        with navigation.open() as nav_file:
             nav_data = YamlLoader(nav_file.read()).get_data()
-            paths = []
-            for x in nav_data:
-                if "page" in x.keys():
-                    paths.append(dir.joinpath(x["page"]))
-                elif "section" in x.keys():
-                    paths.append(dir.joinpath(x["section"]))
-        else:
-            paths = dir.iterdir()
-            nav_data = []
-
-        for i, item in enumerate(paths):
-            if item.is_file():
-                object = self.collect_single_file(item, config)
-                slug, page = list(object.items())[0]
-                toc_entry = {"title": page["title"], "slug": slug, "level": level}
-                self.docs_global_toc.append(toc_entry)
-                if object:
-                    self.markdown_data.update(object)
-            elif item.is_dir():
-                toc_entry = {"title": nav_data[i]["name"], "slug": None, "level": level}
-                self.docs_global_toc.append(toc_entry)
-                self.__recursive_read_data(config, item, level + 1)
+        items = []
+        for x in nav_data:
+            if "page" in x.keys():
+                items.append(("page", dir.joinpath(x["page"]), None))
+            elif "section" in x.keys():
+                items.append(("section", dir.joinpath(x["section"]), x["name"]))
+        return items
+
+    def read_section(self, dir: Path, pages: list):
+        """Reads the navigation of a section and of its new subsections,
+        adding to ``pages`` the pages that have not been parsed yet"""
+        self._sections[dir] = self.read_navigation(dir)
+        for kind, path, _ in self._sections[dir]:
+            if kind == "page":
+                if path not in self._pages and path.is_file():
+                    pages.append(path)
+            elif path not in self._sections and path.is_dir():
+                self.read_section(path, pages)
+
+    def store_pages(self, pages: list, results: list):
+        for path, object in zip(pages, results):
+            if object:
+                self._pages[path] = list(object.items())[0]
+
+    def flatten(self):
+        """Creates the pages and the global toc by visiting the navigation tree.
+        The pages and sections which are no longer in the tree are forgotten"""
+        markdown_data = KartDict()
+        docs_global_toc = []
+        pages = {}
+        sections = {}
+
+        def visit(dir: Path, level: int):
+            sections[dir] = self._sections[dir]
+            for kind, path, name in sections[dir]:
+                if kind == "page" and path in self._pages:
+                    slug, page = pages[path] = self._pages[path]
+                    toc_entry = {"title": page["title"], "slug": slug, "level": level}
+                    docs_global_toc.append(toc_entry)
+                    markdown_data[slug] = page
+                elif kind == "section" and path in self._sections:
+                    toc_entry = {"title": name, "slug": None, "level": level}
+                    docs_global_toc.append(toc_entry)
+                    visit(path, level + 1)
+
+        visit(self.dir, 0)
+        self.markdown_data = markdown_data
+        self.docs_global_toc = docs_global_toc
+        self._pages = pages
+        self._sections = sections
 
     def read_data(self, config: dict):
-        self.markdown_data = KartDict()
-        self.docs_global_toc = []
-        self.__recursive_read_data(config, self.dir)
+        self._sections = {}
+        self._pages = {}
+        pages = []
+        self.read_section(self.dir, pages)
+        self.store_pages(pages, self.collect_files(pages, config))
+        self.flatten()
+
+    def update_changed_files(self, config: dict):
+        """Parses again the changed pages and reads again the navigation of the
+        sections whose ``navigation.yml`` or listed files have changed"""
+        with self._changes_lock:
+            changes, self._changes = self._changes, {}
+        pages = []
+        sections = set()
+        for path in changes:
+            if not path.exists():
+                self._pages.pop(path, None)
+                self._sections.pop(path, None)
+            if path.name == "navigation.yml":
+                sections.add(path.parent)
+            elif path in self._pages and path.is_file():
+                pages.append(path)
+            elif path.parent in self._sections:
+                # created, deleted or moved pages and sections
+                sections.add(path.parent)
+        for dir in sections:
+            if dir in self._sections:
+                try:
+                    self.read_section(dir, pages)
+                except Exception as error:
+                    print(f"Could not read the navigation of {dir}: {error}")
+        self.store_pages(pages, self.collect_readable_files(pages, config))
+        self.flatten()
 
     def collect(self, config: dict):
+        self._updated = bool(self._changes)
+        if self._updated:
+            self.update_changed_files(config)
         return {"docs": self.markdown_data, "docs_global_toc": self.docs_global_toc}
 
-    def start_watching(self, config: dict, observer: KartObserver):
-        """Registers a watchdog handler that calls read_data() when a file has changed"""
+    def changed_keys(self) -> set:
+        return {"docs", "docs_global_toc"} if self._updated else set()
+
+    def start_watching(self, config: dict, observer: "KartObserver"):
+        """Registers a watchdog handler that records the changed files,
+        which are read again by collect() once for every batch of events"""
+        from watchdog.events import RegexMatchingEventHandler
 
         class Handler(RegexMatchingEventHandler):
             def on_any_event(_, event):
-                self.read_data(config)
-
+                # reading the files triggers opened and closed events, which must be ignored
+                if event.event_type in ("opened", "closed"):
+                    return
+                self.file_changed(Path(event.src_path))
+                if event.event_type == "moved":
+                    self.file_changed(Path(event.dest_path))
+
+        self._changes = {}
+        self._changes_lock = threading.Lock()
+        self._observer = observer
+        self._source_dirs = set()
         self.read_data(config)
         observer.schedule(Handler(), self.dir, recursive=True)
+        _watching_miners.append(self)
+
+    def stop_watching(self, config: dict):
+        if self in _watching_miners:
+            _watching_miners.remove(self)
+
+    def watch_modules(self, modules: list):
+        """Watches the sources of the documented modules. A change starts an update
+        of the site, whose new map invalidates the rendered pages, and the symbols
+        of the changed modules are rendered again"""
+        from watchdog.events import FileSystemEventHandler
+
+        dirs = set()
+        for module in modules:
+            path = getattr(module, "__file__", None)
+            if path and not is_kart_module(module.__name__):
+                dirs.add(os.path.dirname(os.path.abspath(path)))
+        with self._changes_lock:
+            dirs -= self._source_dirs
+            self._source_dirs.update(dirs)
+        for directory in dirs:
+            self._observer.schedule(FileSystemEventHandler(), directory)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop("_observer", None)
+        return state
 
 
 class DefaultDocumentationMapper(Mapper):
@@ -99,19 +266,23 @@ class DefaultDocumentationMapper(Mapper):
                 template = page["template"]
             else:
                 template = self.template
+            data = {**page}
             if len(urls):
-                page["previous_page"] = previous_slug
+                data["previous_page"] = previous_slug
                 urls[previous_slug]["data"]["next_page"] = slug
             previous_slug = slug
-            map_page = {
-                "url": self.base_url + url,
-                "data": {**page},
-                "template": template,
-                "renderer": "default_site_renderer",
-            }
+            map_page = MapEntry(
+                url=self.base_url + url,
+                data=data,
+                template=template,
+                renderer="default_site_renderer",
+            )
             urls[slug] = map_page
         return urls
 
+    def dependencies(self):
+        return ["docs"]
+
 
 class DocumentationDirective(Directive):
     """Mistune class that add the ``function`` and ``class`` directive to build a techical documentation"""
@@ -123,12 +294,37 @@ class DocumentationDirective(Directive):
         children = block.parse(text, state, block.rules)
         return {"type": name, "children": children, "params": (name, title)}
 
+    def render_symbol(self, render, loc: str) -> str:
+        """Returns ``render(module, name)`` for the symbol ``loc``, caching the html
+        until the source of its module or of the modules of its bases changes"""
+        module_name, name = loc.rsplit(".", 1)
+        module, mtime = load_module(module_name)
+        modules = [module]
+        symbol = getattr(module, name, None)
+        if inspect.isclass(symbol):
+            modules.extend(inspect.getmodule(x) for x in symbol.__mro__[1:])
+        mtimes = [mtime] + [module_mtime(x) for x in modules[1:]]
+        for miner in _watching_miners:
+            miner.watch_modules(modules)
+        key = (render.__name__, loc)
+        cached = _symbols.get(key)
+        if cached is not None and cached[0] == mtimes:
+            return cached[1]
+        html = render(module, name)
+        _symbols[key] = (mtimes, html)
+        return html
+
     def render_html_function(self, text, name, loc):
         """Renders the ``function`` directive"""
-        module_name = ".".join(loc.split(".")[:-1])
-        func_name = loc.split(".")[-1]
-        module = importlib.import_module(module_name)
-        module = importlib.reload(module)
+        return self.render_symbol(self.function_to_html, loc)
+
+    def render_html_class(self, text, name, loc):
+        """Renders the ``class`` directive"""
+        return self.render_symbol(self.class_to_html, loc)
+
+    def function_to_html(self, module, func_name: str) -> str:
+        """Returns the signature and the docstring of a function"""
+        loc = f"{module.__name__}.{func_name}"
         func = module.__dict__[func_name]
         sig = inspect.signature(func)
         html = "<dl>"
@@ -137,12 +333,10 @@ class DocumentationDirective(Directive):
         html += "</dl>"
         return html
 
-    def render_html_class(self, text, name, loc):
-        """Renders the ``class`` directive"""
-        module_name = ".".join(loc.split(".")[:-1])
-        func_name = loc.split(".")[-1]
-        module = importlib.import_module(module_name)
-        module = importlib.reload(module)
+    def class_to_html(self, module, func_name: str) -> str:
+        """Returns the bases and the docstring of a class, and of its methods"""
+        module_name = module.__name__
+        loc = f"{module_name}.{func_name}"
         cls = module.__dict__[func_name]
         parents = []
         for p in cls.__bases__:
@@ -193,12 +387,27 @@ class DocumentationDirective(Directive):
 def markdown_to_html(context: Context, markdown: str) -> str:
     """Converts markdown data to html.
     It supports markdown directives to extract the documentation out of python
-    docstrings.
+    docstrings. The result is cached, so the same content is converted only once
     """
-    return mistune.Markdown(
-        renderer=KartMistuneRenderer(context=context, escape=False),
-        plugins=[DocumentationDirective()],
-    )(markdown)
+    markdown = str(markdown)
+    config = context["config"]["code_highlighting"]
+    key = ("documentation", digest(markdown), url_key(context["url"]), repr(config))
+    html = html_cache.get(key)
+    if html is None:
+        if not hasattr(_parsers, "html"):
+            _parsers.html = mistune.Markdown(
+                renderer=KartMistuneRenderer(context=None, escape=False),
+                plugins=[DocumentationDirective()],
+            )
+        parser = _parsers.html
+        parser.renderer.context = context
+        try:
+            html = parser(markdown)
+        finally:
+            # the context is not kept, since it references the map
+            parser.renderer.context = None
+        html_cache.set(key, html)
+    return html
 
 
 class DocumentationTocRenderer(TocRenderer):
@@ -219,7 +428,15 @@ class DocumentationTocRenderer(TocRenderer):
 
 def markdown_to_toc(markdown: str) -> str:
     """Extracts a list of header from markdown data"""
-    return mistune.Markdown(
-        renderer=DocumentationTocRenderer(),
-        plugins=[DocumentationDirective()],
-    )(markdown)
+    markdown = str(markdown)
+    key = ("documentation", markdown)
+    toc = toc_cache.get(key)
+    if toc is None:
+        if not hasattr(_parsers, "toc"):
+            _parsers.toc = mistune.Markdown(
+                renderer=DocumentationTocRenderer(),
+                plugins=[DocumentationDirective()],
+            )
+        toc = _parsers.toc(markdown)
+        toc_cache.set(key, toc)
+    return toc
@@ -1,12 +1,34 @@
+import atexit
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING
+
 import mistune
 from jinja2 import pass_context
 from jinja2.runtime import Context
-from pygments import highlight
-from pygments.formatters import HtmlFormatter
-from pygments.lexers import get_lexer_by_name
-from pygments.styles import get_style_by_name
 from slugify import slugify
 
+from kart.utils import LRUCache, digest, render_string
+
+# pygments is imported only when a code block is not found in the cache
+if TYPE_CHECKING:
+    from pygments.formatters import HtmlFormatter
+
+# converted html and tocs, so that every content is parsed only once.
+# They are keyed on the hash of the contents, which are not kept in memory
+html_cache = LRUCache(maxsize=1024)
+toc_cache = LRUCache(maxsize=1024)
+
+# highlighted code blocks. If ``code_highlighting.cache`` is set in the config
+# they are saved in the cache folder and reused by the next builds
+highlight_cache = LRUCache(maxsize=16384)
+_highlight_cache_path = None
+
+# mistune parsers are reused, but every thread has its own because
+# KartMistuneRenderer holds the jinja context of the page being rendered
+_parsers = threading.local()
+
 
 class KartMistuneRenderer(mistune.HTMLRenderer):
     """Custom mistune renderers used by markdown_to_html()"""
@@ -28,15 +50,8 @@ class KartMistuneRenderer(mistune.HTMLRenderer):
     def block_code(self, text, lang):
         """Renders the ``code`` block"""
         if lang:
-            lexer = get_lexer_by_name(lang, stripall=True)
-            config = self.context["config"]["code_highlighting"]
-            formatter = HtmlFormatter(
-                wrapcode=True,
-                style=get_style_by_name(config["style"]),
-                noclasses=config["noclasses"],
-                prestyles="color: #EEFFFF" if config["noclasses"] else "",
-            )
-            return highlight(text, lexer, formatter)
+            config = self.context["config"]
+            return highlight_code(text, lang, config)
         else:
             return f"<pre><code>{mistune.escape(text.strip())}</code></pre>\n"
 
@@ -45,18 +60,98 @@ class KartMistuneRenderer(mistune.HTMLRenderer):
         return f"<h{level} id={slugify(text)}>{text}</h{level}>\n"
 
 
+@lru_cache(maxsize=None)
+def get_lexer(lang: str):
+    """Returns the pygments lexer of a language. Lexers are reused between blocks"""
+    from pygments.lexers import get_lexer_by_name
+
+    return get_lexer_by_name(lang, stripall=True)
+
+
+@lru_cache(maxsize=None)
+def get_formatter(style: str, noclasses: bool) -> "HtmlFormatter":
+    """Returns a pygments html formatter. Formatters are reused between blocks"""
+    from pygments.formatters import HtmlFormatter
+    from pygments.styles import get_style_by_name
+
+    return HtmlFormatter(
+        wrapcode=True,
+        style=get_style_by_name(style),
+        noclasses=noclasses,
+        prestyles="color: #EEFFFF" if noclasses else "",
+    )
+
+
+def url_key(url) -> object:
+    """Returns the key of a ``url`` function in the caches: the generation of
+    its map, since a bound method would keep the map alive"""
+    return getattr(getattr(url, "__self__", None), "generation", url)
+
+
+def load_highlight_cache(path: Path):
+    """Loads the highlight cache from disk and saves it again when kart exits"""
+    global _highlight_cache_path
+    if _highlight_cache_path == path:
+        return
+    if _highlight_cache_path is None:
+        atexit.register(lambda: highlight_cache.save(_highlight_cache_path))
+    _highlight_cache_path = path
+    highlight_cache.load(path)
+
+
+def add_highlights(highlights: dict, config: dict):
+    """Adds to the cache the code blocks highlighted by another process,
+    so that they are saved with the others"""
+    if config["code_highlighting"].get("cache"):
+        load_highlight_cache(Path(config["cache_location"]) / "highlight.json")
+    highlight_cache.update(highlights)
+
+
+def highlight_code(code: str, lang: str, config: dict) -> str:
+    """Highlights a code block with pygments. The results are cached, see
+    ``highlight_cache.hits`` and ``highlight_cache.misses`` for statistics"""
+    style = config["code_highlighting"]["style"]
+    noclasses = config["code_highlighting"]["noclasses"]
+    if config["code_highlighting"].get("cache"):
+        load_highlight_cache(Path(config["cache_location"]) / "highlight.json")
+    key = (code, lang, style, noclasses)
+    html = highlight_cache.get(key)
+    if html is None:
+        from pygments import highlight
+
+        html = highlight(code, get_lexer(lang), get_formatter(style, noclasses))
+        highlight_cache.set(key, html)
+    return html
+
+
 @pass_context
 def markdown_to_html(context: Context, markdown: str) -> str:
-    """Converts markdown data to html"""
-    parsed_markdown = context.environment.from_string(markdown).render(context)
-    return mistune.Markdown(
-        renderer=KartMistuneRenderer(context=context, escape=False),
-        plugins=[
-            mistune.plugins.plugin_strikethrough,
-            mistune.plugins.plugin_table,
-            mistune.plugins.plugin_task_lists,
-        ],
-    )(parsed_markdown)
+    """Converts markdown data to html.
+    The result is cached, so the same content is converted only once
+    """
+    parsed_markdown = render_string(context, markdown)
+    config = context["config"]["code_highlighting"]
+    key = (digest(parsed_markdown), url_key(context["url"]), repr(config))
+    html = html_cache.get(key)
+    if html is None:
+        if not hasattr(_parsers, "html"):
+            _parsers.html = mistune.Markdown(
+                renderer=KartMistuneRenderer(context=None, escape=False),
+                plugins=[
+                    mistune.plugins.plugin_strikethrough,
+                    mistune.plugins.plugin_table,
+                    mistune.plugins.plugin_task_lists,
+                ],
+            )
+        parser = _parsers.html
+        parser.renderer.context = context
+        try:
+            html = parser(parsed_markdown)
+        finally:
+            # the context is not kept, since it references the map
+            parser.renderer.context = None
+        html_cache.set(key, html)
+    return html
 
 
 class TocRenderer(mistune.renderers.BaseRenderer):
@@ -90,4 +185,12 @@ class TocRenderer(mistune.renderers.BaseRenderer):
 
 def markdown_to_toc(markdown: str) -> str:
     """Extracts a list of header from markdown data"""
-    return mistune.Markdown(renderer=TocRenderer())(markdown)
+    markdown = str(markdown)
+    key = digest(markdown)
+    toc = toc_cache.get(key)
+    if toc is None:
+        if not hasattr(_parsers, "toc"):
+            _parsers.toc = mistune.Markdown(renderer=TocRenderer())
+        toc = _parsers.toc(markdown)
+        toc_cache.set(key, toc)
+    return toc
@@ -1,8 +1,9 @@
 from abc import ABC, abstractmethod
+from typing import Optional
 
 from slugify import slugify
 
-from kart.utils import KartDict, KartMap, paginate
+from kart.utils import KartDict, KartMap, MapEntry, paginate, taxonomy_index
 
 
 class Mapper(ABC):
@@ -12,6 +13,11 @@ class Mapper(ABC):
     def map(self, config: dict, site: KartDict) -> KartMap:
         """Takes the site as inputs and outputs a site map"""
 
+    def dependencies(self) -> Optional[list]:
+        """Returns the keys of the site used by the mapper, so that it is called
+        again only when they change. ``None`` means that it can use any key"""
+        return None
+
 
 class RuleMapper(Mapper):
     """Mapper that uses user defined functions to build the map"""
@@ -37,6 +43,9 @@ class ManualMapper(Mapper):
     def map(self, config: dict, site: KartDict) -> KartMap:
         return self.pages
 
+    def dependencies(self):
+        return []
+
 
 class DefaultCollectionMapper(Mapper):
     """Mapper intended to be used with DefaultCollectionMiner"""
@@ -63,15 +72,18 @@ class DefaultCollectionMapper(Mapper):
                 template = object["template"]
             else:
                 template = self.template
-            page = {
-                "url": self.base_url + url,
-                "data": object,
-                "template": template,
-                "renderer": self.renderer,
-            }
+            page = MapEntry(
+                url=self.base_url + url,
+                data=object,
+                template=template,
+                renderer=self.renderer,
+            )
             urls[slug] = page
         return urls
 
+    def dependencies(self):
+        return [self.collection]
+
 
 class DefaultPageMapper(Mapper):
     """Mapper intended to be used with DefaultPageMiner"""
@@ -96,15 +108,18 @@ class DefaultPageMapper(Mapper):
                 template = page["template"]
             else:
                 template = self.template
-            page = {
-                "url": url,
-                "data": page,
-                "template": template,
-                "renderer": self.renderer,
-            }
+            page = MapEntry(
+                url=url,
+                data=page,
+                template=template,
+                renderer=self.renderer,
+            )
             urls[slug] = page
         return urls
 
+    def dependencies(self):
+        return ["pages"]
+
 
 class DefaultIndexMapper(Mapper):
     """Mapper that creates the index pages of a collection"""
@@ -136,6 +151,9 @@ class DefaultIndexMapper(Mapper):
         paginated_map[f"{self.collection}_index.1"]["url"] = self.base_url + "/"
         return paginated_map
 
+    def dependencies(self):
+        return [self.collection]
+
 
 class DefaultTaxonomyMapper(Mapper):
     """Mapper that creates the index pages of a taxonomy of a collection"""
@@ -155,20 +173,14 @@ class DefaultTaxonomyMapper(Mapper):
         self.renderer = renderer
 
     def map(self, config: dict, site: KartDict) -> KartMap:
+        """Uses the index built by TaxonomyIndexer, or builds it if it is missing"""
         urls = {}
+        index = site.get(f"{self.collection}_by_{self.taxonomy}")
+        if index is None:
+            index = taxonomy_index(site[self.collection], self.taxonomy)
         for taxonomy in site[self.taxonomy]:
             slug = taxonomy["slug"]
-            items = site[self.collection]
-            filtered_items = []
-            for item in items:
-                if self.taxonomy not in item:
-                    continue
-                if isinstance(item[self.taxonomy], str):
-                    if item[self.taxonomy] == slug:
-                        filtered_items.append(item)
-                elif isinstance(item[self.taxonomy], list):
-                    if slug in item[self.taxonomy]:
-                        filtered_items.append(item)
+            filtered_items = index.get(slug, [])
             urls.update(
                 paginate(
                     objects=filtered_items,
@@ -182,23 +194,60 @@ class DefaultTaxonomyMapper(Mapper):
             )
         return urls
 
+    def dependencies(self):
+        index = f"{self.collection}_by_{self.taxonomy}"
+        return [self.collection, self.taxonomy, index]
+
 
 class DefaultFeedMapper(Mapper):
-    """Mapper that adds an entry for DefaultFeedMapper"""
+    """Mapper that adds an entry for DefaultFeedMapper.
 
-    def __init__(self, collections: list = [], renderer: str = "default_feed_renderer"):
+    Besides the main feed it can add a feed for each collection and a feed
+    for each term of the ``taxonomies``, containing the items of the collections
+    with that term. ``limit`` is the maximum number of entries of each feed
+    """
+
+    def __init__(
+        self,
+        collections: list = [],
+        renderer: str = "default_feed_renderer",
+        limit: int = None,
+        per_collection: bool = False,
+        taxonomies: list = [],
+        base_url: str = "",
+    ):
         self.collections = collections
         self.renderer = renderer
+        self.limit = limit
+        self.per_collection = per_collection
+        self.taxonomies = taxonomies
+        self.base_url = base_url
+
+    def feed(self, url: str, collections: list, **data) -> dict:
+        return MapEntry(
+            url=url,
+            data={"collections": collections, "limit": self.limit, **data},
+            template="",
+            renderer=self.renderer,
+        )
 
     def map(self, config: dict, site: KartDict) -> KartMap:
-        return {
-            "feed": {
-                "url": "/atom.xml",
-                "data": {"collections": self.collections},
-                "template": "",
-                "renderer": self.renderer,
-            }
-        }
+        urls = {"feed": self.feed("/atom.xml", self.collections)}
+        if self.per_collection:
+            for collection in self.collections:
+                url = self.base_url + f"/{collection}/atom.xml"
+                urls[f"feed.{collection}"] = self.feed(url, [collection])
+        for taxonomy in self.taxonomies:
+            for term in site[taxonomy]:
+                slug = term["slug"]
+                url = self.base_url + f"/{taxonomy}/{slug}/atom.xml"
+                urls[f"feed.{taxonomy}.{slug}"] = self.feed(
+                    url, self.collections, taxonomy=taxonomy, term=slug
+                )
+        return urls
+
+    def dependencies(self):
+        return list(self.taxonomies)
 
 
 class DefaultSitemapMapper(Mapper):
@@ -206,38 +255,47 @@ class DefaultSitemapMapper(Mapper):
 
     def map(elf, config: dict, site: KartDict) -> KartMap:
         return {
-            "sitemap": {
-                "url": "/sitemap.xml",
-                "data": {},
-                "template": "",
-                "renderer": "default_sitemap_renderer",
-            },
+            "sitemap": MapEntry(
+                url="/sitemap.xml",
+                data={},
+                template="",
+                renderer="default_sitemap_renderer",
+            ),
         }
 
+    def dependencies(self):
+        return []
+
 
 class DefaultStaticFilesMapper(Mapper):
     """Mapper that adds an entry for DefaultFeedMapper"""
 
     def map(self, config: dict, site: KartDict) -> KartMap:
         return {
-            "static": {
-                "url": "/static/*",
-                "data": {},
-                "template": "",
-                "renderer": "default_static_files_renderer",
-            }
+            "static": MapEntry(
+                url="/static/*",
+                data={},
+                template="",
+                renderer="default_static_files_renderer",
+            )
         }
 
+    def dependencies(self):
+        return []
+
 
 class DefaultRootDirMapper(Mapper):
     """Mapper that adds an entry for DefaultFeedMapper"""
 
     def map(self, config: dict, site: KartDict) -> KartMap:
         return {
-            "root": {
-                "url": "/*",
-                "data": {},
-                "template": "",
-                "renderer": "default_root_dir_renderer",
-            }
+            "root": MapEntry(
+                url="/*",
+                data={},
+                template="",
+                renderer="default_root_dir_renderer",
+            )
         }
+
+    def dependencies(self):
+        return []
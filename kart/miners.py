@@ -1,11 +1,16 @@
+import threading
 from abc import ABC, abstractmethod
 from fnmatch import fnmatch
 from pathlib import Path
-from typing import Union
+from typing import TYPE_CHECKING, Optional, Union
 
-from watchdog.events import RegexMatchingEventHandler
-
-from kart.utils import id_from_path
+from kart.utils import (
+    FileCache,
+    LazyContent,
+    id_from_path,
+    read_front_matter,
+    split_front_matter,
+)
 
 try:
     from yaml import CSafeLoader as YamlLoader
@@ -14,7 +19,24 @@ except ImportError:
 
 from typing import Dict
 
-from kart.utils import KartDict, KartObserver
+from kart.utils import KartDict
+
+if TYPE_CHECKING:
+    from kart.server import KartObserver
+
+# caches opened by get_file_cache(), one for each location
+_file_caches = {}
+
+
+def get_file_cache(config: dict) -> FileCache:
+    """Returns the cache of the files read by the miners,
+    or None if it is disabled by ``miner_cache.enabled`` in the config"""
+    if not config["miner_cache"]["enabled"]:
+        return None
+    path = Path(config["cache_location"]) / "miners.sqlite"
+    if path not in _file_caches:
+        _file_caches[path] = FileCache(path, config["miner_cache"]["verify_hash"])
+    return _file_caches[path]
 
 
 class Miner(ABC):
@@ -28,8 +50,13 @@ class Miner(ABC):
     def collect(self, config: dict) -> Dict:
         """Collects all data"""
 
+    def changed_keys(self) -> Optional[set]:
+        """Returns the keys of the site changed by the last call of collect(),
+        or None if they are not known and every key must be considered changed"""
+        return None
+
     @abstractmethod
-    def start_watching(self, config: dict, observer: KartObserver):
+    def start_watching(self, config: dict, observer: "KartObserver"):
         """Start watching for data changes"""
 
     @abstractmethod
@@ -40,6 +67,11 @@ class Miner(ABC):
 class DefaultMiner(Miner):
     """Base miner class for reading from filesystem"""
 
+    # files changed while watching, see file_changed()
+    _changes = None
+    # whether the last call of collect() applied some changes
+    _updated = True
+
     @abstractmethod
     def __init__(self):
         """Initializes miner. Must set the ``name`` and ``dir`` variables"""
@@ -51,43 +83,148 @@ class DefaultMiner(Miner):
     def valid_path(self, path: Union[Path, str]) -> bool:
         return any(fnmatch(path, "*" + ext) for ext in self.extensions)
 
+    def collect_files(self, files: list, config: dict) -> list:
+        """Calls collect_single_file() for each file, returning the results in order.
+
+        The results are stored in the miner cache, so that files that have not
+        changed since the last build are not parsed again
+        """
+        cache = get_file_cache(config)
+        if cache is None:
+            return self.parse_files(files, config)
+        # the result depends on the miner, its directory, the dev_mode
+        # and whether the contents are loaded lazily
+        namespace = f"{type(self).__module__}.{type(self).__qualname__}"
+        namespace += f":{self.dir}:{config.get('dev_mode', False)}"
+        namespace += f":{config['mining']['lazy_content']}"
+        results = [None] * len(files)
+        missing = []
+        for i, file in enumerate(files):
+            signature = cache.signature(file)
+            found, data = cache.get(namespace, file, signature)
+            if found:
+                results[i] = data
+            else:
+                missing.append((i, file, signature))
+        parsed = self.parse_files([file for _, file, _ in missing], config)
+        for (i, file, signature), data in zip(missing, parsed):
+            results[i] = data
+            cache.set(namespace, file, signature, data)
+        if missing:
+            cache.commit()
+        return results
+
+    def parse_files(self, files: list, config: dict) -> list:
+        """Calls collect_single_file() for each file, returning the results in order.
+
+        If ``mining.workers`` in the config is greater than one the files are read
+        by a pool of threads, or by a pool of processes if ``mining.processes`` is set
+        """
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        workers = config["mining"]["workers"]
+        if workers <= 1 or len(files) <= 1:
+            return [self.collect_single_file(file, config) for file in files]
+        if config["mining"]["processes"]:
+            executor = ProcessPoolExecutor(workers)
+            chunksize = max(len(files) // (workers * 4), 1)
+        else:
+            executor = ThreadPoolExecutor(workers)
+            chunksize = 1
+        with executor:
+            configs = [config] * len(files)
+            return list(
+                executor.map(
+                    self.collect_single_file, files, configs, chunksize=chunksize
+                )
+            )
+
     def read_data(self, config: dict):
         """Implements Miner.read_data().
 
         It iterates over a directory and calls collect_single_file() for each file
         """
         self.data = KartDict()
-        for file in filter(self.valid_path, filter(Path.is_file, self.dir.iterdir())):
-            data = self.collect_single_file(file, config)
+        files = list(filter(self.valid_path, filter(Path.is_file, self.dir.iterdir())))
+        for data in self.collect_files(files, config):
             if data:
                 self.data.update(data)
 
     def collect(self, config: dict):
+        self._updated = bool(self._changes)
+        if self._updated:
+            self.update_changed_files(config)
         return {self.name: self.data}
 
-    def start_watching(self, config: dict, observer: KartObserver):
-        """Registers a watchdog handler that calls collect_single_file() when a file has changed"""
+    def changed_keys(self) -> set:
+        return {self.name} if self._updated else set()
+
+    def __getstate__(self):
+        # the worker processes of collect_files() receive a copy of the miner,
+        # without the changes recorded while watching and their lock
+        state = self.__dict__.copy()
+        state.pop("_changes", None)
+        state.pop("_changes_lock", None)
+        return state
+
+    def file_changed(self, path: Path, deleted: bool = False):
+        """Records a file changed while watching. Only the last change of each
+        file is kept, so a file changed many times is read only once"""
+        with self._changes_lock:
+            self._changes[path] = deleted
+
+    def update_changed_files(self, config: dict):
+        """Reads again the files changed since the last call. A file which cannot
+        be read, e.g. because it is still being written, keeps its previous data"""
+        with self._changes_lock:
+            changes, self._changes = self._changes, {}
+        files = []
+        for path, deleted in changes.items():
+            if deleted:
+                self.data.pop(id_from_path(self.dir, path), None)
+            elif self.valid_path(path) and path.is_file():
+                files.append(path)
+        for data in self.collect_readable_files(files, config):
+            if data:
+                self.data.update(data)
+
+    def collect_readable_files(self, files: list, config: dict) -> list:
+        """Like collect_files(), but the result of a file which cannot be read
+        is None, and the error is printed instead of being raised"""
+        try:
+            return self.collect_files(files, config)
+        except Exception:
+            results = []
+            for file in files:
+                try:
+                    results.append(self.collect_single_file(file, config))
+                except Exception as error:
+                    name = getattr(self, "name", type(self).__name__)
+                    print(f"{name}: could not read {file}: {error}")
+                    results.append(None)
+            return results
+
+    def start_watching(self, config: dict, observer: "KartObserver"):
+        """Registers a watchdog handler that records the changed files,
+        which are read again by collect() once for every batch of events"""
+        from watchdog.events import RegexMatchingEventHandler
 
         class Handler(RegexMatchingEventHandler):
             def on_moved(_, event):
-                self.data.pop(id_from_path(self.dir, Path(event.src_path)), None)
-                if self.valid_path(event.dest_path):
-                    self.data.update(
-                        self.collect_single_file(Path(event.dest_path), config)
-                    )
+                self.file_changed(Path(event.src_path), deleted=True)
+                self.file_changed(Path(event.dest_path))
 
             def on_modified(_, event):
-                if self.valid_path(event.src_path):
-                    self.data.update(
-                        self.collect_single_file(Path(event.src_path), config)
-                    )
+                self.file_changed(Path(event.src_path))
 
             def on_created(_, event):
-                _.on_modified(event)
+                self.file_changed(Path(event.src_path))
 
             def on_deleted(_, event):
-                self.data.pop(id_from_path(self.dir, Path(event.src_path)), None)
+                self.file_changed(Path(event.src_path), deleted=True)
 
+        self._changes = {}
+        self._changes_lock = threading.Lock()
         self.read_data(config)
         observer.schedule(Handler(ignore_directories=True), self.dir, recursive=False)
 
@@ -105,19 +242,24 @@ class DefaultMarkupMiner(DefaultMiner):
         Stores the data included in the frontmatter in a dictionary, adds
         the content in the ``content`` field and then return the dictionary
         """
-        with file.open("r") as f:
-            data = f.read().split("---")
-            metadata = YamlLoader(data[1]).get_data()
-            if "draft" in metadata and metadata["draft"] and not config["dev_mode"]:
-                return
-            content = "---".join(data[2:])
-            slug = id_from_path(self.dir, file)
-            data = {}
-            data["markup"] = "markdown"
-            data.update(metadata)
-            data["content"] = content
-            data["slug"] = slug
-            return {slug: data}
+        if config["mining"]["lazy_content"]:
+            front_matter, offset = read_front_matter(file)
+            stat = file.stat()
+            length = stat.st_size - offset
+            content = LazyContent(file, offset, length, stat.st_mtime_ns)
+        else:
+            with file.open("r") as f:
+                front_matter, content = split_front_matter(f.read())
+        metadata = YamlLoader(front_matter).get_data()
+        if "draft" in metadata and metadata["draft"] and not config["dev_mode"]:
+            return
+        slug = id_from_path(self.dir, file)
+        data = {}
+        data["markup"] = "markdown"
+        data.update(metadata)
+        data["content"] = content
+        data["slug"] = slug
+        return {slug: data}
 
 
 class DefaultCollectionMiner(DefaultMarkupMiner):
@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 
-from kart.utils import KartDict, KartMap
+from kart.utils import KartDict, KartMap, taxonomy_index
 
 
 class ContentModifier(ABC):
@@ -56,3 +56,20 @@ class CollectionSorter(ContentModifier):
         if self.reverse:
             sorted_data.reverse()
         site[self.collection] = KartDict(sorted_data)
+
+
+class TaxonomyIndexer(ContentModifier):
+    """Modifier which indexes the items of a collection by the terms of a taxonomy.
+
+    The index is stored in ``site[f"{collection}_by_{taxonomy}"]`` and maps each
+    term to the list of its items, so that it can be used by mappers and templates
+    """
+
+    def __init__(self, collection, taxonomy):
+        self.collection = collection
+        self.taxonomy = taxonomy
+
+    def modify(self, config: dict, site: KartDict):
+        """Builds the index"""
+        index = taxonomy_index(site[self.collection], self.taxonomy)
+        site[f"{self.collection}_by_{self.taxonomy}"] = index
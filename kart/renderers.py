@@ -1,23 +1,80 @@
+import heapq
+import json
+import math
+import os
+import re
 from abc import ABC, abstractmethod
-from datetime import datetime, time
-from distutils.dir_util import copy_tree
-from http.server import SimpleHTTPRequestHandler
-from multiprocessing import Pool
+from datetime import datetime, time, tzinfo
+from itertools import islice
 from pathlib import Path
-
-from dateutil import tz
-from jinja2 import Environment, FileSystemLoader
-
-from kart.ext.markdown import markdown_to_html, markdown_to_toc
-from kart.utils import KartDict, KartMap, date_to_string
+from time import perf_counter, process_time
+from typing import Iterator, Optional
+
+from jinja2 import (
+    BaseLoader,
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    ModuleLoader,
+    TemplateNotFound,
+    meta,
+    nodes,
+)
+
+from kart.ext.markdown import (
+    add_highlights,
+    highlight_cache,
+    markdown_to_html,
+    markdown_to_toc,
+)
+from kart.utils import (
+    KartDict,
+    KartMap,
+    LRUCache,
+    OutputWriter,
+    copy_directory,
+    date_to_string,
+    digest,
+    json_default,
+    taxonomy_index,
+)
 
 
 class Renderer(ABC):
     """Base Renderer class"""
 
     @abstractmethod
-    def render(self, config: dict, site: KartDict, map: KartMap, build_location: str):
-        """Renders each page indented for this renderer"""
+    def render(
+        self,
+        config: dict,
+        site: KartDict,
+        map: KartMap,
+        build_location: str,
+        keys: list = None,
+    ):
+        """Renders each page indented for this renderer.
+
+        If ``keys`` is given only the pages with those slugs are rendered
+        """
+
+    def page_hash(
+        self, page: dict, config: dict, site: KartDict, map: KartMap
+    ) -> Optional[str]:
+        """Returns a hash of everything a page depends on, used by incremental builds.
+
+        ``None`` means that the page is rendered every time
+        """
+        return None
+
+    def output_path(self, page: dict, build_location: str) -> Optional[Path]:
+        """Returns the file a page is written to, if there is a single one"""
+        return None
+
+    def output_files(self, page: dict, build_location: str) -> list:
+        """Returns the files written for a page. Incremental builds remove the
+        files that are no longer written by any page"""
+        path = self.output_path(page, build_location)
+        return [] if path is None else [path]
 
     def start_serving(self, config: dict):
         """Start the dev server, if necessary"""
@@ -35,6 +92,22 @@ class Renderer(ABC):
 class DefaultFileRenderer(Renderer):
     """Base class for renderers that render file individually"""
 
+    # pages rendered by serve(), valid as long as the map does not change
+    _serve_cache = (None, {})
+    # number of threads writing the rendered files
+    write_workers = 4
+    # seconds spent rendering and writing the files by the last render()
+    render_time = 0
+    io_time = 0
+    # set by Kart when the build is profiled
+    profile = False
+    page_times = []
+    # keys of the site read by render_single() besides the page, which are part
+    # of the hash of every page. None means the whole site
+    site_keys = None
+    # hashes of the keys of the last site, see site_hash()
+    _site_hashes = (None, {})
+
     @abstractmethod
     def __init__(self, name: str):
         """Initializes renderer. Must set the ``name`` and ``content_type`` variables"""
@@ -45,50 +118,263 @@ class DefaultFileRenderer(Renderer):
     ) -> str:
         """Renders a single file"""
 
-    def render(self, config, site, map, build_location):
-        for page in map:
-            if page["renderer"] != self.name:
+    def page_hash(self, page, config, site, map):
+        return digest(page, config, self.site_hash(site, self.site_keys))
+
+    def site_hash(self, site: KartDict, keys: Optional[list]) -> str:
+        """Returns the hash of some keys of the site, or of the whole site if
+        ``keys`` is None. Each hash is computed once for each site"""
+        cached_site, hashes = self._site_hashes
+        if cached_site is not site:
+            hashes = {}
+            self._site_hashes = (site, hashes)
+        keys = None if keys is None else tuple(sorted(keys))
+        if keys not in hashes:
+            names = site.keys() if keys is None else keys
+            hashes[keys] = digest({key: site.get(key) for key in names})
+        return hashes[keys]
+
+    def output_path(self, page, build_location):
+        return Path(build_location) / Path(*Path(page["url"]).parts[1:])
+
+    def render(self, config, site, map, build_location, keys=None):
+        pages = [map[key] for key in (map.keys() if keys is None else keys)]
+        pages = [page for page in pages if page["renderer"] == self.name]
+        self.render_time = 0
+        with OutputWriter(self.write_workers) as writer:
+            writer.create_directories(
+                self.output_path(page, build_location) for page in pages
+            )
+            self.write_pages(writer, pages, config, site, map, build_location)
+        self.io_time = writer.io_time
+
+    def write_pages(
+        self,
+        writer: OutputWriter,
+        pages: list,
+        config: dict,
+        site: KartDict,
+        map: KartMap,
+        build_location: str,
+    ):
+        """Writes the pages, recording in ``page_times`` the wall and cpu time
+        of each one if ``profile`` is true"""
+        self.page_times = []
+        for page in pages:
+            if not self.profile:
+                self.write_page(writer, page, config, site, map, build_location)
                 continue
-            rendered_file = self.render_single(page, config, site, map)
-            path = Path(build_location) / Path(*Path(page["url"]).parts[1:])
-            path.parent.mkdir(parents=True, exist_ok=True)
-            with path.open("w") as f:
-                f.write(rendered_file)
+            start, cpu = perf_counter(), process_time()
+            self.write_page(writer, page, config, site, map, build_location)
+            self.page_times.append(
+                (
+                    page["url"],
+                    page["template"],
+                    perf_counter() - start,
+                    process_time() - cpu,
+                )
+            )
+
+    def write_page(
+        self,
+        writer: OutputWriter,
+        page: dict,
+        config: dict,
+        site: KartDict,
+        map: KartMap,
+        build_location: str,
+    ):
+        """Renders a single page and writes it with ``writer``"""
+        start = perf_counter()
+        content = self.render_single(page, config, site, map)
+        self.render_time += perf_counter() - start
+        writer.write(self.output_path(page, build_location), content)
+
+    def serve_key(self, page: dict):
+        """Returns the key of a page in the cache of the rendered pages"""
+        return page["url"]
 
     def serve(
         self, http_handler, page: dict, config: dict, site: KartDict, map: KartMap
     ):
+        """Serves a page, rendering it only if it is not in the cache.
+        Every map created by Kart.update_data() starts with an empty cache"""
+        cache_map, cache = self._serve_cache
+        if cache_map is not map:
+            cache = {}
+            self._serve_cache = (map, cache)
+        key = self.serve_key(page)
+        if key not in cache:
+            content = self.render_single(page, config, site, map).encode("utf-8")
+            cache[key] = (content, f'"{digest(content)}"')
+        content, etag = cache[key]
+        if http_handler.headers.get("If-None-Match") == etag:
+            http_handler.send_response(304)
+            http_handler.send_header("ETag", etag)
+            http_handler.end_headers()
+            return
         http_handler.send_response(200)
         http_handler.send_header("Content-type", self.content_type)
+        http_handler.send_header("Content-Length", str(len(content)))
+        http_handler.send_header("ETag", etag)
         http_handler.end_headers()
-        content = self.render_single(page, config, site, map)
-        http_handler.wfile.write(bytes(content, "utf-8"))
+        http_handler.wfile.write(content)
 
 
 class DefaultDirectoryRenderer(Renderer):
     """Base class for renderers that render directories"""
 
+    hardlink = False
+    copy_workers = 8
+
     @abstractmethod
     def __init__(self, name: str, directory: str):
         """Initializes renderer. Must set the ``name``, ``dir`` and ``base_url`` variables"""
 
-    def render(self, config: dict, site: KartDict, map: KartMap, build_location: str):
-        """Copies the entire directory to the target destination"""
-        for page in map:
+    def destination(self, page: dict, build_location: str) -> Path:
+        """Returns the directory the files of ``dir`` are copied to"""
+        return Path(build_location) / Path(*Path(page["url"][:-1]).parts[1:])
+
+    def output_files(self, page: dict, build_location: str) -> list:
+        source = Path(self.dir)
+        destination = self.destination(page, build_location)
+        files = []
+        for directory, _, filenames in os.walk(source, followlinks=True):
+            target = destination / Path(directory).relative_to(source)
+            files.extend(target / x for x in filenames)
+        return files
+
+    def render(
+        self,
+        config: dict,
+        site: KartDict,
+        map: KartMap,
+        build_location: str,
+        keys: list = None,
+    ):
+        """Copies the entire directory to the target destination.
+        Files already up to date in the destination are skipped"""
+        for key in map.keys() if keys is None else keys:
+            page = map[key]
             if page["renderer"] != self.name:
                 continue
-            destination = Path(build_location) / Path(*Path(page["url"][:-1]).parts[1:])
-            copy_tree(self.dir, str(destination))
+            copied, skipped = copy_directory(
+                self.dir,
+                self.destination(page, build_location),
+                self.hardlink,
+                self.copy_workers,
+            )
+            if config["verbose"]:
+                print(f"{self.name}: copied {copied} bytes, skipped {skipped} bytes")
 
     def serve(
         self, http_handler, page: dict, config: dict, site: KartDict, map: KartMap
     ):
+        from http.server import SimpleHTTPRequestHandler
+
         http_handler.path = self.base_url + http_handler.path
         return SimpleHTTPRequestHandler.do_GET(http_handler)
 
 
+# Arguments shared by the worker processes of DefaultSiteRenderer.
+# With the fork start method they are inherited from the parent process,
+# otherwise they are sent once to each worker by _init_worker()
+_worker_args = None
+
+
+def _init_worker(args: tuple):
+    """Initializes a worker process of DefaultSiteRenderer"""
+    global _worker_args
+    _worker_args = args
+
+
+def _render_chunk(keys: list) -> tuple:
+    """Renders a chunk of pages inside a worker process. The code blocks
+    highlighted by the worker are returned, so that the main process saves them"""
+    renderer, config, site, map, build_location, directories = _worker_args
+    start = perf_counter()
+    renderer.render_time = 0
+    save_highlights = config["code_highlighting"].get("cache")
+    if save_highlights:
+        highlight_cache.start_recording()
+    with OutputWriter(renderer.write_workers) as writer:
+        writer.directories.update(directories)
+        pages = [map[key] for key in keys]
+        renderer.write_pages(writer, pages, config, site, map, build_location)
+    return (
+        os.getpid(),
+        len(keys),
+        perf_counter() - start,
+        renderer.render_time,
+        writer.io_time,
+        renderer.page_times,
+        highlight_cache.stop_recording() if save_highlights else {},
+    )
+
+
+def read_site_keys(template: nodes.Template) -> Optional[set]:
+    """Returns the keys of ``site`` read by a template, like ``site.pages`` or
+    ``site["pages"]``, or None if the template uses ``site`` in any other way"""
+    keys = set()
+    lookups = set()
+    for node in template.find_all((nodes.Getattr, nodes.Getitem)):
+        if not isinstance(node.node, nodes.Name) or node.node.name != "site":
+            continue
+        if isinstance(node, nodes.Getattr):
+            keys.add(node.attr)
+        elif isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, str):
+            keys.add(node.arg.value)
+        else:
+            return None
+        lookups.add(id(node.node))
+    for node in template.find_all(nodes.Name):
+        if node.name == "site" and id(node) not in lookups:
+            return None
+    return keys
+
+
+class PrecompiledLoader(BaseLoader):
+    """Loads the templates compiled by ``DefaultSiteRenderer.compile_templates()``,
+    falling back to ``loader`` for the templates changed after the compilation"""
+
+    def __init__(self, path: str, loader: BaseLoader):
+        self.path = Path(path)
+        self.loader = loader
+        self.modules = ModuleLoader(path)
+        with open(self.path / "checksums.json") as f:
+            self.checksums = json.load(f)
+
+    def get_source(self, environment: Environment, template: str):
+        return self.loader.get_source(environment, template)
+
+    def list_templates(self) -> list:
+        return self.loader.list_templates()
+
+    def load(self, environment: Environment, name: str, globals: dict = None):
+        source, _, uptodate = self.loader.get_source(environment, name)
+        if self.checksums.get(name) != digest(source):
+            return self.loader.load(environment, name, globals)
+        template = self.modules.load(environment, name, globals)
+        template._uptodate = uptodate
+        return template
+
+
 class DefaultSiteRenderer(DefaultFileRenderer):
-    """Default renderer for rendering html files"""
+    """Default renderer for rendering html files.
+
+    If ``bytecode_cache`` is set the compiled templates are stored in it (``True``
+    means the ``templates`` folder in the cache location), so that they are not
+    compiled again by every build and every worker. ``compiled_templates`` is
+    the folder created by ``compile_templates()``, used instead of compiling the
+    templates.
+
+    ``site_keys`` lists the keys of the site read by the templates, e.g. a navbar
+    listing ``site.pages``: incremental builds render every page again when one
+    of them changes. By default they are found in the template of each page and
+    in the templates it references, falling back to the whole site when a
+    template uses ``site`` in other ways, e.g. ``site[name]``. Filters that read
+    the site from the jinja context are not tracked
+    """
 
     def __init__(
         self,
@@ -100,13 +386,138 @@ class DefaultSiteRenderer(DefaultFileRenderer):
             "date_to_string": date_to_string,
         },
         process_count: int = 1,
+        chunk_size: int = None,
+        stream: bool = False,
+        bytecode_cache=False,
+        compiled_templates: str = None,
+        site_keys: list = None,
     ):
         self.name = name
+        self.site_keys = site_keys
+        self.stream = stream
+        self.bytecode_cache = bytecode_cache
+        self.compiled_templates = compiled_templates
+        self.bytecode_location = None
         self.content_type = "text/html"
         self.template_folder = template_folder
         self.process_count = process_count
-        self.env = Environment(loader=FileSystemLoader(self.template_folder))
-        self.env.filters.update(filters)
+        self.chunk_size = chunk_size
+        self.worker_stats = {}
+        self.filters = filters
+        self.create_environment()
+
+    def create_environment(self):
+        """Creates the jinja2 environment used to render the templates"""
+        loader = FileSystemLoader(self.template_folder)
+        if self.compiled_templates:
+            if (Path(self.compiled_templates) / "checksums.json").exists():
+                loader = PrecompiledLoader(self.compiled_templates, loader)
+        bytecode_cache = None
+        if self.bytecode_location:
+            Path(self.bytecode_location).mkdir(parents=True, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(self.bytecode_location)
+        self.env = Environment(loader=loader, bytecode_cache=bytecode_cache)
+        # the tojson filter can serialize the entries of the map
+        self.env.policies["json.dumps_kwargs"] = {
+            "sort_keys": True,
+            "default": json_default,
+        }
+        self.env.filters.update(self.filters)
+        self._template_hashes = {}
+
+    def configure(self, config: dict):
+        """Sets the location of the bytecode cache, which depends on the config"""
+        location = None
+        if self.bytecode_cache is True:
+            location = str(Path(config["cache_location"]) / "templates")
+        elif self.bytecode_cache:
+            location = str(self.bytecode_cache)
+        if location != self.bytecode_location:
+            self.bytecode_location = location
+            self.create_environment()
+
+    def compile_templates(self, target: str = "compiled_templates"):
+        """Compiles all the templates ahead of time in the ``target`` folder,
+        which can then be passed as ``compiled_templates``"""
+        self.env.compile_templates(target, zip=None)
+        checksums = {}
+        for name in self.env.list_templates():
+            # the templates that could not be compiled are loaded from their source
+            if (Path(target) / ModuleLoader.get_module_filename(name)).exists():
+                source, _, _ = self.env.loader.get_source(self.env, name)
+                checksums[name] = digest(source)
+        with open(Path(target) / "checksums.json", "w") as f:
+            json.dump(checksums, f, indent=2, sort_keys=True)
+
+    def start_serving(self, config: dict):
+        self.configure(config)
+
+    def __getstate__(self) -> dict:
+        """The environment holds compiled templates that cannot be pickled,
+        so it is created again by the worker processes"""
+        state = self.__dict__.copy()
+        del state["env"]
+        del state["_template_hashes"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.create_environment()
+
+    def inspect_template(self, name: str) -> tuple:
+        """Returns a hash of a template and of every template it extends, includes
+        or imports, and the keys of the site they read (see ``read_site_keys()``)"""
+        if name in self._template_hashes:
+            hash, keys, uptodate = self._template_hashes[name]
+            if all(x() for x in uptodate):
+                return hash, keys
+        sources = []
+        keys = set()
+        uptodate = []
+        queue = [name]
+        seen = set()
+        while queue:
+            template = queue.pop()
+            if template in seen:
+                continue
+            seen.add(template)
+            try:
+                source, _, up = self.env.loader.get_source(self.env, template)
+            except TemplateNotFound:
+                continue
+            sources.append((template, source))
+            if up:
+                uptodate.append(up)
+            ast = self.env.parse(source)
+            template_keys = read_site_keys(ast)
+            if keys is not None:
+                keys = None if template_keys is None else keys | template_keys
+            for reference in meta.find_referenced_templates(ast):
+                if reference is None:
+                    # dynamic references (e.g. include of a variable) cannot be tracked
+                    keys = None
+                else:
+                    queue.append(reference)
+        hash = digest(sources)
+        self._template_hashes[name] = (hash, keys, uptodate)
+        return hash, keys
+
+    def template_hash(self, name: str) -> str:
+        """Returns a hash of a template and of every template it extends, includes or imports"""
+        return self.inspect_template(name)[0]
+
+    def page_hash(self, page, config, site, map):
+        template_hash, keys = self.inspect_template(page["template"])
+        if self.site_keys is not None:
+            keys = self.site_keys
+        return digest(page, config, template_hash, self.site_hash(site, keys))
+
+    def serve_key(self, page):
+        # templates are not watched, so a change must invalidate the cached page
+        return page["url"], self.template_hash(page["template"])
+
+    def output_path(self, page, build_location):
+        return super().output_path(page, build_location) / "index.html"
 
     def render_single(
         self, page: dict, config: dict, site: KartDict, map: KartMap
@@ -115,103 +526,342 @@ class DefaultSiteRenderer(DefaultFileRenderer):
         page = {**page["data"], "url": page["url"]}
         return template.render(page=page, config=config, site=site, url=map.url)
 
-    def _render_single(
-        self, key: str, config: dict, site: KartDict, map: KartMap, build_location: str
-    ):
-        """Renderers a single file and saves it to the disk"""
-        page = map[key]
-        if page["renderer"] != self.name:
-            return
-        rendered_file = self.render_single(page, config, site, map)
-        path = Path(build_location) / Path(*Path(page["url"]).parts[1:])
-        path = path / "index.html"
-        path.parent.mkdir(parents=True, exist_ok=True)
-        with path.open("w") as f:
-            f.write(rendered_file)
+    def generate_single(
+        self, page: dict, config: dict, site: KartDict, map: KartMap
+    ) -> Iterator[str]:
+        """Renders a single file in chunks, without creating the whole string"""
+        template = self.env.get_template(page["template"])
+        page = {**page["data"], "url": page["url"]}
+        return template.generate(page=page, config=config, site=site, url=map.url)
+
+    def write_page(self, writer, page, config, site, map, build_location):
+        if not self.stream:
+            return super().write_page(writer, page, config, site, map, build_location)
+        io_time = writer.io_time
+        start = perf_counter()
+        path = self.output_path(page, build_location)
+        writer.write_stream(path, self.generate_single(page, config, site, map))
+        self.render_time += perf_counter() - start - (writer.io_time - io_time)
 
     def render(
-        self, config: dict, site: KartDict, map: KartMap, build_location: str = "_site"
+        self,
+        config: dict,
+        site: KartDict,
+        map: KartMap,
+        build_location: str = "_site",
+        keys: list = None,
     ):
-        """Renderers all the files with a multiprocessing Pool for faster build times"""
-        if self.process_count == 1:
-            for key in map.keys():
-                self._render_single(key, config, site, map, build_location)
+        """Renderers all the files with a multiprocessing Pool for faster build times.
+
+        The site and the map are transferred to each worker only once,
+        then the pages are dispatched in chunks of ``chunk_size`` keys.
+        If ``stream`` is true the pages are written while they are rendered
+        """
+        from multiprocessing import Pool, get_start_method
+
+        self.configure(config)
+        if keys is None:
+            keys = map.keys()
+        keys = [key for key in keys if map[key]["renderer"] == self.name]
+        if self.process_count == 1 or len(keys) <= 1:
+            super().render(config, site, map, build_location, keys)
+            if config["verbose"]:
+                print(
+                    f"{self.name}: rendered {len(keys)} pages, {self.render_time:.2f}s "
+                    f"rendering and {self.io_time:.2f}s writing"
+                )
+            return
+        # the templates are loaded once, so that forked workers inherit them
+        # and the other ones find them in the bytecode cache
+        for template in {map[key]["template"] for key in keys}:
+            try:
+                self.env.get_template(template)
+            except TemplateNotFound:
+                pass
+        # the directories are created once, before starting the workers
+        writer = OutputWriter()
+        writer.create_directories(
+            self.output_path(map[key], build_location) for key in keys
+        )
+        global _worker_args
+        args = (self, config, site, map, build_location, writer.directories)
+        chunk_size = self.chunk_size or max(len(keys) // (self.process_count * 4), 1)
+        chunks = [keys[i : i + chunk_size] for i in range(0, len(keys), chunk_size)]
+        if get_start_method() == "fork":
+            _worker_args = args
+            pool = Pool(self.process_count)
         else:
-            with Pool(self.process_count) as p:
-                data = ((key, config, site, map, build_location) for key in map.keys())
-                p.starmap(self._render_single, data)
+            pool = Pool(self.process_count, initializer=_init_worker, initargs=(args,))
+        self.worker_stats = {}
+        self.render_time = self.io_time = 0
+        page_times = []
+        try:
+            with pool:
+                for result in pool.imap_unordered(_render_chunk, chunks):
+                    pid, count, elapsed, render_time, io_time = result[:5]
+                    times, highlights = result[5:]
+                    if highlights:
+                        add_highlights(highlights, config)
+                    page_times.extend(times)
+                    pages, total = self.worker_stats.get(pid, (0, 0))
+                    self.worker_stats[pid] = (pages + count, total + elapsed)
+                    self.render_time += render_time
+                    self.io_time += io_time
+        finally:
+            _worker_args = None
+        self.page_times = page_times
+        if not config["verbose"]:
+            return
+        for pid, (pages, elapsed) in self.worker_stats.items():
+            print(
+                f"{self.name}: worker {pid} rendered {pages} pages "
+                f"in {elapsed:.2f}s ({pages / max(elapsed, 1e-9):.0f} pages/s)"
+            )
+        print(
+            f"{self.name}: {self.render_time:.2f}s rendering "
+            f"and {self.io_time:.2f}s writing across all workers"
+        )
 
 
 class DefaultFeedRenderer(DefaultFileRenderer):
-    """Renders an atom feed file"""
+    """Renders an atom feed file.
 
-    def __init__(self, name: str = "default_feed_renderer"):
+    The xml of every entry is cached and shared by all the feeds. If ``cache`` is
+    true the cache is saved in the cache folder and reused by the next builds,
+    otherwise it is kept only by the development server
+    """
+
+    def __init__(self, name: str = "default_feed_renderer", cache: bool = False):
         """Initializes renderer. Sets the ``name`` and ``content_type`` variables"""
         self.name = name
         self.content_type = "application/xml"
+        self.cache = cache
+        self.entry_cache = LRUCache(maxsize=16384)
+        self._cache_path = None
+        self._indexes = {}
+
+    def render(self, config, site, map, build_location, keys=None):
+        path = None
+        if self.cache:
+            path = Path(config["cache_location"]) / f"{self.name}.json"
+            if path != self._cache_path:
+                self.entry_cache.load(path)
+                self._cache_path = path
+        super().render(config, site, map, build_location, keys)
+        if path is not None:
+            self.entry_cache.save(path)
+
+    def page_hash(self, page, config, site, map):
+        collections = [site[x] for x in page["data"]["collections"]]
+        return digest(page, config, collections)
+
+    def taxonomy_index(self, site: KartDict, collection: str, taxonomy: str):
+        """Returns the index built by TaxonomyIndexer, or builds it only once
+        for all the feeds of the taxonomy"""
+        key = f"{collection}_by_{taxonomy}"
+        if key in site:
+            return site[key]
+        items, index = self._indexes.get(key, (None, None))
+        if items is not site[collection]:
+            index = taxonomy_index(site[collection], taxonomy)
+            self._indexes[key] = (site[collection], index)
+        return index
+
+    def feed_entries(self, page: dict, site: KartDict, map: KartMap) -> list:
+        """Returns the ``limit`` most recent items of the feed"""
+        data = page["data"]
+        entries = []
+        for collection in data["collections"]:
+            if "taxonomy" in data:
+                index = self.taxonomy_index(site, collection, data["taxonomy"])
+                items = index.get(data["term"], [])
+            else:
+                items = site[collection]
+            entries.extend((collection, object) for object in items)
+        limit = data.get("limit")
+        if limit is None:
+            return sorted(entries, key=lambda x: x[1]["date"], reverse=True)
+        return heapq.nlargest(limit, entries, key=lambda x: x[1]["date"])
+
+    def render_entry(
+        self, url: str, entry: dict, timezone: str, tzinfo: tzinfo = None
+    ) -> str:
+        """Creates the xml of a single entry of the feed.
+        ``tzinfo`` is the time zone named by ``timezone``"""
+        title = entry["title"] if "title" in entry.keys() else entry["name"]
+        description = entry.get("description")
+        key = digest(url, title, entry["date"], description, timezone)
+        xml = self.entry_cache.get(key)
+        if xml is not None:
+            return xml
+        entry_time = datetime.combine(entry["date"], time(12))
+        entry_time = entry_time.replace(tzinfo=tzinfo)
+        xml = [
+            "<entry>",
+            f"<id>{url}</id>",
+            f"<title>{title}</title>",
+            f"<updated>{entry_time.isoformat()}</updated>",
+        ]
+        if description is not None:
+            xml.append(f"<summary>{description}</summary>")
+        xml.append(f'<link href="{url}" rel="alternate"/>')
+        xml.append("</entry>")
+        xml = "".join(xml)
+        self.entry_cache.set(key, xml)
+        return xml
 
     def render_single(
         self, page: dict, config: dict, site: KartDict, map: KartMap
     ) -> str:
         """Creates the atom feeds"""
-        feed_entries = []
-        for collection in page["data"]["collections"]:
-            for object in site[collection]:
-                feed_entries.append([map.url(collection, object["slug"]), object])
-        feed_entries.sort(key=lambda x: x[1]["date"], reverse=True)
-        atom = '<feed xmlns="http://www.w3.org/2005/Atom">'
-        atom += f'<id>"{map.url("/")}"</id>'
-        atom += f"<title>{config['name']}</title>"
+        from dateutil import tz
+
         timezone = config["timezone"]
-        updated_time = datetime.now().replace(tzinfo=tz.gettz(timezone))
-        atom += f"<updated>{updated_time.isoformat()}</updated>"
-        atom += f'<link href="{map.url("/")}"/>'
-        atom += f'<link href="{map.url(page["url"])}" rel="self"/>'
-        for url, entry in feed_entries:
-            atom += "<entry>"
-            atom += f"<id>{url}</id>"
-            title = entry["title"] if "title" in entry.keys() else entry["name"]
-            atom += f"<title>{title}</title>"
-            entry_time = datetime.combine(entry["date"], time(12))
-            entry_time.replace(tzinfo=tz.gettz(timezone))
-            atom += f"<updated>{entry_time.isoformat()}</updated>"
-            if "description" in entry.keys():
-                atom += f'<summary>{entry["description"]}</summary>'
-            atom += f'<link href="{url}" link="alternate"/>'
-            atom += "</entry>"
-        atom += "</feed>"
-        return atom
+        tzinfo = tz.gettz(timezone)
+        updated_time = datetime.now().replace(tzinfo=tzinfo)
+        atom = [
+            '<feed xmlns="http://www.w3.org/2005/Atom">',
+            f'<id>"{map.url("/")}"</id>',
+            f"<title>{config['name']}</title>",
+            f"<updated>{updated_time.isoformat()}</updated>",
+            f'<link href="{map.url("/")}"/>',
+            f'<link href="{map.url(page["url"])}" rel="self"/>',
+        ]
+        for collection, entry in self.feed_entries(page, site, map):
+            url = map.url(collection, entry["slug"])
+            atom.append(self.render_entry(url, entry, timezone, tzinfo))
+        atom.append("</feed>")
+        return "".join(atom)
 
 
 class DefaultSitemapRenderer(DefaultFileRenderer):
-    """Renders the sitemap of the site"""
+    """Renders the sitemap of the site.
+
+    If it has more than ``shard_size`` urls, it is split in multiple files
+    (optionally compressed with ``gzip``) next to it, e.g. ``sitemap-1.xml``,
+    and the sitemap becomes the index of these files
+    """
 
-    def __init__(self, name: str = "default_sitemap_renderer"):
+    def __init__(
+        self,
+        name: str = "default_sitemap_renderer",
+        renderers: list = ["default_site_renderer"],
+        shard_size: int = 50000,
+        gzip: bool = False,
+    ):
         """Initializes renderer. Sets the ``name`` and ``content_type`` variables"""
         self.name = name
         self.content_type = "application/xml"
+        self.renderers = renderers
+        self.shard_size = shard_size
+        self.gzip = gzip
 
-    def render_single(self, page: dict, config: dict, site: KartDict, map: KartMap):
-        """Uses the site ``map`` variable to create the sitemap"""
-        sitemap = '<?xml version="1.0" encoding="UTF-8"?>'
-        sitemap += '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
-        for x in map:
-            if x["renderer"] != "default_site_renderer":
+    def sitemap_pages(self, map: KartMap) -> Iterator[dict]:
+        """Yields the pages of the sitemap, skipping the urls with wildcards"""
+        for page in map:
+            if page["renderer"] not in self.renderers:
+                continue
+            if "*" in page["url"] or "?" in page["url"]:
                 continue
-            sitemap += f"<url><loc>{map.url(x['url'])}</loc></url>"
-        sitemap += "</urlset>"
-        return sitemap
+            yield page
+
+    def lastmod(self, page: dict) -> Optional[str]:
+        """Returns the last modification date of a page, taken from the
+        ``lastmod`` or the ``date`` field of its data"""
+        data = page["data"]
+        if not isinstance(data, dict):
+            return None
+        date = data.get("lastmod", data.get("date"))
+        if date is None:
+            return None
+        return date if isinstance(date, str) else date.isoformat()
+
+    def page_hash(self, page, config, site, map):
+        urls = [(x["url"], self.lastmod(x)) for x in self.sitemap_pages(map)]
+        return digest(page, config, urls)
+
+    def url_entries(self, map: KartMap) -> Iterator[str]:
+        for page in self.sitemap_pages(map):
+            lastmod = self.lastmod(page)
+            if lastmod is None:
+                yield f"<url><loc>{map.url(page['url'])}</loc></url>"
+            else:
+                yield (
+                    f"<url><loc>{map.url(page['url'])}</loc>"
+                    f"<lastmod>{lastmod}</lastmod></url>"
+                )
+
+    def generate_urlset(self, entries: Iterator[str]) -> Iterator[str]:
+        yield '<?xml version="1.0" encoding="UTF-8"?>'
+        yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        yield from entries
+        yield "</urlset>"
+
+    def generate_index(self, urls: list) -> Iterator[str]:
+        yield '<?xml version="1.0" encoding="UTF-8"?>'
+        yield '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        for url in urls:
+            yield f"<sitemap><loc>{url}</loc></sitemap>"
+        yield "</sitemapindex>"
+
+    def render_single(self, page: dict, config: dict, site: KartDict, map: KartMap):
+        """Uses the site ``map`` variable to create the sitemap.
+        The dev server always serves a single sitemap"""
+        return "".join(self.generate_urlset(self.url_entries(map)))
+
+    def render(self, config, site, map, build_location, keys=None):
+        """Streams the urls to the disk, one shard at a time.
+        The shards of the previous build which are no longer needed are deleted"""
+        pages = [map[key] for key in (map.keys() if keys is None else keys)]
+        with OutputWriter(workers=1) as writer:
+            for page in pages:
+                if page["renderer"] != self.name:
+                    continue
+                path = self.output_path(page, build_location)
+                count = sum(1 for _ in self.sitemap_pages(map))
+                shards = []
+                if count > self.shard_size:
+                    directory, name = page["url"].rsplit("/", 1)
+                    stem = name.rsplit(".", 1)[0]
+                    extension = ".xml.gz" if self.gzip else ".xml"
+                    entries = self.url_entries(map)
+                    for i in range(math.ceil(count / self.shard_size)):
+                        shard = path.with_name(f"{stem}-{i + 1}{extension}")
+                        urls = islice(entries, self.shard_size)
+                        writer.write_stream(
+                            shard, self.generate_urlset(urls), self.gzip
+                        )
+                        shards.append(shard)
+                    urls = [map.url(f"{directory}/{x.name}") for x in shards]
+                    writer.write_stream(path, self.generate_index(urls))
+                else:
+                    urls = self.url_entries(map)
+                    writer.write_stream(path, self.generate_urlset(urls))
+                self.remove_shards(path, shards)
+
+    def remove_shards(self, path: Path, shards: list):
+        """Deletes the shards of the sitemap at ``path`` which are not in ``shards``"""
+        stem = path.name.rsplit(".", 1)[0]
+        pattern = re.compile(re.escape(stem) + r"-\d+\.xml(\.gz)?")
+        for file in path.parent.glob(f"{stem}-*"):
+            if pattern.fullmatch(file.name) and file not in shards:
+                file.unlink()
 
 
 class DefaultStaticFilesRenderer(DefaultDirectoryRenderer):
     """Renders all files in the ``static`` directory"""
 
     def __init__(
-        self, name: str = "default_static_files_renderer", directory: str = "static"
+        self,
+        name: str = "default_static_files_renderer",
+        directory: str = "static",
+        hardlink: bool = False,
     ):
-        """Initializes renderer. Sets the ``name``, ``dir`` and ``content_type`` variables"""
+        """Initializes renderer. Sets the ``name``, ``dir`` and ``content_type`` variables.
+        If ``hardlink`` is true files are hard linked instead of copied"""
         self.name = name
         self.dir = directory
+        self.hardlink = hardlink
         self.base_url = ""
 
 
@@ -219,9 +869,14 @@ class DefaultRootDirRenderer(DefaultDirectoryRenderer):
     """Renders all files in the ``root`` directory"""
 
     def __init__(
-        self, name: str = "default_root_dir_renderer", directory: str = "root"
+        self,
+        name: str = "default_root_dir_renderer",
+        directory: str = "root",
+        hardlink: bool = False,
     ):
-        """Initializes renderer. Sets the ``name``, ``dir`` and ``content_type`` variables"""
+        """Initializes renderer. Sets the ``name``, ``dir`` and ``content_type`` variables.
+        If ``hardlink`` is true files are hard linked instead of copied"""
         self.name = name
         self.dir = directory
+        self.hardlink = hardlink
         self.base_url = "/root"
@@ -0,0 +1,56 @@
+import queue
+import time
+import traceback
+from http.server import SimpleHTTPRequestHandler
+from typing import Callable
+
+from watchdog.observers import Observer
+
+
+class KartObserver(Observer):
+    """Extends whatchdog observer to execute a function after each batch of events.
+
+    The events are dispatched to the handlers as they arrive, but ``action`` is
+    executed only when no event has arrived for ``debounce`` seconds, or at most
+    ``max_delay`` seconds after the first event, so that many files changed at
+    once (e.g. by ``git checkout``) cause a single update
+    """
+
+    def __init__(self, action: Callable, debounce: float = 0.05, max_delay: float = 1):
+        """Initializes the observer with the ``action`` variable"""
+        super().__init__()
+        self.action = action
+        self.debounce = debounce
+        self.max_delay = max_delay
+
+    def dispatch_batch(self):
+        """Dispatches the events until none arrives for ``debounce`` seconds"""
+        self.dispatch_events(self.event_queue)
+        start = time.monotonic()
+        while self.should_keep_running():
+            time.sleep(self.debounce)
+            if self.event_queue.empty() or time.monotonic() - start > self.max_delay:
+                return
+            while not self.event_queue.empty():
+                self.dispatch_events(self.event_queue)
+
+    def run(self):
+        """Ovverrides Observer.run() to execute a function after each batch of events.
+        The function is always executed by this thread, so updates never overlap"""
+        while self.should_keep_running():
+            try:
+                self.dispatch_batch()
+                if self.should_keep_running():
+                    self.action()
+            except queue.Empty:
+                pass
+            except Exception:
+                print(traceback.format_exc())
+
+
+class KartRequestHandler(SimpleHTTPRequestHandler):
+    """Extends SimpleHTTPRequestHandler execute a function for each request"""
+
+    def do_GET(self):
+        """Executes self.action() for every get request"""
+        self.action(self, self.path)
@@ -1,58 +1,288 @@
+import errno
+import filecmp
+import fnmatch
+import gzip
+import hashlib
+import io
+import itertools
+import json
 import math
-import queue
-import traceback
+import os
+import re
+import shutil
+import sys
+import threading
 from collections import OrderedDict
-from datetime import datetime
-from http.server import SimpleHTTPRequestHandler
+from collections.abc import Mapping, MutableMapping
+from contextlib import contextmanager
+from copy import copy
+from datetime import date, datetime
 from pathlib import Path
-from typing import Callable, List
+from time import perf_counter, process_time
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Iterable, List, Optional, Tuple
 
-from watchdog.observers import Observer
 
+def __getattr__(name: str):
+    """The classes of the development server are imported from ``kart.server``
+    only when they are used, so that a build does not import watchdog"""
+    if name in ("KartObserver", "KartRequestHandler"):
+        from kart import server
 
-class KartObserver(Observer):
-    """Extends whatchdog observer to execute a function after each event"""
+        return getattr(server, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-    def __init__(self, action: Callable):
-        """Initializes the observer with the ``action`` variable"""
-        super().__init__()
-        self.action = action
 
-    def run(self):
-        """Ovverrides Observer.run() to execute an function each time an even is handled"""
-        while self.should_keep_running():
-            try:
-                self.dispatch_events(self.event_queue)
-                if self.event_queue.empty():
-                    self.action()
-            except queue.Empty:
-                pass
-            except Exception:
-                print(traceback.format_exc())
+class KartDict(dict):
+    """Subclass of dict with a custom iterator. Dictionaries keep the insertion
+    order, so it does not need the memory overhead of OrderedDict"""
+
+    def __iter__(self):
+        """Iterate over the dict values instead of the keys"""
+        return iter(self.values())
+
+
+class MapEntry(MutableMapping):
+    """Entry of the site map, which behaves like a dictionary with the ``url``,
+    ``data``, ``template`` and ``renderer`` keys but is stored in slots.
+
+    Other keys are kept in a dictionary created only when needed. Templates and
+    renderers are interned, so all the entries share the same strings
+    """
 
+    __slots__ = ("url", "data", "template", "renderer", "extra")
+    fields = ("url", "data", "template", "renderer")
 
-class KartRequestHandler(SimpleHTTPRequestHandler):
-    """Extends SimpleHTTPRequestHandler execute a function for each request"""
+    def __init__(self, url: str, data, template: str, renderer: str, **extra):
+        self.url = url
+        self.data = data
+        self.template = sys.intern(template) if isinstance(template, str) else template
+        self.renderer = sys.intern(renderer) if isinstance(renderer, str) else renderer
+        self.extra = extra or None
 
-    def do_GET(self):
-        """Executes self.action() for every get request"""
-        self.action(self, self.path)
+    def __getitem__(self, key):
+        if key in MapEntry.fields:
+            return getattr(self, key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
 
+    def __setitem__(self, key, value):
+        if key in MapEntry.fields:
+            setattr(self, key, value)
+        elif self.extra is None:
+            self.extra = {key: value}
+        else:
+            self.extra[key] = value
 
-class KartDict(OrderedDict):
-    """Subclass of OrderedDict with a custom iterator"""
+    def __delitem__(self, key):
+        if key in MapEntry.fields or self.extra is None:
+            raise KeyError(key)
+        del self.extra[key]
 
     def __iter__(self):
-        """Iterate over the dict values instead of the keys"""
-        return iter(self.values())
+        yield from MapEntry.fields
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return len(MapEntry.fields) + len(self.extra or ())
+
+    def copy(self) -> "MapEntry":
+        """Returns a shallow copy, like dict.copy()"""
+        entry = MapEntry.__new__(MapEntry)
+        for field in MapEntry.__slots__:
+            setattr(entry, field, getattr(self, field))
+        if self.extra is not None:
+            entry.extra = dict(self.extra)
+        return entry
+
+    __copy__ = copy
+
+    def to_dict(self) -> dict:
+        """Returns the equivalent dictionary, used to serialize the entry"""
+        return dict(self)
+
+    def __repr__(self) -> str:
+        """Same as the representation of the equivalent dictionary,
+        so that digest() gives the same hash for both"""
+        return repr(self.to_dict())
+
+
+def json_default(object):
+    """``default`` function for json.dumps() which serializes map entries"""
+    if isinstance(object, MapEntry):
+        return object.to_dict()
+    raise TypeError(f"Object of type {type(object).__name__} is not JSON serializable")
+
+
+def copy_entry(entry: Mapping) -> Mapping:
+    """Returns a copy of a map entry and of its data, which can be modified
+    without changing the original"""
+    entry = entry.copy()
+    if "data" in entry:
+        entry["data"] = copy(entry["data"])
+    return entry
+
+
+class LRUCache:
+    """Thread safe cache that holds at most ``maxsize`` items,
+    discarding the least recently used ones"""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        # items set while recording, see start_recording()
+        self.recorded = None
+
+    def get(self, key, default=None):
+        """Returns the cached value of ``key``, or ``default`` if it is not cached"""
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return self.data[key]
+
+    def set(self, key, value):
+        """Caches ``value`` under ``key``"""
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+            if self.recorded is not None:
+                self.recorded[key] = value
+
+    def update(self, items: dict):
+        """Caches every item of ``items``"""
+        for key, value in items.items():
+            self.set(key, value)
+
+    def start_recording(self):
+        """Records the items set from now on, e.g. to send them to another process"""
+        with self.lock:
+            self.recorded = {}
+
+    def stop_recording(self) -> dict:
+        """Stops recording and returns the items set since start_recording()"""
+        with self.lock:
+            recorded, self.recorded = self.recorded or {}, None
+        return recorded
+
+    def clear(self):
+        """Removes every item from the cache"""
+        with self.lock:
+            self.data.clear()
+
+    def load(self, path: Path):
+        """Loads the items saved by save(), if the file exists"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                items = json.load(f)
+            data = OrderedDict(
+                (tuple(key) if isinstance(key, list) else key, value)
+                for key, value in items
+            )
+        except (OSError, ValueError, TypeError):
+            return
+        with self.lock:
+            data.update(self.data)
+            self.data = data
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def save(self, path: Path):
+        """Saves the items of the cache in a json file. The keys must be strings
+        or tuples of strings, and the values must be strings"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            items = list(self.data.items())
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(items, f)
+        os.replace(f"{path}.tmp", path)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+class FileCache:
+    """Persistent cache of the data parsed from files, stored in a sqlite database.
+
+    An entry is valid as long as the modification time and the size of its file do
+    not change. If ``verify_hash`` is true the hash of the content is checked too
+    """
+
+    def __init__(self, path: Path, verify_hash: bool = False):
+        import sqlite3
+
+        self.path = Path(path)
+        self.verify_hash = verify_hash
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files (namespace TEXT, path TEXT, "
+            "mtime INTEGER, size INTEGER, hash TEXT, data BLOB, "
+            "PRIMARY KEY (namespace, path))"
+        )
+        self.lock = threading.Lock()
+
+    def signature(self, file: Path) -> tuple:
+        """Returns the modification time, the size and the hash of a file"""
+        stat = file.stat()
+        hash = None
+        if self.verify_hash:
+            hash = hashlib.sha1(file.read_bytes()).hexdigest()
+        return stat.st_mtime_ns, stat.st_size, hash
+
+    def get(self, namespace: str, file: Path, signature: tuple) -> Tuple[bool, object]:
+        """Returns a tuple ``(found, data)`` with the cached data of a file"""
+        import pickle
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT mtime, size, hash, data FROM files "
+                "WHERE namespace = ? AND path = ?",
+                (namespace, str(file)),
+            ).fetchone()
+        if row is None or tuple(row[:3]) != signature:
+            return False, None
+        return True, pickle.loads(row[3])
+
+    def set(self, namespace: str, file: Path, signature: tuple, data):
+        """Stores the data parsed from a file"""
+        import pickle
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, str(file), *signature, pickle.dumps(data)),
+            )
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
 
 
 class KartMap(KartDict):
-    """Custom dictionary that holds the site map"""
+    """Custom dictionary that holds the site map.
+
+    Every map has a different ``generation``, which identifies it in the caches
+    without keeping it alive
+    """
+
+    _generations = itertools.count()
 
     def __init__(self, initial_data: dict = {}, site_url: str = "", *args, **kwargs):
         super().__init__(initial_data, *args, **kwargs)
         self.site_url = site_url
+        self.generation = next(KartMap._generations)
 
     def url(self, *name: List[str]) -> str:
         """Takes as input the slug of a page and returns its absolute url"""
@@ -71,6 +301,160 @@ class KartMap(KartDict):
         return ""
 
 
+class RouteTable:
+    """Resolves the urls requested to the dev server to the slugs of the map.
+
+    Urls are looked up in a dictionary, then the urls containing ``*`` or ``?``
+    are tried in map order. They are compiled once in a single regular expression
+    """
+
+    def __init__(self, map: KartMap):
+        self.urls = {}
+        wildcards = {}
+        for slug, page in map.items():
+            self.urls[page["url"]] = slug
+            if "*" in page["url"] or "?" in page["url"]:
+                wildcards[page["url"]] = slug
+        self.slugs = list(wildcards.values())
+        self.regex = None
+        if wildcards:
+            self.regex = re.compile(
+                "|".join(
+                    f"(?P<r{i}>{fnmatch.translate(url)})"
+                    for i, url in enumerate(wildcards)
+                )
+            )
+
+    def resolve(self, url: str) -> Optional[str]:
+        """Returns the slug of the page that serves ``url``, if any"""
+        if url in self.urls:
+            return self.urls[url]
+        if self.regex:
+            match = self.regex.match(url)
+            if match:
+                return self.slugs[int(match.lastgroup[1:])]
+        return None
+
+
+class Profiler:
+    """Records the wall and cpu time spent by each phase of a build,
+    by each miner, modifier, mapper and renderer and by each page"""
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.events = []
+        self.pages = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def describe(object) -> str:
+        """Returns a readable name of a miner, mapper, modifier or renderer"""
+        for attribute in ("name", "collection", "dir"):
+            value = getattr(object, attribute, None)
+            if isinstance(value, (str, Path)):
+                return f"{type(object).__name__}({value})"
+        return type(object).__name__
+
+    @contextmanager
+    def record(self, category: str, name: str):
+        """Context manager that records the time spent inside it"""
+        start, cpu = perf_counter(), process_time()
+        try:
+            yield
+        finally:
+            event = {
+                "category": category,
+                "name": name,
+                "start": start - self.start,
+                "wall": perf_counter() - start,
+                "cpu": process_time() - cpu,
+                "thread": threading.get_ident(),
+            }
+            with self.lock:
+                self.events.append(event)
+
+    def add_pages(self, renderer: str, pages: list):
+        """Adds the ``(url, template, wall, cpu)`` timings of the pages of a renderer"""
+        for url, template, wall, cpu in pages:
+            self.pages.append(
+                {
+                    "url": url,
+                    "template": template,
+                    "renderer": renderer,
+                    "wall": wall,
+                    "cpu": cpu,
+                }
+            )
+
+    def templates(self) -> list:
+        """Returns the total time spent rendering each template"""
+        templates = {}
+        for page in self.pages:
+            name = page["template"] or page["renderer"]
+            x = templates.setdefault(name, {"template": name, "pages": 0})
+            x["pages"] += 1
+            x["wall"] = x.get("wall", 0) + page["wall"]
+            x["cpu"] = x.get("cpu", 0) + page["cpu"]
+        return sorted(templates.values(), key=lambda x: x["wall"], reverse=True)
+
+    def report(self) -> dict:
+        return {
+            "events": sorted(self.events, key=lambda x: x["start"]),
+            "pages": sorted(self.pages, key=lambda x: x["wall"], reverse=True),
+            "templates": self.templates(),
+        }
+
+    def summary(self, top: int = 10) -> str:
+        """Returns a human readable summary with the ``top`` slowest pages and templates"""
+        lines = []
+        report = self.report()
+        for x in report["events"]:
+            lines.append(
+                f"{x['category']:>9} {x['name']:<50} "
+                f"{x['wall']:8.3f}s wall {x['cpu']:8.3f}s cpu"
+            )
+        lines.append(f"Slowest {top} pages:")
+        for x in report["pages"][:top]:
+            lines.append(
+                f"{x['wall']:8.3f}s wall {x['cpu']:8.3f}s cpu  "
+                f"{x['url']} ({x['template'] or x['renderer']})"
+            )
+        lines.append(f"Slowest {top} templates:")
+        for x in report["templates"][:top]:
+            lines.append(
+                f"{x['wall']:8.3f}s wall {x['cpu']:8.3f}s cpu  "
+                f"{x['template']} ({x['pages']} pages)"
+            )
+        return "\n".join(lines)
+
+    def save(self, path: Path):
+        """Saves the report as json"""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def save_trace(self, path: Path):
+        """Saves the events in the Chrome trace event format,
+        which can be opened by chrome://tracing and Perfetto"""
+        events = []
+        for x in self.events:
+            events.append(
+                {
+                    "name": x["name"],
+                    "cat": x["category"],
+                    "ph": "X",
+                    "ts": x["start"] * 1e6,
+                    "dur": x["wall"] * 1e6,
+                    "pid": os.getpid(),
+                    "tid": x["thread"],
+                    "args": {"cpu": x["cpu"]},
+                }
+            )
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events}, f)
+
+
 def paginate(
     objects: list,
     per_page: int,
@@ -86,35 +470,413 @@ def paginate(
         objects[x * per_page : (x + 1) * per_page]
         for x in range(max(math.ceil(len(objects) / per_page), 1))
     ]
+    # the slugs are shared by the map and the links to the previous and next pages
+    slugs = [""] + [f"{slug}.{i}" for i in range(1, len(paginated_objects) + 1)] + [""]
     for i, objects in enumerate(paginated_objects, 1):
-
-        if i > 1:
-            previous_page = f"{slug}.{i-1}"
-        else:
-            previous_page = ""
-
-        if i < len(paginated_objects):
-            next_page = f"{slug}.{i+1}"
-        else:
-            next_page = ""
-
         paginator = {
             "objects": objects,
             "index": i,
-            "next_page": next_page,
-            "previous_page": previous_page,
-        }
-        data = {"paginator": paginator}
-        data.update(additional_data)
-        urls[f"{slug}.{i}"] = {
-            "url": base_url + f"{i}/" if i > 1 else base_url,
-            "data": data,
-            "template": template,
-            "renderer": renderer,
+            "next_page": slugs[i + 1],
+            "previous_page": slugs[i - 1],
         }
+        data = {"paginator": paginator, **additional_data}
+        urls[slugs[i]] = MapEntry(
+            url=base_url + f"{i}/" if i > 1 else base_url,
+            data=data,
+            template=template,
+            renderer=renderer,
+        )
     return urls
 
 
+# compiled jinja templates of the contents rendered by render_string()
+template_cache = LRUCache(maxsize=1024)
+
+
+def render_string(context, string: str) -> str:
+    """Renders a string as a jinja template using the given jinja context.
+    The compiled templates are cached by the hash of the string, so every string
+    is compiled only once"""
+    string = str(string)
+    key = (context.environment, digest(string))
+    template = template_cache.get(key)
+    if template is None:
+        template = context.environment.from_string(string)
+        template_cache.set(key, template)
+    return template.render(context)
+
+
+def split_front_matter(text: str, delimiter: str = "---") -> Tuple[str, str]:
+    """Splits a markup file in its front matter and its content.
+    The front matter is enclosed between the first two delimiters"""
+    start = text.find(delimiter)
+    if start == -1:
+        raise ValueError("The file has no front matter")
+    start += len(delimiter)
+    end = text.find(delimiter, start)
+    if end == -1:
+        return text[start:], ""
+    return text[start:end], text[end + len(delimiter) :]
+
+
+def read_front_matter(
+    path: Path, delimiter: str = "---", chunk_size: int = 4096
+) -> Tuple[str, int]:
+    """Reads a markup file in chunks only up to the end of its front matter.
+    Returns the front matter and the offset in bytes of the content"""
+    delimiter = delimiter.encode()
+    header = b""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            header += chunk
+            start = header.find(delimiter)
+            if start != -1:
+                start += len(delimiter)
+                end = header.find(delimiter, start)
+                if end != -1:
+                    return decode_text(header[start:end]), end + len(delimiter)
+            if not chunk:
+                if start == -1:
+                    raise ValueError("The file has no front matter")
+                return decode_text(header[start:]), len(header)
+
+
+def decode_text(data: bytes) -> str:
+    """Decodes bytes like a file opened in text mode, with universal newlines"""
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
+
+# contents loaded by LazyContent, shared by all the pages that use them
+content_cache = LRUCache(maxsize=256)
+
+
+class LazyContent:
+    """Content of a file that is read from the disk only when it is used.
+
+    It stores only the position of the content in the file and behaves like
+    the string it represents. The modification time of the file is part of
+    its representation, so that digest() changes when the file changes
+    """
+
+    __slots__ = ("path", "offset", "length", "mtime")
+
+    def __init__(self, path: Path, offset: int, length: int, mtime: int):
+        self.path = str(path)
+        self.offset = offset
+        self.length = length
+        self.mtime = mtime
+
+    def __str__(self) -> str:
+        key = (self.path, self.offset, self.length, self.mtime)
+        content = content_cache.get(key)
+        if content is None:
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                content = decode_text(f.read(self.length))
+            content_cache.set(key, content)
+        return content
+
+    def __repr__(self) -> str:
+        return f"LazyContent({self.path!r}, {self.offset}, {self.length}, {self.mtime})"
+
+    def __getattr__(self, name: str):
+        """Delegates the methods of str, like ``split()``"""
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(str(self), name)
+
+    def __len__(self) -> int:
+        return len(str(self))
+
+    def __getitem__(self, key):
+        return str(self)[key]
+
+    def __contains__(self, item) -> bool:
+        return item in str(self)
+
+    def __add__(self, other) -> str:
+        return str(self) + other
+
+    def __radd__(self, other) -> str:
+        return other + str(self)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (str, LazyContent)):
+            return str(self) == str(other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(str(self))
+
+
+def taxonomy_index(items: list, taxonomy: str) -> KartDict:
+    """Maps each term of a taxonomy to the list of items that have it,
+    in the order of ``items``. It runs in linear time"""
+    index = KartDict()
+    for item in items:
+        terms = item.get(taxonomy)
+        if isinstance(terms, str):
+            terms = [terms]
+        elif not isinstance(terms, list):
+            continue
+        for term in dict.fromkeys(terms):
+            index.setdefault(term, []).append(item)
+    return index
+
+
+# set to False the first time the filesystem refuses to clone a file
+# devices of the filesystems that do not support reflinks
+_reflink_unsupported = set()
+
+
+def reflink(source: Path, destination: Path) -> bool:
+    """Clones a file with the linux FICLONE ioctl, sharing its blocks
+    with the source on copy-on-write filesystems. Returns whether it succeeded.
+
+    Reflinks are not tried again on a filesystem that does not support them,
+    while other errors (e.g. copying across filesystems) affect only one file"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    device = os.stat(Path(destination).parent).st_dev
+    if device in _reflink_unsupported:
+        return False
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), 0x40049409, src.fileno())  # FICLONE
+            return True
+        except OSError as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY):
+                _reflink_unsupported.add(device)
+    os.unlink(destination)
+    return False
+
+
+def copy_file(source: Path, destination: Path, hardlink: bool = False) -> bool:
+    """Copies a file, unless the destination already has the same content.
+    Returns whether the file has been copied"""
+    try:
+        stat = destination.stat()
+    except FileNotFoundError:
+        pass
+    else:
+        source_stat = source.stat()
+        if stat.st_size == source_stat.st_size:
+            if stat.st_mtime_ns == source_stat.st_mtime_ns:
+                return False
+            if filecmp.cmp(source, destination, shallow=False):
+                # the next builds compare only the modification times
+                os.utime(destination, ns=(stat.st_atime_ns, source_stat.st_mtime_ns))
+                return False
+        # never write through a hard link, it could be shared with the source
+        destination.unlink()
+    if hardlink:
+        try:
+            os.link(source, destination)
+            return True
+        except OSError:
+            pass
+    if reflink(source, destination):
+        shutil.copystat(source, destination)
+    else:
+        shutil.copy2(source, destination)
+    return True
+
+
+def copy_directory(
+    source: Path, destination: Path, hardlink: bool = False, workers: int = 8
+) -> Tuple[int, int]:
+    """Copies every file of a directory in parallel, skipping the files that are
+    already up to date. Returns the number of bytes copied and skipped.
+
+    Files are hard linked if ``hardlink`` is true, reflinked if the filesystem
+    supports it and copied otherwise. Symbolic links are followed"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    source = Path(source)
+    destination = Path(destination)
+    if not source.is_dir():
+        raise FileNotFoundError(f"Cannot copy {source}: not a directory")
+    files = []
+    for directory, _, filenames in os.walk(source, followlinks=True):
+        target = destination / Path(directory).relative_to(source)
+        target.mkdir(parents=True, exist_ok=True)
+        files.extend((Path(directory, x), target / x) for x in filenames)
+
+    def copy(paths):
+        copied = copy_file(*paths, hardlink)
+        return copied, paths[0].stat().st_size
+
+    copied = skipped = 0
+    with ThreadPoolExecutor(workers) as executor:
+        for was_copied, size in executor.map(copy, files):
+            if was_copied:
+                copied += size
+            else:
+                skipped += size
+    return copied, skipped
+
+
+class OutputWriter:
+    """Writes the rendered files to the disk as utf-8 with a pool of threads,
+    so that rendering and I/O can overlap.
+
+    Each directory is created only once and ``io_time`` holds the total time
+    spent writing the files"""
+
+    def __init__(self, workers: int = 4, max_pending: int = 256):
+        self.workers = workers
+        self.io_time = 0
+        self.directories = set()
+        self._lock = threading.Lock()
+        # bounds the number of files waiting to be written
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._error = None
+        self._executor = None
+
+    def __enter__(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        if self.workers > 1:
+            self._executor = ThreadPoolExecutor(self.workers)
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Waits for the pending writes, raising the first error"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def create_directories(self, paths: list):
+        """Creates the parent directories of all ``paths`` in one pass"""
+        for directory in sorted({Path(path).parent for path in paths}):
+            self.create_directory(directory)
+
+    def create_directory(self, directory: Path):
+        if directory in self.directories:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self.directories.add(directory)
+            self.directories.update(directory.parents)
+
+    @contextmanager
+    def _open(self, path: Path):
+        """Opens a temporary file, which replaces ``path`` only once it has been
+        written. Replacing the file also breaks its hard links to the previous
+        build, see Kart.build()"""
+        self.create_directory(path.parent)
+        temporary = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            with temporary.open("wb") as f:
+                yield f
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                temporary.unlink()
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _write(self, path: Path, data: bytes):
+        try:
+            start = perf_counter()
+            with self._open(path) as f:
+                f.write(data)
+            elapsed = perf_counter() - start
+            with self._lock:
+                self.io_time += elapsed
+        except Exception as error:
+            with self._lock:
+                if self._error is None:
+                    self._error = error
+        finally:
+            self._pending.release()
+
+    def write(self, path: Path, content: str):
+        """Writes ``content`` to ``path`` in the background"""
+        data = content.encode("utf-8")
+        self._pending.acquire()
+        if self._executor is None:
+            self._write(path, data)
+            # without threads the error is raised immediately
+            return self.close()
+        self._executor.submit(self._write, path, data)
+
+    def write_stream(self, path: Path, chunks: Iterable[str], compress: bool = False):
+        """Writes the chunks of a template rendered with ``Template.generate``
+        to ``path`` as soon as they are produced, compressing them with gzip if
+        ``compress`` is true. Only the time spent writing is counted in ``io_time``.
+        If rendering fails the previous file is left untouched"""
+        elapsed = 0
+        start = perf_counter()
+        with self._open(path) as f:
+            # mtime=0 makes the output reproducible
+            output = gzip.GzipFile(fileobj=f, mode="wb", mtime=0) if compress else f
+            elapsed += perf_counter() - start
+            for chunk in chunks:
+                start = perf_counter()
+                output.write(chunk.encode("utf-8"))
+                elapsed += perf_counter() - start
+            if compress:
+                output.close()
+        with self._lock:
+            self.io_time += elapsed
+
+
+def link_unchanged_files(directory: Path, reference: Path):
+    """Replaces the files of ``directory`` that have the same content as the
+    corresponding files of ``reference`` with hard links to them"""
+    directory = Path(directory)
+    reference = Path(reference)
+    for path, _, filenames in os.walk(directory):
+        for filename in filenames:
+            new = Path(path, filename)
+            old = reference / new.relative_to(directory)
+            try:
+                if os.path.samefile(new, old):
+                    continue
+                if not filecmp.cmp(new, old, shallow=False):
+                    continue
+            except OSError:
+                continue
+            temporary = new.with_name(new.name + ".kart-tmp")
+            try:
+                os.link(old, temporary)
+            except OSError:
+                shutil.copystat(old, new)
+                continue
+            os.replace(temporary, new)
+
+
+def exchange_paths(a: Path, b: Path) -> bool:
+    """Atomically exchanges two paths with the linux renameat2 syscall.
+    Returns whether it succeeded, it always fails on other platforms"""
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError):
+        return False
+    AT_FDCWD = -100
+    RENAME_EXCHANGE = 2
+    result = renameat2(
+        AT_FDCWD, os.fsencode(a), AT_FDCWD, os.fsencode(b), RENAME_EXCHANGE
+    )
+    return result == 0
+
+
 def date_to_string(date: datetime) -> str:
     "Formats a date to be displayed"
     return date.strftime("%b %d, %Y")
@@ -127,6 +889,51 @@ def id_from_path(base_dir: Path, path: Path) -> str:
     return id
 
 
+def stable_repr(object, _parents: set = None) -> str:
+    """Returns a representation of an object which, unlike repr(), does not depend
+    on memory addresses or on the order of sets, so it is the same in every build"""
+    if isinstance(object, (str, int, float, type(None), bytes, date, Path)):
+        return repr(object)
+    if isinstance(object, (FunctionType, BuiltinFunctionType, type, ModuleType)):
+        name = getattr(object, "__qualname__", object.__name__)
+        return f"{getattr(object, '__module__', None)}.{name}"
+    if isinstance(object, MethodType):
+        return stable_repr(object.__func__, _parents)
+    _parents = _parents or set()
+    if id(object) in _parents:
+        return "..."
+    _parents.add(id(object))
+    try:
+        if isinstance(object, Mapping):
+            items = (
+                f"{stable_repr(x, _parents)}: {stable_repr(y, _parents)}"
+                for x, y in object.items()
+            )
+            return "{" + ", ".join(items) + "}"
+        if isinstance(object, (list, tuple)):
+            return "[" + ", ".join(stable_repr(x, _parents) for x in object) + "]"
+        if isinstance(object, (set, frozenset)):
+            items = sorted(stable_repr(x, _parents) for x in object)
+            return "{" + ", ".join(items) + "}"
+        text = repr(object)
+        if " at 0x" not in text:
+            return text
+        # the default repr() of objects includes their address
+        text = type(object).__qualname__
+        if hasattr(object, "__dict__"):
+            text += stable_repr(vars(object), _parents)
+        return text
+    finally:
+        _parents.discard(id(object))
+
+
+def digest(*objects) -> str:
+    """Returns a hash of the given objects, used to detect changes between builds"""
+    if len(objects) == 1 and isinstance(objects[0], str):
+        return hashlib.sha1(objects[0].encode("utf-8")).hexdigest()
+    return hashlib.sha1(stable_repr(objects).encode("utf-8")).hexdigest()
+
+
 def merge_dicts(a: dict, b: dict) -> dict:
     """Merge two dicts"""
     c = a.__class__()
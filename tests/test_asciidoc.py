@@ -0,0 +1,114 @@
+import subprocess
+import sys
+import threading
+
+import pytest
+from jinja2 import Environment
+
+from kart.ext import asciidoc
+from kart.ext.asciidoc import AsciidoctorConverter, asciidoc_to_toc
+
+
+def asciidoctor_available() -> bool:
+    try:
+        command = ["ruby", "-e", 'require "asciidoctor"']
+        return subprocess.run(command, capture_output=True).returncode == 0
+    except OSError:
+        return False
+
+
+# follows the protocol of ASCIIDOCTOR_WORKER, exiting when it reads "crash"
+FAKE_CONVERTER = """
+import html, json, sys
+for line in sys.stdin:
+    source = json.loads(line)["source"]
+    if source == "crash":
+        sys.exit(1)
+    titles = [x[3:] for x in source.splitlines() if x.startswith("== ")]
+    items = "".join(f'<li><a href="#_{x.lower()}">{x}</a></li>' for x in titles)
+    toc = f'<ul class="sectlevel1">{items}</ul>' if titles else ""
+    print(json.dumps({"html": f"<p>{html.escape(source)}</p>", "toc": toc}), flush=True)
+"""
+
+
+@pytest.fixture
+def converter(tmp_path):
+    script = tmp_path / "converter.py"
+    script.write_text(FAKE_CONVERTER)
+    converter = AsciidoctorConverter([sys.executable, str(script)], process_count=1)
+    yield converter
+    converter.close()
+
+
+def test_convert(converter):
+    assert converter.convert("a") == ("<p>a</p>", "")
+    assert converter.convert("b & c") == ("<p>b &amp; c</p>", "")
+    assert converter.convert("a") == ("<p>a</p>", "")
+    assert converter.cache.hits == 1
+    assert len(converter._processes) == 1
+
+
+def test_failed_process_is_replaced(converter):
+    first = converter.convert("first")
+    with pytest.raises(RuntimeError):
+        converter.convert("crash")
+    assert converter._processes == []
+    # the pool has a single process, so this would block without a new one
+    assert converter.convert("second") == ("<p>second</p>", "")
+    assert converter.convert("first") == first
+
+
+def test_concurrent_conversions(converter):
+    results = {}
+
+    def convert(i):
+        results[i] = converter.convert(f"document {i}")
+
+    threads = [threading.Thread(target=convert, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert results == {i: (f"<p>document {i}</p>", "") for i in range(8)}
+
+
+def test_toc(converter, monkeypatch):
+    monkeypatch.setattr(asciidoc, "converter", converter)
+    assert asciidoc_to_toc("= Title\n\n== Intro\n\n== Usage") == [
+        {"title": "Intro", "id": "_intro", "level": 2},
+        {"title": "Usage", "id": "_usage", "level": 2},
+    ]
+    assert asciidoc_to_toc("no sections") == []
+
+
+def test_page_toc_shares_the_conversion_of_the_html(converter, monkeypatch):
+    monkeypatch.setattr(asciidoc, "converter", converter)
+    env = Environment()
+    env.filters["html"] = asciidoc.asciidoc_to_html
+    env.filters["toc"] = asciidoc.asciidoc_page_toc
+    template = env.from_string("{{ content | html }}{{ content | toc }}")
+    config = {"code_highlighting": {"style": "default", "noclasses": False}}
+    output = template.render(content="== {{ title }}", title="Intro", config=config)
+    assert "== Intro" in output
+    assert "'id': '_intro'" in output
+    assert (converter.cache.hits, converter.cache.misses) == (1, 1)
+
+
+@pytest.mark.skipif(not asciidoctor_available(), reason="asciidoctor is not installed")
+def test_asciidoctor_worker(monkeypatch):
+    converter = AsciidoctorConverter(process_count=1)
+    monkeypatch.setattr(asciidoc, "converter", converter)
+    try:
+        source = "= Title\n\n== Intro\n\nSome *text*\n\n=== Details\n\nMore"
+        html, outline = converter.convert(source)
+        assert '<h2 id="_intro">Intro</h2>' in html
+        assert "<strong>text</strong>" in html
+        assert asciidoc_to_toc(source) == [
+            {"title": "Intro", "id": "_intro", "level": 2},
+            {"title": "Details", "id": "_details", "level": 3},
+        ]
+        # the process is reused for the next documents
+        assert "<p>Other</p>" in converter.convert("Other")[0]
+        assert len(converter._processes) == 1
+    finally:
+        converter.close()
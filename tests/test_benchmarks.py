@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from benchmarks import import_time, synthetic
+
+ROOT = Path(__file__).parent.parent
+
+
+def files(path: Path) -> dict:
+    return {
+        str(x.relative_to(path)): x.read_bytes() for x in path.rglob("*") if x.is_file()
+    }
+
+
+@pytest.mark.parametrize(
+    "generate, scale",
+    [
+        (synthetic.generate_blog, {"posts": 6, "tags": 3, "static": 3}),
+        (synthetic.generate_documentation, {"sections": 2, "pages": 2, "static": 3}),
+    ],
+)
+def test_synthetic_sites_are_reproducible_and_build(tmp_path, generate, scale):
+    generate(tmp_path / "first", **scale)
+    generate(tmp_path / "second", **scale)
+    assert files(tmp_path / "first") == files(tmp_path / "second")
+    assert len(list((tmp_path / "first" / "static" / "assets").rglob("*.bin"))) == 3
+    subprocess.run(
+        [sys.executable, "main.py", "build"],
+        cwd=tmp_path / "first",
+        env={**os.environ, "PYTHONPATH": str(ROOT)},
+        check=True,
+        capture_output=True,
+    )
+    assert (tmp_path / "first" / "_site" / "index.html").exists()
+
+
+def test_lazy_modules_are_not_imported():
+    times = import_time.import_times(import_time.STATEMENT)
+    for module in import_time.LAZY_MODULES:
+        assert not any(x == module or x.startswith(module + ".") for x in times)
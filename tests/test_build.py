@@ -0,0 +1,200 @@
+import json
+import shutil
+
+import pytest
+
+from kart import Kart, mappers, renderers
+from kart.miners import Miner
+from kart.renderers import DefaultSiteRenderer
+from kart.utils import Profiler, digest
+
+
+class DictMiner(Miner):
+    def __init__(self, data: dict):
+        self.data = data
+
+    def read_data(self, config):
+        pass
+
+    def collect(self, config):
+        return dict(self.data)
+
+    def start_watching(self, config, observer):
+        pass
+
+    def stop_watching(self, config):
+        pass
+
+
+def page(url, title):
+    return {
+        "url": url,
+        "data": {"title": title},
+        "template": "page.html",
+        "renderer": "default_site_renderer",
+    }
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "templates").mkdir()
+    (tmp_path / "templates" / "page.html").write_text(
+        "{{ page.title }}|{{ site.menu | join(',') }}"
+    )
+    miner = DictMiner({"menu": ["a"], "other": 1})
+    pages = {"index": page("/", "Home"), "about": page("/about/", "About")}
+    kart = Kart(
+        miners=[miner],
+        mappers=[mappers.ManualMapper(pages)],
+        renderers=[DefaultSiteRenderer(site_keys=["menu"])],
+    )
+    return kart, miner, pages
+
+
+def mtimes(path):
+    return {x: x.stat().st_mtime_ns for x in path.rglob("*.html")}
+
+
+def test_digest_is_stable():
+    class Item:
+        def __init__(self):
+            self.value = {"b", "a"}
+
+    assert digest(Item()) == digest(Item())
+    assert digest({"x": {3, 1, 2}}) == digest({"x": {2, 3, 1}})
+    assert digest({"x": 1}) != digest({"x": 2})
+
+
+def test_no_manifest_without_incremental(site):
+    kart, _, _ = site
+    kart.build()
+    assert (kart.build_location / "about" / "index.html").exists()
+    assert not kart.manifest_location.exists()
+
+
+def test_incremental_renders_changed_pages(site, tmp_path):
+    kart, miner, pages = site
+    kart.build(incremental=True)
+    manifest = json.loads(kart.manifest_location.read_text())
+    assert set(manifest["pages"]) == {"index", "about"}
+    before = mtimes(kart.build_location)
+
+    pages["about"]["data"]["title"] = "About us"
+    miner.data["other"] = 2  # not read by the templates
+    kart.build(incremental=True)
+    after = mtimes(kart.build_location)
+    index = kart.build_location / "index.html"
+    about = kart.build_location / "about" / "index.html"
+    assert after[index] == before[index]
+    assert about.read_text() == "About us|a"
+
+    miner.data["menu"] = ["a", "b"]
+    kart.build(incremental=True)
+    assert index.read_text() == "Home|a,b"
+
+
+def test_site_keys_are_read_from_the_templates(site):
+    kart, miner, pages = site
+    kart.renderers = [DefaultSiteRenderer()]
+    kart.build(incremental=True)
+    index = kart.build_location / "index.html"
+    before = mtimes(kart.build_location)
+    miner.data["other"] = 2
+    pages["about"]["data"]["title"] = "About us"
+    kart.build(incremental=True)
+    assert mtimes(kart.build_location)[index] == before[index]
+    miner.data["menu"] = ["a", "b"]
+    kart.build(incremental=True)
+    assert index.read_text() == "Home|a,b"
+
+
+def test_incremental_build_removes_deleted_pages(site):
+    kart, _, pages = site
+    kart.build(incremental=True)
+    pages["nested"] = page("/docs/nested/", "Nested")
+    kart.build(incremental=True)
+    # the output of a page can be removed by hand
+    shutil.rmtree(kart.build_location / "about")
+    del pages["about"]
+    del pages["nested"]
+    kart.build(incremental=True)
+    assert not (kart.build_location / "docs").exists()
+    assert not (kart.build_location / "about").exists()
+    assert (kart.build_location / "index.html").exists()
+
+
+def test_incremental_build_removes_deleted_static_files(site, tmp_path):
+    kart, _, _ = site
+    (tmp_path / "static" / "css").mkdir(parents=True)
+    (tmp_path / "static" / "css" / "style.css").write_text("body {}")
+    (tmp_path / "static" / "logo.svg").write_text("<svg/>")
+    kart.mappers.append(mappers.DefaultStaticFilesMapper())
+    kart.renderers.append(renderers.DefaultStaticFilesRenderer())
+    kart.build(incremental=True)
+    manifest = json.loads(kart.manifest_location.read_text())
+    assert sorted(manifest["pages"]["static"]["paths"]) == [
+        "static/css/style.css",
+        "static/logo.svg",
+    ]
+    (tmp_path / "static" / "css" / "style.css").unlink()
+    (tmp_path / "static" / "css").rmdir()
+    kart.build(incremental=True)
+    assert (kart.build_location / "static" / "logo.svg").exists()
+    assert not (kart.build_location / "static" / "css").exists()
+
+
+def test_manifest_skips_unregistered_renderers(site):
+    kart, _, pages = site
+    pages["feed"] = {**page("/feed/", "Feed"), "renderer": "missing"}
+    kart.build(incremental=True)
+    manifest = json.loads(kart.manifest_location.read_text())
+    assert "feed" not in manifest["pages"]
+
+
+def test_atomic_build_keeps_unchanged_files(site):
+    kart, _, pages = site
+    kart.build(atomic=True)
+    index = kart.build_location / "index.html"
+    about = kart.build_location / "about" / "index.html"
+    inode = index.stat().st_ino
+    mtime = index.stat().st_mtime_ns
+
+    pages["about"]["data"]["title"] = "About us"
+    kart.build(atomic=True)
+    assert index.stat().st_ino == inode
+    assert index.stat().st_mtime_ns == mtime
+    assert about.read_text() == "About us|a"
+    assert not kart.build_location.with_name("_site.staging").exists()
+    assert not kart.build_location.with_name("_site.old").exists()
+
+
+def test_atomic_incremental_build_removes_deleted_pages(site):
+    kart, _, pages = site
+    kart.build(incremental=True, atomic=True)
+    del pages["about"]
+    kart.build(incremental=True, atomic=True)
+    assert not (kart.build_location / "about").exists()
+    assert (kart.build_location / "index.html").read_text() == "Home|a"
+    assert not kart.build_location.with_name("_site.staging").exists()
+
+
+def test_profiled_build(site, tmp_path):
+    kart, _, _ = site
+    kart.profiler = Profiler()
+    kart.build()
+    report = kart.profiler.report()
+    phases = [x["name"] for x in report["events"] if x["category"] == "phase"]
+    assert phases == ["check_config", "mine_data", "create_map", "write"]
+    names = {x["name"] for x in report["events"]}
+    assert names >= {"DictMiner", "DefaultSiteRenderer(default_site_renderer)"}
+    assert sorted(x["url"] for x in report["pages"]) == ["/", "/about/"]
+    assert report["templates"][0]["template"] == "page.html"
+    assert report["templates"][0]["pages"] == 2
+    assert "Slowest 1 pages:" in kart.profiler.summary(top=1)
+
+    kart.profiler.save(tmp_path / "profile.json")
+    assert json.loads((tmp_path / "profile.json").read_text())["pages"]
+    kart.profiler.save_trace(tmp_path / "trace.json")
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    assert {x["ph"] for x in trace["traceEvents"]} == {"X"}
@@ -0,0 +1,215 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from kart import Kart, utils
+from kart.ext import documentation, markdown
+from kart.ext.documentation import DefaultDocumentationMiner
+from kart.utils import KartMap
+
+
+class Observer:
+    def __init__(self):
+        self.watched = []
+
+    def schedule(self, handler, path, **kwargs):
+        self.watched.append(str(path))
+
+
+def write_page(path, title):
+    path.write_text(f"---\ntitle: {title}\n---\n{title}\n")
+
+
+@pytest.fixture
+def config():
+    kart = Kart(config={"serving": True, "dev_mode": False})
+    kart.check_config()
+    return kart.config
+
+
+@pytest.fixture
+def miner(tmp_path, monkeypatch, config):
+    monkeypatch.chdir(tmp_path)
+    docs = tmp_path / "docs"
+    (docs / "guide").mkdir(parents=True)
+    write_page(docs / "index.md", "Index")
+    write_page(docs / "install.md", "Install")
+    write_page(docs / "guide" / "intro.md", "Intro")
+    (docs / "navigation.yml").write_text(
+        "- page: index.md\n- page: install.md\n- section: guide\n  name: Guide\n"
+    )
+    miner = DefaultDocumentationMiner()
+    miner.start_watching(config, Observer())
+    yield miner
+    miner.stop_watching(config)
+
+
+def update(miner, config, path):
+    miner.file_changed(Path(path))
+    return miner.collect(config)
+
+
+def toc(data):
+    return [(x["title"], x["level"]) for x in data["docs_global_toc"]]
+
+
+def test_changed_page_is_parsed_again(miner, config, tmp_path):
+    write_page(tmp_path / "docs" / "guide" / "intro.md", "Introduction")
+    data = update(miner, config, "docs/guide/intro.md")
+    assert data["docs"]["guide.intro"]["title"] == "Introduction"
+    assert miner.changed_keys() == {"docs", "docs_global_toc"}
+    miner.collect(config)
+    assert miner.changed_keys() == set()
+
+
+def test_added_page(miner, config, tmp_path):
+    # a section without navigation.yml lists its files
+    write_page(tmp_path / "docs" / "guide" / "usage.md", "Usage")
+    data = update(miner, config, "docs/guide/usage.md")
+    assert data["docs"]["guide.usage"]["title"] == "Usage"
+    assert ("Usage", 1) in toc(data)
+
+
+def test_deleted_page(miner, config, tmp_path):
+    (tmp_path / "docs" / "install.md").unlink()
+    data = update(miner, config, "docs/install.md")
+    assert "install" not in data["docs"]
+    assert toc(data) == [("Index", 0), ("Guide", 0), ("Intro", 1)]
+
+
+def test_navigation_is_read_again(miner, config, tmp_path, monkeypatch):
+    parsed = []
+    collect_single_file = DefaultDocumentationMiner.collect_single_file
+
+    def record(self, file, config):
+        parsed.append(file)
+        return collect_single_file(self, file, config)
+
+    monkeypatch.setattr(DefaultDocumentationMiner, "collect_single_file", record)
+    (tmp_path / "docs" / "navigation.yml").write_text(
+        "- section: guide\n  name: Guide\n- page: index.md\n"
+    )
+    data = update(miner, config, "docs/navigation.yml")
+    assert toc(data) == [("Guide", 0), ("Intro", 1), ("Index", 0)]
+    assert "install" not in data["docs"]
+    # the pages already parsed are not read again
+    assert parsed == []
+
+    (tmp_path / "docs" / "navigation.yml").write_text(
+        "- page: index.md\n- page: install.md\n"
+    )
+    data = update(miner, config, "docs/navigation.yml")
+    assert toc(data) == [("Index", 0), ("Install", 0)]
+    assert parsed == [Path("docs/install.md")]
+
+
+def test_unreadable_page_keeps_its_data(miner, config, tmp_path, capsys):
+    (tmp_path / "docs" / "index.md").write_text("---\ntitle: [\n---\n")
+    data = update(miner, config, "docs/index.md")
+    assert data["docs"]["index"]["title"] == "Index"
+    assert "DefaultDocumentationMiner: could not read docs/index.md" in (
+        capsys.readouterr().out
+    )
+
+
+@pytest.fixture
+def modules(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / "docs_base.py").write_text(
+        "class Base:\n    def run(self):\n        '''Runs'''\n"
+    )
+    (tmp_path / "docs_derived.py").write_text(
+        "from docs_base import Base\n\nclass Derived(Base):\n    '''Derived'''\n"
+    )
+    yield tmp_path
+    for name in ("docs_base", "docs_derived"):
+        sys.modules.pop(name, None)
+        documentation._modules.pop(name, None)
+    documentation._symbols.clear()
+
+
+def touch(path, mtime):
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_symbols_are_rendered_again_when_the_bases_change(modules):
+    calls = []
+
+    def render(module, name):
+        calls.append(name)
+        return module.__dict__[name].__doc__
+
+    directive = documentation.DocumentationDirective()
+    touch(modules / "docs_base.py", 10**18)
+    assert directive.render_symbol(render, "docs_derived.Derived") == "Derived"
+    assert directive.render_symbol(render, "docs_derived.Derived") == "Derived"
+    assert calls == ["Derived"]
+    touch(modules / "docs_base.py", 2 * 10**18)
+    directive.render_symbol(render, "docs_derived.Derived")
+    assert calls == ["Derived", "Derived"]
+    # the module of the symbol is reloaded when it changes
+    (modules / "docs_derived.py").write_text(
+        "from docs_base import Base\n\nclass Derived(Base):\n    '''Changed'''\n"
+    )
+    touch(modules / "docs_derived.py", 3 * 10**18)
+    assert directive.render_symbol(render, "docs_derived.Derived") == "Changed"
+
+
+def test_documentation_module_is_not_reloaded():
+    modules, symbols = documentation._modules, documentation._symbols
+    module, mtime = documentation.load_module(documentation.__name__)
+    assert module is documentation
+    assert mtime == documentation.module_mtime(documentation)
+    assert documentation._modules is modules
+    assert documentation._symbols is symbols
+    html = documentation.DocumentationDirective().render_symbol(
+        documentation.DocumentationDirective().function_to_html,
+        "kart.ext.documentation.load_module",
+    )
+    assert "function kart.ext.documentation.load_module(name: str)" in html
+    assert documentation._symbols is symbols
+
+
+def test_kart_modules_are_not_reloaded():
+    for module in (utils, markdown):
+        assert documentation.load_module(module.__name__)[0] is module
+    directive = documentation.DocumentationDirective()
+    html = directive.render_symbol(directive.class_to_html, "kart.utils.KartMap")
+    assert "class kart.utils.KartMap" in html
+    assert utils.KartMap is KartMap
+    assert not [name for name in documentation._modules if name.startswith("kart")]
+
+
+def test_documented_modules_are_watched(miner, modules, config):
+    directive = documentation.DocumentationDirective()
+    directive.render_symbol(directive.class_to_html, "docs_derived.Derived")
+    directive.render_symbol(directive.function_to_html, "kart.utils.digest")
+    # the docs and the directory of the modules, but not kart
+    assert miner._observer.watched == ["docs", str(modules)]
+    miner.stop_watching(config)
+    (modules / "docs_other.py").write_text("def run():\n    '''Runs'''\n")
+    directive.render_symbol(directive.function_to_html, "docs_other.run")
+    assert len(miner._observer.watched) == 2
+    sys.modules.pop("docs_other", None)
+    documentation._modules.pop("docs_other", None)
+
+
+def test_changed_docstrings_are_rendered_with_a_new_map(modules):
+    def render(map):
+        context = {"config": {"code_highlighting": {}}, "url": map.url}
+        return documentation.markdown_to_html(
+            context, ".. class:: docs_derived.Derived"
+        )
+
+    map = KartMap(site_url="")
+    touch(modules / "docs_derived.py", 10**18)
+    assert "<p>Derived</p>" in render(map)
+    (modules / "docs_derived.py").write_text(
+        "from docs_base import Base\n\nclass Derived(Base):\n    '''Changed'''\n"
+    )
+    touch(modules / "docs_derived.py", 2 * 10**18)
+    # the watcher of the sources creates a new map, the old one stays cached
+    assert "<p>Derived</p>" in render(map)
+    assert "<p>Changed</p>" in render(KartMap(site_url=""))
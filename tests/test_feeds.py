@@ -0,0 +1,93 @@
+import re
+from datetime import date
+
+from kart.mappers import DefaultCollectionMapper, DefaultFeedMapper
+from kart.renderers import DefaultFeedRenderer
+from kart.utils import KartDict, KartMap
+
+CONFIG = {"name": "Blog", "timezone": "Europe/Rome"}
+
+
+def create_site():
+    posts = KartDict()
+    for i in range(1, 8):
+        posts[f"post{i}"] = {
+            "slug": f"post{i}",
+            "title": f"Post {i}",
+            "date": date(2021, 1, i),
+            "tags": ["odd"] if i % 2 else ["even"],
+        }
+    posts["post3"]["description"] = "Third post"
+    tags = KartDict(odd={"slug": "odd"}, even={"slug": "even"})
+    return KartDict(posts=posts, tags=tags)
+
+
+def create_map(mapper, site):
+    map = KartMap(site_url="https://example.org")
+    map.update(DefaultCollectionMapper("posts").map(CONFIG, site))
+    map.update(mapper.map(CONFIG, site))
+    return map
+
+
+def render_feeds(mapper, renderer=None):
+    site = create_site()
+    map = create_map(mapper, site)
+    renderer = renderer or DefaultFeedRenderer()
+    feeds = {}
+    for slug, page in map.items():
+        if page["renderer"] == renderer.name:
+            feeds[slug] = renderer.render_single(page, CONFIG, site, map)
+    return feeds
+
+
+def titles(feed):
+    return re.findall(r"<entry>.*?<title>(.*?)</title>", feed)
+
+
+def test_feed_entries_are_sorted_by_date():
+    feed = render_feeds(DefaultFeedMapper(collections=["posts"]))["feed"]
+    assert titles(feed) == [f"Post {i}" for i in range(7, 0, -1)]
+    assert "<id>https://example.org/posts/post3/</id>" in feed
+    assert "<summary>Third post</summary>" in feed
+    assert "<updated>2021-01-03T12:00:00+01:00</updated>" in feed
+    assert '<link href="https://example.org/posts/post3/" rel="alternate"/>' in feed
+
+
+def test_feed_limit_and_taxonomies():
+    mapper = DefaultFeedMapper(
+        collections=["posts"], limit=2, per_collection=True, taxonomies=["tags"]
+    )
+    feeds = render_feeds(mapper)
+    assert set(feeds) == {"feed", "feed.posts", "feed.tags.odd", "feed.tags.even"}
+    assert titles(feeds["feed"]) == ["Post 7", "Post 6"]
+    assert titles(feeds["feed.posts"]) == ["Post 7", "Post 6"]
+    assert titles(feeds["feed.tags.odd"]) == ["Post 7", "Post 5"]
+    assert titles(feeds["feed.tags.even"]) == ["Post 6", "Post 4"]
+
+
+def test_entries_are_cached():
+    renderer = DefaultFeedRenderer()
+    mapper = DefaultFeedMapper(collections=["posts"], taxonomies=["tags"])
+    first = render_feeds(mapper, renderer)
+    # every entry is in the main feed and in the feed of its tag
+    assert renderer.entry_cache.misses == 7
+    assert renderer.entry_cache.hits == 7
+    assert titles(render_feeds(mapper, renderer)["feed"]) == titles(first["feed"])
+    assert renderer.entry_cache.misses == 7
+
+
+def test_entry_cache_is_saved(tmp_path):
+    config = {**CONFIG, "cache_location": str(tmp_path / ".kart-cache")}
+    site = create_site()
+    map = create_map(DefaultFeedMapper(collections=["posts"]), site)
+    DefaultFeedRenderer(cache=True).render(config, site, map, str(tmp_path / "a"))
+    renderer = DefaultFeedRenderer(cache=True)
+    renderer.render(config, site, map, str(tmp_path / "b"))
+    assert renderer.entry_cache.misses == 0
+    feed = (tmp_path / "b" / "atom.xml").read_text()
+    assert titles(feed) == [f"Post {i}" for i in range(7, 0, -1)]
+    # without cache nothing is written
+    DefaultFeedRenderer().render(config, site, map, str(tmp_path / "c"))
+    assert [x.name for x in (tmp_path / ".kart-cache").iterdir()] == [
+        "default_feed_renderer.json"
+    ]
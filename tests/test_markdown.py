@@ -0,0 +1,70 @@
+import gc
+import weakref
+
+from jinja2 import Environment
+
+from kart.ext.markdown import html_cache, markdown_to_html, markdown_to_toc
+from kart.utils import KartMap, LazyContent, template_cache
+
+CONFIG = {"code_highlighting": {"style": "default", "noclasses": True}}
+
+
+def render(content, map):
+    env = Environment()
+    env.filters["html"] = markdown_to_html
+    template = env.from_string("{{ content | html }}")
+    return template.render(content=content, url=map.url, config=CONFIG)
+
+
+def create_map():
+    map = KartMap(site_url="https://example.org")
+    map["about"] = {"url": "/about/"}
+    return map
+
+
+def test_html_is_cached_per_map():
+    html_cache.clear()
+    map = create_map()
+    html = render("[About](about)", map)
+    assert html == '<p><a href="https://example.org/about/">About</a></p>\n'
+    hits = html_cache.hits
+    assert render("[About](about)", map) == html
+    assert html_cache.hits == hits + 1
+    other = create_map()
+    other["about"] = {"url": "/about-us/"}
+    assert "about-us" in render("[About](about)", other)
+
+
+def test_cache_does_not_keep_the_map_alive():
+    map = create_map()
+    render("[About](about) *alive*", map)
+    reference = weakref.ref(map)
+    del map
+    gc.collect()
+    assert reference() is None
+
+
+def test_caches_do_not_keep_the_contents():
+    html_cache.clear()
+    content = "*" + "long content " * 100 + "*"
+    render(content, create_map())
+    assert len(html_cache) == 1
+    assert not any(content in repr(key) for key in html_cache.data)
+    assert not any(content in repr(key) for key in template_cache.data)
+
+
+def test_toc():
+    toc = markdown_to_toc("# Title\ntext\n## Section")
+    assert toc == [
+        {"title": "Title", "id": "title", "level": 1},
+        {"title": "Section", "id": "section", "level": 2},
+    ]
+
+
+def test_lazy_content_is_converted_like_a_string(tmp_path):
+    file = tmp_path / "page.md"
+    file.write_text("---\n---\n[About](about) *text*\n")
+    content = LazyContent(file, 7, file.stat().st_size - 7, file.stat().st_mtime_ns)
+    map = create_map()
+    assert render(content, map) == render(str(content), map)
+    assert "<em>text</em>" in render(content, map)
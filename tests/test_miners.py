@@ -0,0 +1,145 @@
+import os
+
+import pytest
+
+from kart import Kart
+from kart.ext.documentation import DefaultDocumentationMiner
+from kart.miners import DefaultPageMiner
+from kart.utils import FileCache, LazyContent, split_front_matter
+
+
+def create_config(tmp_path, workers=1, processes=False, cache=False, lazy=False):
+    return {
+        "cache_location": str(tmp_path / "cache"),
+        "mining": {"workers": workers, "processes": processes, "lazy_content": lazy},
+        "miner_cache": {"enabled": cache, "verify_hash": False},
+        "dev_mode": False,
+    }
+
+
+@pytest.fixture
+def pages(tmp_path):
+    directory = tmp_path / "pages"
+    directory.mkdir()
+    for i in range(12):
+        (directory / f"page{i:02}.md").write_text(
+            f"---\ntitle: Page {i}\n---\nContent of page {i}\n"
+        )
+    (directory / "notes.txt").write_text("not a markdown file")
+    return directory
+
+
+def test_split_front_matter():
+    assert split_front_matter("---\na: 1\n---\nbody\n---\n") == (
+        "\na: 1\n",
+        "\nbody\n---\n",
+    )
+    assert split_front_matter("---\na: 1\n") == ("\na: 1\n", "")
+    with pytest.raises(ValueError):
+        split_front_matter("no front matter")
+
+
+@pytest.mark.parametrize("workers, processes", [(1, False), (4, False), (2, True)])
+def test_parallel_mining(pages, tmp_path, workers, processes):
+    miner = DefaultPageMiner(directory=str(pages))
+    miner.read_data(create_config(tmp_path, workers, processes))
+    assert sorted(miner.data.keys()) == [f"page{i:02}" for i in range(12)]
+    page = miner.data["page03"]
+    assert page["title"] == "Page 3"
+    assert page["content"].strip() == "Content of page 3"
+
+
+class Observer:
+    def schedule(self, *args, **kwargs):
+        pass
+
+
+@pytest.mark.parametrize(
+    "miner_class, key",
+    [(DefaultPageMiner, "pages"), (DefaultDocumentationMiner, "docs")],
+)
+def test_watching_with_processes(pages, tmp_path, miner_class, key):
+    config = create_config(tmp_path, workers=2, processes=True)
+    miner = miner_class(directory=str(pages))
+    miner.start_watching(config, Observer())
+    (pages / "page03.md").write_text("---\ntitle: Changed\n---\n")
+    miner.file_changed(pages / "page03.md")
+    miner.file_changed(pages / "page04.md")
+    data = miner.collect(config)[key]
+    assert data["page03"]["title"] == "Changed"
+    assert data["page04"]["title"] == "Page 4"
+
+
+def test_parallel_results_keep_the_order_of_the_files(pages, tmp_path):
+    miner = DefaultPageMiner(directory=str(pages))
+    files = sorted(pages.glob("*.md"), reverse=True)
+    serial = miner.parse_files(files, create_config(tmp_path))
+    parallel = miner.parse_files(files, create_config(tmp_path, workers=4))
+    assert [list(x) for x in parallel] == [list(x) for x in serial]
+    assert list(serial[0]) == ["page11"]
+
+
+def test_lazy_mining_matches_eager_mining(pages, tmp_path):
+    eager = DefaultPageMiner(directory=str(pages))
+    eager.read_data(create_config(tmp_path))
+    lazy = DefaultPageMiner(directory=str(pages))
+    lazy.read_data(create_config(tmp_path, lazy=True))
+    page = lazy.data["page03"]
+    assert isinstance(page["content"], LazyContent)
+    assert page == eager.data["page03"]
+
+
+def test_lazy_content_reads_the_changed_file(pages, tmp_path):
+    miner = DefaultPageMiner(directory=str(pages))
+    miner.read_data(create_config(tmp_path, lazy=True))
+    content = miner.data["page05"]["content"]
+    assert content.strip() == "Content of page 5"
+    (pages / "page05.md").write_text("---\ntitle: Page 5\n---\nNew content\n")
+    os.utime(pages / "page05.md", ns=(0, content.mtime + 1))
+    miner.read_data(create_config(tmp_path, lazy=True))
+    assert miner.data["page05"]["content"].strip() == "New content"
+
+
+def test_file_cache_skips_unchanged_files(pages, tmp_path, monkeypatch):
+    config = create_config(tmp_path, cache=True)
+    miner = DefaultPageMiner(directory=str(pages))
+    miner.read_data(config)
+    parsed = []
+    collect_single_file = DefaultPageMiner.collect_single_file
+
+    def record(self, file, config):
+        parsed.append(file.name)
+        return collect_single_file(self, file, config)
+
+    monkeypatch.setattr(DefaultPageMiner, "collect_single_file", record)
+    (pages / "page05.md").write_text("---\ntitle: Changed\n---\nNew content\n")
+    miner.read_data(config)
+    assert parsed == ["page05.md"]
+    assert miner.data["page05"]["title"] == "Changed"
+    assert miner.data["page04"]["title"] == "Page 4"
+    # the cache is valid only for the same dev_mode
+    miner.read_data({**config, "dev_mode": True})
+    assert len(parsed) == 13
+
+
+def test_file_cache_is_disabled_by_default(pages, tmp_path):
+    kart = Kart(config={"cache_location": str(tmp_path / "cache")})
+    kart.check_config()
+    miner = DefaultPageMiner(directory=str(pages))
+    miner.read_data({**kart.config, "dev_mode": False})
+    assert not (tmp_path / "cache" / "miners.sqlite").exists()
+
+
+def test_file_cache_verifies_the_hash(tmp_path):
+    file = tmp_path / "file.md"
+    file.write_text("one")
+    cache = FileCache(tmp_path / "cache.sqlite", verify_hash=True)
+    signature = cache.signature(file)
+    cache.set("namespace", file, signature, {"data": 1})
+    cache.commit()
+    assert cache.get("namespace", file, signature) == (True, {"data": 1})
+    assert cache.get("other", file, signature) == (False, None)
+    stat = file.stat()
+    file.write_text("two")
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cache.get("namespace", file, cache.signature(file)) == (False, None)
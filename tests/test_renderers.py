@@ -0,0 +1,199 @@
+import json
+import pickle
+from pathlib import Path
+
+import pytest
+from jinja2 import Environment
+
+from kart.ext.markdown import highlight_cache
+from kart.renderers import DefaultSiteRenderer, PrecompiledLoader, read_site_keys
+from kart.utils import KartDict, KartMap, MapEntry
+
+
+@pytest.fixture
+def templates(tmp_path):
+    (tmp_path / "templates").mkdir()
+    (tmp_path / "templates" / "page.html").write_text(
+        "{{ page.title }}|{{ site.menu | join(',') }}|{{ url('about') }}"
+    )
+    (tmp_path / "templates" / "code.html").write_text("{{ page.content | html }}")
+    return str(tmp_path / "templates")
+
+
+def create_map(count):
+    map = KartMap(site_url="https://example.org")
+    for i in range(count):
+        map[f"page.{i}"] = {
+            "url": f"/page/{i}/",
+            "data": {"title": f"Page {i}"},
+            "template": "page.html",
+            "renderer": "default_site_renderer",
+        }
+    map["about"] = {
+        "url": "/about/",
+        "data": {"title": "About"},
+        "template": "page.html",
+        "renderer": "default_site_renderer",
+    }
+    return map
+
+
+def render(renderer, tmp_path, keys=None):
+    config = {
+        "cache_location": str(tmp_path / "cache"),
+        "code_highlighting": {"style": "default", "noclasses": True, "cache": True},
+        "verbose": False,
+    }
+    site = KartDict(menu=["a", "b"])
+    build = tmp_path / "site"
+    renderer.render(config, site, create_map(20), build, keys=keys)
+    return {
+        str(x.relative_to(build)): x.read_text()
+        for x in build.rglob("*")
+        if x.is_file()
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 7])
+def test_parallel_rendering_matches_serial(templates, tmp_path, chunk_size):
+    serial = render(DefaultSiteRenderer(template_folder=templates), tmp_path / "1")
+    renderer = DefaultSiteRenderer(
+        template_folder=templates, process_count=2, chunk_size=chunk_size
+    )
+    assert render(renderer, tmp_path / "2") == serial
+    assert len(serial) == 21
+    assert serial["page/3/index.html"] == "Page 3|a,b|https://example.org/about/"
+    assert sum(pages for pages, _ in renderer.worker_stats.values()) == 21
+
+
+def test_parallel_rendering_of_some_keys(templates, tmp_path):
+    renderer = DefaultSiteRenderer(template_folder=templates, process_count=2)
+    output = render(renderer, tmp_path, keys=["page.1", "page.2"])
+    assert set(output) == {"page/1/index.html", "page/2/index.html"}
+
+
+def test_parallel_rendering_with_initializer(templates, tmp_path, monkeypatch):
+    # workers that do not inherit the memory of the parent receive the site once
+    monkeypatch.setattr("multiprocessing.get_start_method", lambda: "spawn")
+    serial = render(DefaultSiteRenderer(template_folder=templates), tmp_path / "1")
+    renderer = DefaultSiteRenderer(template_folder=templates, process_count=2)
+    assert render(renderer, tmp_path / "2") == serial
+
+
+def test_workers_send_back_the_highlighted_code(templates, tmp_path):
+    highlight_cache.clear()
+    map = create_map(0)
+    for i in range(4):
+        map[f"code.{i}"] = {
+            "url": f"/code/{i}/",
+            "data": {"content": f"```python\nx = {i}\n```"},
+            "template": "code.html",
+            "renderer": "default_site_renderer",
+        }
+    config = {
+        "cache_location": str(tmp_path / "cache"),
+        "code_highlighting": {"style": "default", "noclasses": True, "cache": True},
+        "verbose": False,
+    }
+    renderer = DefaultSiteRenderer(
+        template_folder=templates, process_count=2, chunk_size=1
+    )
+    renderer.render(config, KartDict(), map, tmp_path / "site")
+    assert {x[0] for x in highlight_cache.data} == {f"x = {i}\n" for i in range(4)}
+
+
+def test_tojson_filter_serializes_map_entries(tmp_path):
+    (tmp_path / "page.html").write_text("{{ map['about'] | tojson }}")
+    map = KartMap(site_url="https://example.org")
+    map["about"] = MapEntry("/about/", {}, "page.html", "default_site_renderer")
+    renderer = DefaultSiteRenderer(template_folder=str(tmp_path))
+    html = renderer.env.get_template("page.html").render(map=map)
+    assert html.startswith('{"data": {}, "renderer": "default_site_renderer"')
+
+
+def test_templates_are_cached_as_bytecode(templates, tmp_path, monkeypatch):
+    renderer = DefaultSiteRenderer(template_folder=templates, bytecode_cache=True)
+    output = render(renderer, tmp_path)
+    assert list((tmp_path / "cache" / "templates").iterdir())
+    # a new renderer loads the template from the bytecode cache
+    compile = Environment.compile
+    compiled = []
+
+    def record(self, *args, **kwargs):
+        compiled.append(args)
+        return compile(self, *args, **kwargs)
+
+    monkeypatch.setattr(Environment, "compile", record)
+    renderer = DefaultSiteRenderer(template_folder=templates, bytecode_cache=True)
+    assert render(renderer, tmp_path) == output
+    assert compiled == []
+
+
+def test_bytecode_cache_is_opt_in(templates, tmp_path):
+    render(DefaultSiteRenderer(template_folder=templates), tmp_path)
+    assert not (tmp_path / "cache" / "templates").exists()
+    renderer = DefaultSiteRenderer(
+        template_folder=templates, bytecode_cache=str(tmp_path / "bytecode")
+    )
+    render(renderer, tmp_path)
+    assert list((tmp_path / "bytecode").iterdir())
+
+
+def test_precompiled_templates(templates, tmp_path):
+    serial = render(DefaultSiteRenderer(template_folder=templates), tmp_path / "1")
+    target = tmp_path / "compiled"
+    DefaultSiteRenderer(template_folder=templates).compile_templates(str(target))
+    checksums = json.loads((target / "checksums.json").read_text())
+    assert set(checksums) == {"page.html", "code.html"}
+    renderer = DefaultSiteRenderer(
+        template_folder=templates, compiled_templates=str(target), bytecode_cache=False
+    )
+    assert isinstance(renderer.env.loader, PrecompiledLoader)
+    assert render(renderer, tmp_path / "2") == serial
+    # the templates changed after the compilation are loaded from their source
+    (Path(templates) / "page.html").write_text("changed")
+    renderer = DefaultSiteRenderer(
+        template_folder=templates, compiled_templates=str(target), bytecode_cache=False
+    )
+    assert render(renderer, tmp_path / "3")["page/3/index.html"] == "changed"
+
+
+def test_missing_precompiled_templates_are_ignored(templates, tmp_path):
+    renderer = DefaultSiteRenderer(
+        template_folder=templates, compiled_templates=str(tmp_path / "missing")
+    )
+    assert not isinstance(renderer.env.loader, PrecompiledLoader)
+
+
+def test_renderer_can_be_pickled(templates, tmp_path):
+    renderer = DefaultSiteRenderer(template_folder=templates)
+    copy = pickle.loads(pickle.dumps(renderer))
+    assert render(copy, tmp_path / "1") == render(renderer, tmp_path / "2")
+
+
+@pytest.mark.parametrize(
+    "source, keys",
+    [
+        ("{{ page.title }}", set()),
+        (
+            "{% for x in site.pages %}{{ site['tags'][x] }}{% endfor %}",
+            {"pages", "tags"},
+        ),
+        ("{{ site[name] }}", None),
+        ("{{ site | tojson }}", None),
+        ("{% set s = site %}{{ s.pages }}", None),
+    ],
+)
+def test_read_site_keys(source, keys):
+    assert read_site_keys(Environment().parse(source)) == keys
+
+
+def test_site_keys_include_the_referenced_templates(tmp_path):
+    (tmp_path / "base.html").write_text("{{ site.menu }}{% block body %}{% endblock %}")
+    (tmp_path / "page.html").write_text(
+        "{% extends 'base.html' %}{% block body %}{{ site.tags }}{% endblock %}"
+    )
+    (tmp_path / "dynamic.html").write_text("{% include page.template %}")
+    renderer = DefaultSiteRenderer(template_folder=str(tmp_path))
+    assert renderer.inspect_template("page.html")[1] == {"menu", "tags"}
+    assert renderer.inspect_template("dynamic.html")[1] is None
@@ -0,0 +1,203 @@
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+from watchdog.events import FileModifiedEvent, FileSystemEventHandler
+
+from kart import Kart, mappers
+from kart.renderers import DefaultFileRenderer
+from kart.server import KartObserver, KartRequestHandler
+from kart.utils import KartDict, KartMap, RouteTable
+
+
+class Handler:
+    """Records the response of DefaultFileRenderer.serve()"""
+
+    def __init__(self, headers={}):
+        self.headers = headers
+        self.status = None
+        self.response_headers = {}
+        self.wfile = io.BytesIO()
+
+    def send_response(self, status):
+        self.status = status
+
+    def send_header(self, name, value):
+        self.response_headers[name] = value
+
+    def end_headers(self):
+        pass
+
+
+class TextRenderer(DefaultFileRenderer):
+    def __init__(self, name="text_renderer"):
+        self.name = name
+        self.content_type = "text/plain"
+        self.rendered = []
+
+    def render_single(self, page, config, site, map):
+        self.rendered.append(page["url"])
+        return page["data"]["text"]
+
+
+def create_map(text="hello"):
+    map = KartMap(site_url="http://localhost")
+    map["index"] = {
+        "url": "/",
+        "data": {"text": text},
+        "template": None,
+        "renderer": "text_renderer",
+    }
+    return map
+
+
+def test_serve_caches_the_rendered_pages():
+    renderer = TextRenderer()
+    map = create_map()
+    handler = Handler()
+    renderer.serve(handler, map["index"], {}, KartDict(), map)
+    assert handler.status == 200
+    assert handler.wfile.getvalue() == b"hello"
+    etag = handler.response_headers["ETag"]
+
+    handler = Handler({"If-None-Match": etag})
+    renderer.serve(handler, map["index"], {}, KartDict(), map)
+    assert handler.status == 304
+    assert handler.wfile.getvalue() == b""
+    assert renderer.rendered == ["/"]
+
+    # every new map starts with an empty cache
+    map = create_map("changed")
+    handler = Handler({"If-None-Match": etag})
+    renderer.serve(handler, map["index"], {}, KartDict(), map)
+    assert handler.status == 200
+    assert handler.wfile.getvalue() == b"changed"
+    assert renderer.rendered == ["/", "/"]
+
+
+@pytest.fixture
+def server():
+    renderer = TextRenderer()
+    pages = {}
+    for i in range(20):
+        pages[f"page.{i}"] = {
+            "url": f"/page/{i}/",
+            "data": {"text": f"page {i}"},
+            "template": None,
+            "renderer": "text_renderer",
+        }
+    kart = Kart(mappers=[mappers.ManualMapper(pages)], renderers=[renderer])
+    kart.check_config()
+    kart.mine_data()
+    kart.create_map()
+    kart._site, kart._map, kart._routes = kart.site, kart.map, RouteTable(kart.map)
+    kart.renderer_dict = {renderer.name: renderer}
+
+    class RequestHandler(KartRequestHandler):
+        action = kart.serve_page
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", renderer
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_concurrent_requests(server):
+    url, renderer = server
+
+    def get(i):
+        with urlopen(f"{url}/page/{i % 20}/", timeout=10) as response:
+            return response.read().decode(), response.headers["ETag"]
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(get, range(60)))
+    assert [x[0] for x in results] == [f"page {i % 20}" for i in range(60)]
+    # pages rendered at the same time by two threads may be rendered twice
+    assert 20 <= len(renderer.rendered) < 60
+
+    request = Request(f"{url}/page/3/", headers={"If-None-Match": results[3][1]})
+    with pytest.raises(HTTPError) as error:
+        urlopen(request, timeout=10)
+    assert error.value.code == 304
+
+
+class RecordingHandler(FileSystemEventHandler):
+    def __init__(self):
+        self.events = []
+
+    def on_any_event(self, event):
+        self.events.append(event.src_path)
+
+
+def watch_directory(tmp_path, action, **kwargs):
+    handler = RecordingHandler()
+    observer = KartObserver(action, **kwargs)
+    watch = observer.schedule(handler, str(tmp_path))
+    return observer, watch, handler
+
+
+def test_observer_runs_the_action_once_per_batch(tmp_path):
+    batches = []
+    observer, watch, handler = watch_directory(
+        tmp_path, lambda: batches.append(len(handler.events))
+    )
+    for i in range(20):
+        observer.event_queue.put((FileModifiedEvent(f"file{i}"), watch))
+    observer.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.2)
+    finally:
+        observer.stop()
+        observer.join()
+    # every event was dispatched before the single update
+    assert batches == [20]
+
+
+def test_observer_waits_at_most_max_delay(tmp_path):
+    observer, watch, handler = watch_directory(
+        tmp_path, lambda: None, debounce=0.05, max_delay=0.2
+    )
+    stop = threading.Event()
+
+    def produce():
+        i = 0
+        while not stop.is_set():
+            observer.event_queue.put((FileModifiedEvent(f"file{i}"), watch))
+            i += 1
+            time.sleep(0.01)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    try:
+        start = time.monotonic()
+        observer.dispatch_batch()
+        elapsed = time.monotonic() - start
+    finally:
+        stop.set()
+        producer.join()
+    # events kept arriving, but the batch ended after max_delay
+    assert 0.2 <= elapsed < 1
+    assert len(handler.events) > 1
+
+
+def test_observer_batch_ends_when_no_event_arrives(tmp_path):
+    observer, watch, handler = watch_directory(tmp_path, lambda: None, debounce=0.05)
+    observer.event_queue.put((FileModifiedEvent("file"), watch))
+    start = time.monotonic()
+    observer.dispatch_batch()
+    assert time.monotonic() - start < 0.5
+    assert handler.events == ["file"]
@@ -0,0 +1,82 @@
+import gzip
+from datetime import date
+
+from kart.renderers import DefaultSitemapRenderer
+from kart.utils import KartMap
+
+
+def create_map(count):
+    map = KartMap(site_url="https://example.org")
+    for i in range(count):
+        map[f"page.{i}"] = {
+            "url": f"/page/{i}/",
+            "data": {"date": date(2021, 1, i + 1)} if i == 0 else {},
+            "template": "page.html",
+            "renderer": "default_site_renderer",
+        }
+    map["static"] = {
+        "url": "/static/*",
+        "data": {},
+        "template": "",
+        "renderer": "default_site_renderer",
+    }
+    map["sitemap"] = {
+        "url": "/sitemap.xml",
+        "data": {},
+        "template": "",
+        "renderer": "default_sitemap_renderer",
+    }
+    return map
+
+
+def render(renderer, count, build):
+    renderer.render({}, {}, create_map(count), build)
+    return sorted(x.name for x in build.iterdir())
+
+
+def test_single_sitemap(tmp_path):
+    assert render(DefaultSitemapRenderer(), 2, tmp_path) == ["sitemap.xml"]
+    assert (tmp_path / "sitemap.xml").read_text() == (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        "<url><loc>https://example.org/page/0/</loc>"
+        "<lastmod>2021-01-01</lastmod></url>"
+        "<url><loc>https://example.org/page/1/</loc></url>"
+        "</urlset>"
+    )
+
+
+def test_sharded_sitemap(tmp_path):
+    renderer = DefaultSitemapRenderer(shard_size=2, gzip=True)
+    assert render(renderer, 5, tmp_path) == [
+        "sitemap-1.xml.gz",
+        "sitemap-2.xml.gz",
+        "sitemap-3.xml.gz",
+        "sitemap.xml",
+    ]
+    index = (tmp_path / "sitemap.xml").read_text()
+    assert "<sitemapindex" in index
+    assert "<loc>https://example.org/sitemap-3.xml.gz</loc>" in index
+    shard = gzip.decompress((tmp_path / "sitemap-3.xml.gz").read_bytes()).decode()
+    assert "<loc>https://example.org/page/4/</loc>" in shard
+
+
+def test_stale_shards_are_removed(tmp_path):
+    (tmp_path / "sitemap-notes.xml").write_text("not a shard")
+    renderer = DefaultSitemapRenderer(shard_size=2)
+    assert len(render(renderer, 5, tmp_path)) == 5
+    assert render(renderer, 3, tmp_path) == [
+        "sitemap-1.xml",
+        "sitemap-2.xml",
+        "sitemap-notes.xml",
+        "sitemap.xml",
+    ]
+    renderer.gzip = True
+    assert render(renderer, 3, tmp_path) == [
+        "sitemap-1.xml.gz",
+        "sitemap-2.xml.gz",
+        "sitemap-notes.xml",
+        "sitemap.xml",
+    ]
+    assert render(renderer, 1, tmp_path) == ["sitemap-notes.xml", "sitemap.xml"]
+    assert "<urlset" in (tmp_path / "sitemap.xml").read_text()
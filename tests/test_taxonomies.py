@@ -0,0 +1,49 @@
+from kart.mappers import DefaultTaxonomyMapper
+from kart.modifiers import TaxonomyIndexer
+from kart.utils import KartDict, taxonomy_index
+
+CONFIG = {"pagination": {"per_page": 2}}
+
+
+def create_site():
+    posts = KartDict()
+    posts["a"] = {"slug": "a", "tags": ["python", "web"]}
+    posts["b"] = {"slug": "b", "tags": "python"}
+    posts["c"] = {"slug": "c", "tags": ["python", "python"]}
+    posts["d"] = {"slug": "d"}
+    posts["e"] = {"slug": "e", "tags": ["web"]}
+    tags = KartDict()
+    for slug in ("python", "web", "empty"):
+        tags[slug] = {"slug": slug, "title": slug.title()}
+    return KartDict(posts=posts, tags=tags)
+
+
+def test_taxonomy_index():
+    site = create_site()
+    index = taxonomy_index(site["posts"], "tags")
+    assert {x: [y["slug"] for y in index[x]] for x in index.keys()} == {
+        "python": ["a", "b", "c"],
+        "web": ["a", "e"],
+    }
+
+
+def test_indexer_stores_the_index_in_the_site():
+    site = create_site()
+    TaxonomyIndexer("posts", "tags").modify(CONFIG, site)
+    assert [x["slug"] for x in site["posts_by_tags"]["web"]] == ["a", "e"]
+
+
+def test_mapper_with_and_without_the_index():
+    mapper = DefaultTaxonomyMapper("posts", "tags")
+    site = create_site()
+    without_index = mapper.map(CONFIG, site)
+    TaxonomyIndexer("posts", "tags").modify(CONFIG, site)
+    assert mapper.map(CONFIG, site) == without_index
+
+    def objects(slug):
+        return [x["slug"] for x in without_index[slug]["data"]["paginator"]["objects"]]
+
+    assert objects("tags.python.1") == ["a", "b"]
+    assert objects("tags.python.2") == ["c"]
+    assert objects("tags.empty.1") == []
+    assert without_index["tags.python.2"]["url"] == "/tags/python/2/"
@@ -0,0 +1,91 @@
+from pathlib import Path
+
+import pytest
+
+from kart import Kart, mappers, miners, modifiers
+
+
+class Observer:
+    def schedule(self, *args, **kwargs):
+        pass
+
+
+class CountingMapper(mappers.DefaultCollectionMapper):
+    calls = 0
+
+    def map(self, config, site):
+        self.calls += 1
+        return super().map(config, site)
+
+
+def write_page(directory, name, title):
+    (directory / f"{name}.md").write_text(f"---\ntitle: {title}\n---\n{title}\n")
+
+
+@pytest.fixture
+def kart(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for directory in ("pages", "collections/posts"):
+        (tmp_path / directory).mkdir(parents=True)
+    write_page(tmp_path / "pages", "about", "About")
+    write_page(tmp_path / "collections" / "posts", "first", "First")
+
+    def count_views(map, site):
+        for entry in map.values():
+            entry["data"]["views"] = entry["data"].get("views", 0) + 1
+
+    kart = Kart(
+        miners=[miners.DefaultPageMiner(), miners.DefaultCollectionMiner("posts")],
+        mappers=[mappers.DefaultPageMapper(), CountingMapper("posts")],
+        map_modifiers=[modifiers.RuleMapModifier([count_views])],
+        config={"serving": True, "dev_mode": False},
+    )
+    kart.check_config()
+    for miner in kart.miners:
+        miner.start_watching(kart.config, Observer())
+    kart.update_data()
+    return kart
+
+
+def test_only_changed_keys_are_mapped_again(kart, tmp_path):
+    pages, posts = kart.miners
+    counting = kart.mappers[1]
+    assert counting.calls == 1
+    snapshot = kart._site["posts"]
+    write_page(tmp_path / "pages", "about", "About us")
+    pages.file_changed(Path("pages/about.md"))
+    kart.update_data()
+    assert kart.changed_keys() == {"pages"}
+    assert counting.calls == 1
+    assert kart._map["about"]["data"]["title"] == "About us"
+    # unchanged keys share the snapshot of the previous update
+    assert kart._site["posts"] is snapshot
+
+    write_page(tmp_path / "collections" / "posts", "second", "Second")
+    posts.file_changed(Path("collections/posts/second.md"))
+    kart.update_data()
+    assert kart.changed_keys() == {"posts"}
+    assert counting.calls == 2
+    assert "posts.second" in kart._map
+
+    kart.update_data()
+    assert kart.changed_keys() == set()
+
+
+def test_map_modifiers_do_not_change_the_reused_entries(kart):
+    for _ in range(3):
+        kart.update_data()
+    assert kart._map["posts.first"]["data"]["views"] == 1
+    assert "views" not in kart._site["posts"]["first"]
+
+
+def test_keys_of_the_content_modifiers_change_with_the_miners(kart, tmp_path):
+    kart.content_modifiers = [modifiers.CollectionSorter("posts", "title")]
+    kart.update_data()
+    pages = kart.miners[0]
+    write_page(tmp_path / "pages", "about", "About us")
+    pages.file_changed(Path("pages/about.md"))
+    kart.update_data()
+    assert kart.changed_keys() == {"pages", "posts"}
+    kart.update_data()
+    assert kart.changed_keys() == set()
@@ -0,0 +1,311 @@
+import copy
+import errno
+import filecmp
+import fnmatch
+import gzip
+import json
+import os
+import sys
+
+import pytest
+
+from kart import utils
+from kart.utils import (
+    KartMap,
+    LazyContent,
+    LRUCache,
+    MapEntry,
+    OutputWriter,
+    RouteTable,
+    copy_directory,
+    copy_entry,
+    copy_file,
+    digest,
+    exchange_paths,
+    json_default,
+    read_front_matter,
+)
+
+
+def test_lru_cache_evicts_the_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_cache_save_and_load(tmp_path):
+    cache = LRUCache()
+    cache.set(("code", "python"), "<pre>code</pre>")
+    cache.set("key", "value")
+    cache.save(tmp_path / "cache.json")
+    loaded = LRUCache()
+    loaded.load(tmp_path / "cache.json")
+    assert loaded.data == cache.data
+    assert loaded.get(("code", "python")) == "<pre>code</pre>"
+
+
+def test_lru_cache_ignores_invalid_files(tmp_path):
+    cache = LRUCache()
+    cache.load(tmp_path / "missing.json")
+    (tmp_path / "invalid.json").write_bytes(b"\x80\x04invalid")
+    cache.load(tmp_path / "invalid.json")
+    assert len(cache) == 0
+
+
+def test_lru_cache_recording():
+    cache = LRUCache()
+    cache.set("before", 1)
+    cache.start_recording()
+    cache.set("during", 2)
+    assert cache.stop_recording() == {"during": 2}
+    cache.set("after", 3)
+    assert cache.stop_recording() == {}
+
+
+def test_map_entry_behaves_like_a_dict():
+    entry = MapEntry("/about/", {"title": "About"}, "page.html", "renderer", x=1)
+    expected = {
+        "url": "/about/",
+        "data": {"title": "About"},
+        "template": "page.html",
+        "renderer": "renderer",
+        "x": 1,
+    }
+    assert entry == expected
+    assert entry.to_dict() == expected
+    assert type(entry.to_dict()) is dict
+    assert repr(entry) == repr(expected)
+    assert digest(entry) == digest(expected)
+    entry["y"] = 2
+    del entry["x"]
+    assert list(entry) == ["url", "data", "template", "renderer", "y"]
+    with pytest.raises(KeyError):
+        del entry["url"]
+
+
+def test_map_entry_without_template():
+    entry = MapEntry("/", None, None, "renderer")
+    assert entry["template"] is None
+    assert entry.get("x") is None
+
+
+def test_map_entry_to_json():
+    entry = MapEntry("/", {"title": "Home"}, "page.html", "renderer")
+    with pytest.raises(TypeError):
+        json.dumps(entry)
+    assert json.loads(json.dumps(entry, default=json_default)) == entry.to_dict()
+    with pytest.raises(TypeError):
+        json.dumps(object(), default=json_default)
+
+
+def test_map_entry_copy():
+    entry = MapEntry("/", {"title": "Home"}, "page.html", "renderer", x=1)
+    for duplicate in (entry.copy(), copy.copy(entry)):
+        assert duplicate == entry
+        duplicate["x"] = 2
+        assert entry["x"] == 1
+        assert duplicate["data"] is entry["data"]
+    duplicate = copy_entry(entry)
+    duplicate["data"]["title"] = "Other"
+    assert entry["data"]["title"] == "Home"
+
+
+def test_read_front_matter(tmp_path):
+    file = tmp_path / "page.md"
+    file.write_bytes(b"---\ntitle: \xc3\xa8\n---\nbody\n")
+    assert read_front_matter(file) == ("\ntitle: \u00e8\n", 17)
+    assert read_front_matter(file, chunk_size=2) == ("\ntitle: \u00e8\n", 17)
+    file.write_text("no front matter")
+    with pytest.raises(ValueError):
+        read_front_matter(file)
+
+
+def test_lazy_content(tmp_path):
+    file = tmp_path / "page.md"
+    file.write_bytes(b"---\na: 1\n---\nfirst line\r\nsecond line\n")
+    stat = file.stat()
+    content = LazyContent(file, 12, stat.st_size - 12, stat.st_mtime_ns)
+    text = "\nfirst line\nsecond line\n"
+    assert str(content) == text
+    assert content == text and content == LazyContent(file, 12, 25, stat.st_mtime_ns)
+    assert hash(content) == hash(text)
+    assert len(content) == len(text)
+    assert content[1:6] == "first"
+    assert "second" in content
+    assert content.split() == text.split()
+    assert "x" + content == "x" + text and content + "x" == text + "x"
+    assert repr(content) == f"LazyContent({str(file)!r}, 12, 25, {stat.st_mtime_ns})"
+
+
+def test_lazy_content_digest_changes_with_the_file(tmp_path):
+    file = tmp_path / "page.md"
+    file.write_text("---\n---\nbody\n")
+    mtime = file.stat().st_mtime_ns
+    content = LazyContent(file, 7, 6, mtime)
+    assert digest(content) == digest(LazyContent(file, 7, 6, mtime))
+    assert digest(content) != digest(LazyContent(file, 7, 6, mtime + 1))
+
+
+def test_route_table():
+    map = KartMap()
+    map["index"] = {"url": "/"}
+    map["posts"] = {"url": "/posts/*"}
+    map["drafts"] = {"url": "/posts/draft-?/"}
+    map["all"] = {"url": "*"}
+    map["literal"] = {"url": "/posts/*/"}
+    routes = RouteTable(map)
+    assert routes.resolve("/") == "index"
+    # wildcards are tried in map order, but a url is first looked up literally
+    assert routes.resolve("/posts/draft-1/") == "posts"
+    assert routes.resolve("/posts/*/") == "literal"
+    assert routes.resolve("/about/") == "all"
+    assert RouteTable(KartMap({"index": {"url": "/"}})).resolve("/about/") is None
+
+
+def test_route_table_matches_like_fnmatch():
+    patterns = ["/a/*/b/", "/a/?/", "/[ab]/*", "/c.d/*", "/e+f/*"]
+    map = KartMap({f"p{i}": {"url": x} for i, x in enumerate(patterns)})
+    routes = RouteTable(map)
+    urls = ["/a/x/b/", "/a/x/", "/a/xy/", "/b/x", "/c/x", "/c.d/x", "/cxd/x", "/e+f/"]
+    for url in urls:
+        expected = next(
+            (f"p{i}" for i, x in enumerate(patterns) if fnmatch.fnmatch(url, x)), None
+        )
+        assert routes.resolve(url) == expected
+
+
+def test_copy_directory(tmp_path):
+    source = tmp_path / "source"
+    (source / "css").mkdir(parents=True)
+    (source / "css" / "style.css").write_text("body {}")
+    (source / "index.txt").write_text("index")
+    linked = tmp_path / "linked"
+    linked.mkdir()
+    (linked / "image.svg").write_text("<svg/>")
+    (source / "images").symlink_to(linked)
+    destination = tmp_path / "destination"
+    assert copy_directory(source, destination) == (18, 0)
+    assert (destination / "css" / "style.css").read_text() == "body {}"
+    assert (destination / "images" / "image.svg").read_text() == "<svg/>"
+    assert not (destination / "images").is_symlink()
+    # files already up to date are skipped
+    assert copy_directory(source, destination) == (0, 18)
+    (source / "index.txt").write_text("changed")
+    assert copy_directory(source, destination) == (7, 13)
+    assert (destination / "index.txt").read_text() == "changed"
+
+
+def test_copy_directory_with_hard_links(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "file.txt").write_text("content")
+    copy_directory(source, tmp_path / "destination", hardlink=True)
+    copied = tmp_path / "destination" / "file.txt"
+    assert copied.stat().st_ino == (source / "file.txt").stat().st_ino
+
+
+def test_copy_missing_directory(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        copy_directory(tmp_path / "missing", tmp_path / "destination")
+
+
+def test_copy_file_compares_the_content_once(tmp_path, monkeypatch):
+    source = tmp_path / "source.txt"
+    destination = tmp_path / "destination.txt"
+    source.write_text("content")
+    destination.write_text("content")
+    os.utime(source, ns=(10**18, 10**18))
+    compared = []
+    cmp = filecmp.cmp
+
+    def record(*args, **kwargs):
+        compared.append(args)
+        return cmp(*args, **kwargs)
+
+    monkeypatch.setattr(filecmp, "cmp", record)
+    assert not copy_file(source, destination)
+    assert destination.stat().st_mtime_ns == 10**18
+    assert not copy_file(source, destination)
+    assert len(compared) == 1
+
+
+def test_reflink_is_disabled_only_by_unsupported_filesystems(tmp_path, monkeypatch):
+    fcntl = pytest.importorskip("fcntl")
+    source = tmp_path / "source.txt"
+    source.write_text("content")
+    errors = []
+
+    def ioctl(*args):
+        errors.append(args)
+        raise OSError(error_code, "ioctl failed")
+
+    monkeypatch.setattr(fcntl, "ioctl", ioctl)
+    monkeypatch.setattr(utils, "_reflink_unsupported", set())
+    error_code = errno.EXDEV
+    assert not utils.reflink(source, tmp_path / "a.txt")
+    assert not utils.reflink(source, tmp_path / "b.txt")
+    assert len(errors) == 2
+    error_code = errno.EOPNOTSUPP
+    assert not utils.reflink(source, tmp_path / "c.txt")
+    assert not utils.reflink(source, tmp_path / "d.txt")
+    assert len(errors) == 3
+    assert not (tmp_path / "d.txt").exists()
+
+
+def test_exchange_paths_fails_on_other_platforms(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, "platform", "win32")
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    assert not exchange_paths(tmp_path / "a", tmp_path / "b")
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_output_writer(tmp_path, workers):
+    with OutputWriter(workers, max_pending=2) as writer:
+        for i in range(20):
+            writer.write(tmp_path / f"dir{i % 3}" / f"{i}.html", f"page {i} é")
+    assert (tmp_path / "dir1" / "4.html").read_text(encoding="utf-8") == "page 4 é"
+    assert sorted(x.name for x in tmp_path.rglob("*")) == sorted(
+        [f"dir{i}" for i in range(3)] + [f"{i}.html" for i in range(20)]
+    )
+
+
+def test_output_writer_breaks_hard_links(tmp_path):
+    previous = tmp_path / "previous.html"
+    previous.write_text("previous")
+    os.link(previous, tmp_path / "page.html")
+    with OutputWriter() as writer:
+        writer.write(tmp_path / "page.html", "new")
+    assert previous.read_text() == "previous"
+    assert (tmp_path / "page.html").read_text() == "new"
+
+
+def test_output_writer_raises_the_first_error(tmp_path):
+    (tmp_path / "file").write_text("not a directory")
+    with pytest.raises(OSError):
+        with OutputWriter(workers=2) as writer:
+            writer.write(tmp_path / "page.html", "ok")
+            writer.write(tmp_path / "file" / "dir" / "page.html", "error")
+    assert (tmp_path / "page.html").read_text() == "ok"
+
+
+def test_output_writer_stream_keeps_the_previous_file(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_text("previous")
+
+    def chunks():
+        yield "partial"
+        raise ValueError("rendering failed")
+
+    with OutputWriter() as writer:
+        with pytest.raises(ValueError):
+            writer.write_stream(path, chunks())
+        writer.write_stream(tmp_path / "sitemap.xml.gz", iter(["<a/>"]), compress=True)
+    assert path.read_text() == "previous"
+    assert sorted(x.name for x in tmp_path.iterdir()) == ["page.html", "sitemap.xml.gz"]
+    assert gzip.decompress((tmp_path / "sitemap.xml.gz").read_bytes()) == b"<a/>"